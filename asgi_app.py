@@ -0,0 +1,353 @@
+"""
+ASGI serving mode for the lesson API.
+
+The Gemini-bound routes are served by coroutines that use the async Firestore
+client and generate_content_async, so one worker can hold hundreds of
+in-flight LLM calls instead of one per thread. Every other route, and CORS
+preflight, is handed to the Flask app in main.py, so the route contract and
+the create_response envelope are the same in both modes.
+
+Run with:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 8080
+"""
+import asyncio
+import copy
+import json
+import logging
+import os
+import traceback
+
+from asgiref.wsgi import WsgiToAsgi
+
+import main
+from main import create_response
+from llm_gateway import LLMUnavailableError
+from metrics import registry as metrics_registry, server_timing_header, span
+from singleflight import single_flight
+from serialization import MIN_COMPRESS_BYTES, compress_body
+from startup import LazyModule, LazyProxy, LazyResource, prewarm
+
+logger = logging.getLogger(__name__)
+
+
+def init_async_firestore():
+    """Async Firestore client on the same Firebase app main.py initializes."""
+    main.firebase_app_resource.get()
+    from firebase_admin import firestore_async
+    return firestore_async.client()
+
+
+firestore_async = LazyModule('firebase_admin.firestore_async')
+async_db_resource = LazyResource('firestore_async', init_async_firestore)
+async_db = LazyProxy(async_db_resource)
+
+
+# Like main.find_lesson_by_ref, the lesson_cache copy is the leader's to keep
+@single_flight(name='find_lesson_by_ref_async', copy_result=copy.deepcopy)
+async def find_lesson_by_ref_async(lesson_ref, country, curriculum, grade, level, subject):
+    """Async counterpart of main.find_lesson_by_ref, sharing its lesson cache."""
+    try:
+        doc_path = main.lesson_doc_path(country, curriculum, grade, level, subject, lesson_ref)
+        lesson_data = main.lesson_cache.get(doc_path)
+
+        if lesson_data is None:
+            logger.info(f"Attempting to fetch lesson at path: {doc_path}")
+            with span('firestore.read'):
+                doc = await async_db.document(doc_path).get()
+            if not doc.exists:
+                logger.error(f"Document not found at path: {doc_path}")
+                raise ValueError(f'No lesson found for ref: {lesson_ref}')
+            lesson_data = doc.to_dict() or {}
+            main.compiled_lessons.note_loaded(doc_path, lesson_data)
+            main.lesson_cache.set(doc_path, lesson_data)
+
+        # Add missing fields if they don't exist
+        lesson_data.setdefault('lessonRef', lesson_ref)
+        lesson_data.setdefault('subject', subject)
+        lesson_data.setdefault('gradeLevel', grade)
+
+        return doc_path, lesson_data
+
+    except Exception as e:
+        logger.error(f"Error finding lesson: {str(e)}")
+        raise ValueError(f'Error retrieving lesson: {str(e)}')
+
+
+# ===== ASYNC ROUTES =====
+async def process_interaction(data):
+    try:
+        student_id = data.get('student_id')
+        lesson_ref = data.get('lesson_ref')
+        session_id = data.get('session_id')
+        interaction_data = data.get('interaction_data', {})
+        interaction_duration = interaction_data.get('duration', 0)  # In minutes
+
+        if not all([student_id, lesson_ref, session_id]):
+            return create_response(False, 'Missing required fields', status_code=400)
+
+        # Shares the WSGI app's write-behind buffer; only a session's first update reads Firestore
+        with span('session_state'):
+            new_time_spent, total_duration = await asyncio.to_thread(
+                main.session_states.add_time_spent, session_id, max(interaction_duration, 0)
+            )
+
+        engagement_rate = main.calculate_engagement(new_time_spent, total_duration)
+
+        interaction_doc, analysis_update = main.build_interaction_writes(
+            student_id, lesson_ref, interaction_data, engagement_rate
+        )
+        analysis_ref = async_db.collection('lesson_analysis').document(
+            main.lesson_analysis_id(student_id, lesson_ref)
+        )
+        interaction_ref = analysis_ref.collection('interactions').document(interaction_doc['interaction_id'])
+
+        @firestore_async.async_transactional
+        async def write(transaction):
+            analysis = (await analysis_ref.get(transaction=transaction)).to_dict() or {}
+            transaction.create(interaction_ref, interaction_doc)
+            transaction.set(analysis_ref, {**analysis_update, **main.analysis_averages(analysis, interaction_data)},
+                            merge=True)
+
+        with span('firestore.write'):
+            await write(async_db.transaction())
+
+        main.enqueue_bloom_classification(student_id, lesson_ref, interaction_data)
+        return create_response(True, "Interaction processed successfully", {
+            'interaction_id': interaction_doc['interaction_id'],
+            'engagement_rate': engagement_rate
+        })
+
+    except Exception as e:
+        logger.error(f"Full error details: {traceback.format_exc()}")
+        return create_response(False, str(e), status_code=500)
+
+
+async def ai_tutor(data):
+    try:
+        student_id = data.get('student_id')
+        question = data.get('question')
+        lesson_path = data.get('lesson_path')
+
+        if not all([student_id, question, lesson_path]):
+            return create_response(False, 'Missing required fields', status_code=400)
+
+        response = await main.model.generate_content_async(
+            main.build_tutor_prompt(question, lesson_path),
+            endpoint='ai-tutor', use_cache=data.get('use_cache', True)
+        )
+        explanation = response.text if response else "No response generated."
+
+        return create_response(True, 'Response generated successfully', {'explanation': explanation})
+    except LLMUnavailableError as e:
+        return main.llm_unavailable_response(e)
+    except Exception as e:
+        logger.error(f"Full error details: {traceback.format_exc()}")
+        return create_response(False, str(e), status_code=500)
+
+
+async def generate_summary(data):
+    try:
+        analytics_data = data.get('analytics_data')
+
+        if not analytics_data:
+            return create_response(False, 'Missing analytics data', status_code=400)
+
+        response = await main.model.generate_content_async(
+            main.build_summary_prompt(analytics_data),
+            endpoint='generate-summary', use_cache=data.get('use_cache', True)
+        )
+        summary = response.text if response else "No summary generated."
+
+        return create_response(True, 'Summary generated successfully', {'summary': summary})
+    except LLMUnavailableError as e:
+        return main.llm_unavailable_response(e)
+    except Exception as e:
+        logger.error(f"Full error details: {traceback.format_exc()}")
+        return create_response(False, str(e), status_code=500)
+
+
+async def generate_blooms_summary(data):
+    try:
+        bloom_data = data.get('bloom_data')
+
+        if not bloom_data:
+            return create_response(False, 'Missing Bloom\'s data', status_code=400)
+
+        response = await main.model.generate_content_async(
+            main.build_blooms_summary_prompt(bloom_data),
+            endpoint='generate-blooms-summary', use_cache=data.get('use_cache', True)
+        )
+        summary = response.text if response else "No summary generated."
+
+        return create_response(True, 'Bloom\'s summary generated successfully', {'summary': summary})
+    except LLMUnavailableError as e:
+        return main.llm_unavailable_response(e)
+    except Exception as e:
+        logger.error(f"Full error details: {traceback.format_exc()}")
+        return create_response(False, str(e), status_code=500)
+
+
+async def generate_lesson_plan(data):
+    try:
+        params = main.parse_lesson_plan_request(data)
+
+        try:
+            lesson_path, lesson_data = await find_lesson_by_ref_async(
+                params['lessonRef'], params['country'], params['curriculum'],
+                params['grade'], params['level'], params['subject']
+            )
+            if not lesson_data:
+                return create_response(False, "Lesson document not found", status_code=404)
+        except Exception as e:
+            logger.error(f"Firestore error: {str(e)}")
+            return create_response(False, "Database error", status_code=500)
+
+        if data.get('use_cache', True):
+            # Usually an in-process cache hit; a miss is one Firestore read
+            lesson_plan = await asyncio.to_thread(main.lookup_lesson_plan_template, lesson_path, lesson_data, params)
+            if lesson_plan:
+                return create_response(True, "Lesson plan generated successfully", {"lesson_plan": lesson_plan})
+
+        prompt = main.build_lesson_plan_prompt(
+            lesson_data, params['lessonRef'], params['studentId'], params['learningObjectives'],
+            params['country'], params['curriculum'], params['grade'], params['subject'],
+            lesson_path=lesson_path
+        )
+
+        try:
+            logger.info("Generating lesson plan with Gemini")
+            gemini_response = await main.model.generate_content_async(
+                prompt,
+                request_options={'timeout': main.GEMINI_TIMEOUT},
+                endpoint='generate-lesson-plan',
+                use_cache=data.get('use_cache', True)
+            )
+
+            if not gemini_response.text:
+                return create_response(False, "Empty response from AI", status_code=500)
+
+            return create_response(True, "Lesson plan generated successfully", {"lesson_plan": gemini_response.text})
+
+        except LLMUnavailableError as e:
+            return main.llm_unavailable_response(e)
+        except Exception as e:
+            logger.error(f"Gemini Error: {str(e)}")
+            return create_response(False, "AI service unavailable", status_code=503)
+
+    except ValueError as e:
+        logger.error(f"Validation error: {str(e)}")
+        return create_response(False, str(e), status_code=400)
+
+    except Exception as e:
+        logger.exception(f"Unexpected error: {str(e)}")
+        return create_response(False, "Internal server error", status_code=500)
+
+
+ASYNC_ROUTES = {
+    '/process-interaction': process_interaction,
+    '/ai-tutor': ai_tutor,
+    '/generate-summary': generate_summary,
+    '/generate-blooms-summary': generate_blooms_summary,
+    '/generate-lesson-plan': generate_lesson_plan
+}
+
+
+# ===== ASGI APPLICATION =====
+class LessonASGIApp:
+    """
+    Dispatches POSTs on async routes to their coroutine handlers and
+    everything else to the wrapped WSGI app.
+    """
+
+    def __init__(self, routes, wsgi_app):
+        self.routes = routes
+        self.fallback = WsgiToAsgi(wsgi_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+
+        handler = None
+        if scope['type'] == 'http' and scope['method'] == 'POST':
+            handler = self.routes.get(scope['path'])
+        if handler is None:
+            await self.fallback(scope, receive, send)
+            return
+
+        token = metrics_registry.start_trace(scope['path'])
+        status_code = 500
+        try:
+            body = await _read_body(receive)
+            try:
+                data = json.loads(body) if body else None
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                response = create_response(False, 'Invalid JSON data', status_code=400)
+            else:
+                response = await handler(data)
+            body, status_code, headers = response
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            if main.RESPONSE_COMPRESSION and len(body) >= MIN_COMPRESS_BYTES:
+                with span('compress'):
+                    body, encoding = compress_body(body, _header(scope, b'accept-encoding'), main.RESPONSE_COMPRESSION)
+                headers = {**headers, 'Vary': 'Accept-Encoding'}
+                if encoding:
+                    headers['Content-Encoding'] = encoding
+        finally:
+            trace, elapsed = metrics_registry.finish_trace(token, status_code)
+        if main.SERVER_TIMING_ENABLED:
+            headers = {**headers, 'Server-Timing': server_timing_header(trace, elapsed)}
+        await _send_response(send, body, status_code, headers)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if os.getenv('STARTUP_PREWARM', 'false').lower() == 'true':
+                    # Off the event loop: client setup is blocking
+                    await asyncio.to_thread(
+                        prewarm, main.db_resource, main.gemini_resource, async_db_resource
+                    )
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await asyncio.to_thread(main.session_states.stop)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def _read_body(receive):
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    return b''.join(chunks)
+
+
+def _header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+async def _send_response(send, body, status_code, headers):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    raw_headers = [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in headers.items()]
+    # Match the flask_cors configuration in main.py
+    raw_headers.append((b'access-control-allow-origin', b'*'))
+    raw_headers.append((b'content-length', str(len(body)).encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status_code, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+app = LessonASGIApp(ASYNC_ROUTES, main.app)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="localhost", port=8080)
@@ -0,0 +1,111 @@
+"""
+Concurrent throughput of the sync (Flask) and async (ASGI) serving modes.
+
+Gemini is replaced by a stub that sleeps for a fixed latency, so the numbers
+show how many in-flight LLM calls each mode can hold, not Gemini speed.
+The sync mode gets a fixed pool of worker threads, like a gthread worker on
+Cloud Run; the async mode runs every request on one event loop.
+
+    python benchmarks/async_serving.py --requests 200 --threads 8 --latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import main  # noqa: E402
+import asgi_app  # noqa: E402
+
+PAYLOAD = {
+    'student_id': 'bench-student',
+    'question': 'Why is the sky blue?',
+    'lesson_path': 'countries/NG/curriculums/NERDC/grades/JSS1/levels/1/subjects/Science/lessonRef/SCI-001',
+    'use_cache': False
+}
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """Stands in for GenerativeModel with a fixed response latency."""
+
+    model_name = 'stub'
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(self.latency)
+        return StubResponse('stub explanation')
+
+    async def generate_content_async(self, prompt, **kwargs):
+        await asyncio.sleep(self.latency)
+        return StubResponse('stub explanation')
+
+
+def run_sync(total_requests, threads):
+    client = main.app.test_client()
+
+    def one_request(_):
+        response = client.post('/ai-tutor', json=PAYLOAD)
+        assert response.status_code == 200, response.data
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one_request, range(total_requests)))
+    return time.perf_counter() - start
+
+
+async def _asgi_post(path, payload):
+    body = json.dumps(payload).encode('utf-8')
+    scope = {'type': 'http', 'method': 'POST', 'path': path, 'headers': [], 'query_string': b''}
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi_app.app(scope, receive, send)
+    return sent[0]['status']
+
+
+async def _run_async(total_requests):
+    statuses = await asyncio.gather(*(_asgi_post('/ai-tutor', PAYLOAD) for _ in range(total_requests)))
+    assert all(status == 200 for status in statuses), statuses
+
+
+def run_async(total_requests):
+    start = time.perf_counter()
+    asyncio.run(_run_async(total_requests))
+    return time.perf_counter() - start
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8, help='worker threads in sync mode')
+    parser.add_argument('--latency', type=float, default=0.5, help='stub Gemini latency in seconds')
+    args = parser.parse_args()
+
+    main.model.model = StubModel(args.latency)
+
+    sync_elapsed = run_sync(args.requests, args.threads)
+    async_elapsed = run_async(args.requests)
+
+    print(f"{args.requests} requests, stub latency {args.latency:.2f}s")
+    print(f"sync  ({args.threads} threads): {sync_elapsed:7.2f}s  {args.requests / sync_elapsed:8.1f} req/s")
+    print(f"async (1 event loop): {async_elapsed:7.2f}s  {args.requests / async_elapsed:8.1f} req/s")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,104 @@
+"""
+Request-thread CPU spent on logging, before and after structured logging.
+
+Each simulated request logs what a lesson request logs today: the lesson
+document, the Gemini prompt, the constructed response and one INFO line.
+
+  before      basicConfig(DEBUG) with eager f-strings, written synchronously
+  after       configure_logging(INFO) with lazy, truncated %-arguments
+  after-debug configure_logging(DEBUG), showing what truncation alone saves
+
+Output goes to os.devnull, so the numbers are formatting cost, not I/O.
+
+    python benchmarks/logging_overhead.py --requests 2000
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from structured_logging import configure_logging, truncated  # noqa: E402
+
+logger = logging.getLogger('benchmark')
+
+
+def make_lesson(sections=12):
+    return {
+        'title': 'Photosynthesis',
+        'key_concepts': ['chlorophyll', 'light energy', 'glucose', 'carbon dioxide'],
+        'sections': [
+            {
+                'title': f'Section {index}',
+                'duration': 5,
+                'content': 'Plants convert light energy into chemical energy. ' * 40,
+                'interactive_element': 'diagram'
+            }
+            for index in range(sections)
+        ],
+        'metadata': {'difficulty_level': 'intermediate', 'estimated_duration': 60}
+    }
+
+
+def request_before(lesson, prompt, response):
+    logger.debug(f"Lesson data: {lesson}")
+    logger.info(f"Sending prompt to Gemini: {prompt}")
+    logger.debug(f"Constructed response: {response}")
+    logger.info(f"Lesson plan generated for {lesson['title']}")
+
+
+def request_after(lesson, prompt, response):
+    logger.debug("Lesson data: %s", truncated(lesson))
+    logger.debug("Sending prompt to Gemini (%d chars): %s", len(prompt), truncated(prompt, 500))
+    logger.debug("Constructed response: %s", truncated(response))
+    logger.info(f"Lesson plan generated for {lesson['title']}")
+
+
+def run(handler_setup, request, total_requests, lesson, prompt, response):
+    listener = handler_setup()
+    start = time.thread_time()
+    for _ in range(total_requests):
+        request(lesson, prompt, response)
+    elapsed = time.thread_time() - start
+    if listener is not None:
+        listener.stop()
+    return elapsed / total_requests * 1e6
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--sections', type=int, default=12, help='sections in the logged lesson')
+    args = parser.parse_args()
+
+    lesson = make_lesson(args.sections)
+    prompt = f"Create a lesson plan from this content: {lesson}"
+    response = {'success': True, 'message': 'Lesson plan generated', 'data': lesson}
+    devnull = open(os.devnull, 'w')
+
+    def before_setup():
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        logging.basicConfig(level=logging.DEBUG, stream=devnull,
+                            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        return None
+
+    modes = [
+        ('before', before_setup, request_before),
+        ('after', lambda: configure_logging('INFO', stream=devnull), request_after),
+        ('after-debug', lambda: configure_logging('DEBUG', stream=devnull), request_after),
+    ]
+    results = {name: run(setup, request, args.requests, lesson, prompt, response)
+               for name, setup, request in modes}
+
+    print(f"{args.requests} requests, lesson of {len(str(lesson))} chars")
+    for name, per_request_us in results.items():
+        saved = (1 - per_request_us / results['before']) * 100
+        print(f"{name:12s} {per_request_us:9.1f} us/request on the request thread  ({saved:5.1f}% saved)")
+
+
+if __name__ == "__main__":
+    main_benchmark()
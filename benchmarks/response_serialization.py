@@ -0,0 +1,103 @@
+"""
+Serialization and compression cost of typical lesson responses.
+
+The payloads mirror what /initialize-lesson and /generate-lesson-plan
+return: the enhanced lesson, the lesson state with timestamps, and the
+prompt. Every installed serializer backend is timed on each payload,
+followed by each available compression encoding.
+
+    python benchmarks/response_serialization.py --iterations 500
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from serialization import COMPRESSORS, SERIALIZERS  # noqa: E402
+
+
+def make_lesson(sections):
+    return {
+        'title': 'Photosynthesis',
+        'key_concepts': ['chlorophyll', 'light energy', 'glucose', 'carbon dioxide'],
+        'sections': [
+            {
+                'title': f'Section {index}',
+                'duration': 5,
+                'content': 'Plants convert light energy into chemical energy stored in glucose. ' * 20,
+                'interactive_element': 'diagram',
+                'tools': ['virtual lab', 'graph plotter']
+            }
+            for index in range(sections)
+        ],
+        'quizzes': [
+            {'question': f'Question {index}?', 'options': ['a', 'b', 'c', 'd'], 'answer': 'a'}
+            for index in range(10)
+        ],
+        'metadata': {'difficulty_level': 'intermediate', 'estimated_duration': 60, 'tags': ['biology']}
+    }
+
+
+def make_response(sections):
+    lesson = make_lesson(sections)
+    now = datetime.now(timezone.utc)
+    return {
+        'success': True,
+        'message': 'Lesson initialized successfully',
+        'timestamp': now.isoformat(),
+        'data': {
+            'session_id': 'b8f3c6e0-7d7a-4d1e-9a55-2f0c1d8e9a10',
+            'lesson': lesson,
+            'state': {
+                'current_section': 0,
+                'time_spent': 0,
+                'total_duration': 60,
+                'created_at': now,
+                'last_modified': now
+            },
+            'prompt': f"Create an interactive lesson from: {lesson}"
+        }
+    }
+
+
+def time_call(func, payload, iterations):
+    func(payload)  # warm up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = func(payload)
+    return (time.perf_counter() - start) / iterations * 1e6, result
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=500)
+    args = parser.parse_args()
+
+    serializers = {}
+    # stdlib first, so the speedups are relative to it
+    for name, serializer_class in sorted(SERIALIZERS.items(), key=lambda item: item[0] != 'json'):
+        try:
+            serializers[name] = serializer_class()
+        except ImportError:
+            print(f"{name}: not installed, skipped")
+
+    for label, sections in (('small', 3), ('typical', 12), ('large', 40)):
+        payload = make_response(sections)
+        print(f"\n{label} payload ({sections} sections)")
+        baseline = None
+        body = None
+        for name, serializer in serializers.items():
+            per_call_us, body = time_call(serializer.dumps, payload, args.iterations)
+            baseline = baseline or per_call_us
+            print(f"  {name:8s} {per_call_us:9.1f} us  {len(body):8d} bytes  ({baseline / per_call_us:4.1f}x vs json)")
+        for encoding, compress in COMPRESSORS.items():
+            per_call_us, compressed = time_call(compress, body, args.iterations)
+            print(f"  {encoding:8s} {per_call_us:9.1f} us  {len(compressed):8d} bytes  "
+                  f"({len(compressed) / len(body):.0%} of original)")
+
+
+if __name__ == "__main__":
+    main_benchmark()
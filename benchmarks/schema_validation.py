@@ -0,0 +1,83 @@
+"""
+Per-call jsonschema.validate() against the compiled LessonValidator.
+
+Validates the same mix of valid and invalid lessons both ways, the shape of
+a curriculum import, and reports documents per second.
+
+    python benchmarks/schema_validation.py --documents 5000 --invalid-ratio 0.05
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+
+from jsonschema import ValidationError, validate
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from main import LESSON_SCHEMA  # noqa: E402
+from lesson_validation import LessonValidator  # noqa: E402
+
+VALID_LESSON = {
+    'title': 'Photosynthesis',
+    'key_concepts': ['chlorophyll', 'light energy', 'glucose'],
+    'sections': [
+        {'title': 'Introduction', 'duration': 5, 'content': 'Plants make food.', 'interactive_element': 'quiz'},
+        {'title': 'Key Concepts', 'duration': 15, 'content': 'Light reactions.', 'interactive_element': 'diagram'},
+        {'title': 'Conclusion', 'duration': 5, 'content': 'Summary.'}
+    ],
+    'quizzes': [{'question': 'What do plants need?', 'options': ['light', 'salt'], 'answer': 'light'}],
+    'metadata': {'difficulty_level': 'easy', 'estimated_duration': 25, 'tags': ['biology']}
+}
+
+
+def make_documents(count, invalid_ratio):
+    invalid_every = int(1 / invalid_ratio) if invalid_ratio else 0
+    documents = []
+    for index in range(count):
+        lesson = copy.deepcopy(VALID_LESSON)
+        if invalid_every and index % invalid_every == 0:
+            lesson['key_concepts'] = ['only one']
+            lesson['metadata']['difficulty_level'] = 'unknown'
+        documents.append(lesson)
+    return documents
+
+
+def run_per_call(documents):
+    invalid = 0
+    start = time.perf_counter()
+    for document in documents:
+        try:
+            validate(instance=document, schema=LESSON_SCHEMA)
+        except ValidationError:
+            invalid += 1
+    return time.perf_counter() - start, invalid
+
+
+def run_compiled(documents):
+    start = time.perf_counter()
+    validator = LessonValidator(LESSON_SCHEMA)
+    failures = validator.validate_many(documents)
+    return time.perf_counter() - start, len(failures)
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=5000)
+    parser.add_argument('--invalid-ratio', type=float, default=0.05)
+    args = parser.parse_args()
+
+    documents = make_documents(args.documents, args.invalid_ratio)
+    per_call_elapsed, per_call_invalid = run_per_call(documents)
+    compiled_elapsed, compiled_invalid = run_compiled(documents)
+    assert per_call_invalid == compiled_invalid, (per_call_invalid, compiled_invalid)
+
+    print(f"{args.documents} lessons, {compiled_invalid} invalid")
+    print(f"per-call validate(): {per_call_elapsed:7.3f}s  {args.documents / per_call_elapsed:10.0f} docs/s")
+    print(f"LessonValidator:     {compiled_elapsed:7.3f}s  {args.documents / compiled_elapsed:10.0f} docs/s"
+          f"  ({per_call_elapsed / compiled_elapsed:.1f}x)")
+
+
+if __name__ == "__main__":
+    main_benchmark()
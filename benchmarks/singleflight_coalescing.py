@@ -0,0 +1,122 @@
+"""
+Concurrent callers of a coalesced lesson load, each mutating what it gets.
+
+A burst of threads (and then coroutines) asks for the same slow lesson at
+once. Every caller edits its result as soon as it returns, the way routes
+decorate a lesson before serialising it, and checks that it neither sees
+another caller's edits nor leaks its own into theirs. Reports how many
+loads actually ran and the time for the burst.
+
+    python benchmarks/singleflight_coalescing.py --callers 50 --latency 0.2
+"""
+import argparse
+import asyncio
+import copy
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from singleflight import SingleFlight  # noqa: E402
+
+LESSON = {
+    'lessonTitle': 'Photosynthesis',
+    'sections': [{'title': 'Introduction', 'content': 'Plants make food.'}],
+    'metadata': {'tags': ['biology']}
+}
+
+
+def check_and_mutate(lesson, caller):
+    assert lesson == LESSON, f"caller {caller} saw another caller's edits: {lesson}"
+    lesson['sections'].append({'title': f'caller {caller}'})
+    lesson['metadata']['tags'].append(caller)
+    lesson['viewed_by'] = caller
+
+
+def run_threads(callers, latency):
+    flight = SingleFlight('bench-threads', copy_result=copy.deepcopy)
+    barrier = threading.Barrier(callers)
+    errors = []
+
+    def load():
+        time.sleep(latency)
+        return copy.deepcopy(LESSON)
+
+    def one_caller(caller):
+        barrier.wait()
+        try:
+            check_and_mutate(flight.do('lesson', load), caller)
+        except AssertionError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=one_caller, args=(caller,)) for caller in range(callers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return time.perf_counter() - start, flight.stats()
+
+
+async def _run_coroutines(callers, latency):
+    flight = SingleFlight('bench-async', copy_result=copy.deepcopy)
+
+    async def load():
+        await asyncio.sleep(latency)
+        return copy.deepcopy(LESSON)
+
+    async def one_caller(caller):
+        check_and_mutate(await flight.do_async('lesson', load), caller)
+        # Give the other callers a turn before they copy the shared result
+        await asyncio.sleep(0)
+
+    await asyncio.gather(*(one_caller(caller) for caller in range(callers)))
+    return flight.stats()
+
+
+def run_coroutines(callers, latency):
+    start = time.perf_counter()
+    stats = asyncio.run(_run_coroutines(callers, latency))
+    return time.perf_counter() - start, stats
+
+
+async def check_cancelled_leader(followers, latency):
+    """The leader's request going away mid-load must not fail the callers waiting on it."""
+    flight = SingleFlight('bench-cancel', copy_result=copy.deepcopy)
+
+    async def load():
+        await asyncio.sleep(latency)
+        return copy.deepcopy(LESSON)
+
+    leader = asyncio.ensure_future(flight.do_async('lesson', load))
+    await asyncio.sleep(0)
+    waiting = [asyncio.ensure_future(flight.do_async('lesson', load)) for _ in range(followers)]
+    await asyncio.sleep(latency / 2)
+    leader.cancel()
+    results = await asyncio.gather(*waiting, return_exceptions=True)
+    assert leader.cancelled()
+    assert all(result == LESSON for result in results), results
+    assert flight.stats()['executions'] == 1, flight.stats()
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--callers', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds each lesson load takes')
+    args = parser.parse_args()
+
+    print(f"{args.callers} concurrent callers, load latency {args.latency:.2f}s")
+    for label, run in (('threads', run_threads), ('asyncio', run_coroutines)):
+        elapsed, stats = run(args.callers, args.latency)
+        assert stats['executions'] < args.callers, stats
+        print(f"{label:8} {elapsed:6.2f}s  loads={stats['executions']}  coalesced={stats['coalesced']}")
+    asyncio.run(check_cancelled_leader(args.callers - 1, args.latency))
+    print("cancelled leader: every follower got the lesson")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import logging
+import random
+import threading
+from collections import OrderedDict, namedtuple
+
+from serialization import encode_default
+
+logger = logging.getLogger(__name__)
+
+# The lesson fields a lesson version covers: what compiled lessons and the
+# lesson-dependent parts of prompts are built from. Anything else (such as
+# per-request learningObjectives) does not change the version.
+SOURCE_FIELDS = (
+    'title', 'subject', 'topic', 'gradeLevel', 'introduction', 'sections', 'key_concepts', 'examples',
+    'interactiveElements', 'quizzes', 'examContent', 'objectives', 'prerequisites', 'resources',
+    'metadata', 'curriculumAlignment', 'lessonTitle', 'instructionalSteps', 'extensionActivities',
+    'quizzesAndAssessments', 'adaptiveStrategies'
+)
+
+
+class FrozenDict(dict):
+    """A dict that refuses mutation; serializers and readers see a plain dict."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('Compiled lessons are read-only; copy the part you need to change')
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = __ior__ = _readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+class FrozenList(list):
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('Compiled lessons are read-only; copy the part you need to change')
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = reverse = sort = clear = _readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return FrozenList, (list(self),)
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return FrozenList(freeze(item) for item in value)
+    return value
+
+
+def lesson_content_hash(lesson_data):
+    source = {field: lesson_data.get(field) for field in SOURCE_FIELDS}
+    canonical = json.dumps(source, sort_keys=True, default=encode_default, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+CompiledLesson = namedtuple('CompiledLesson', ('lesson_ref', 'lesson_path', 'content_hash', 'payload'))
+
+
+def compile_lesson(lesson_ref, lesson_path, lesson_data, tools, seed='', content_hash=None):
+    """
+    Build the enhanced lesson sessions are started from, without touching
+    lesson_data. Sections without an interactive_element get one from tools,
+    chosen by a generator seeded with seed and the content hash, so the same
+    lesson version always gets the same elements.
+    """
+    content_hash = content_hash or lesson_content_hash(lesson_data)
+    chooser = random.Random(f"{seed}:{content_hash}")
+    metadata = lesson_data.get('metadata') or {}
+
+    sections = []
+    for section in lesson_data.get('sections') or []:
+        if 'interactive_element' not in section:
+            section = {**section, 'interactive_element': chooser.choice(tools)}
+        sections.append(section)
+
+    payload = {
+        'lessonRef': lesson_ref,
+        'title': lesson_data.get('title', 'Untitled Lesson'),
+        'content': {
+            'introduction': lesson_data.get('introduction', ''),
+            'sections': sections,
+            'key_concepts': lesson_data.get('key_concepts', []),
+            'examples': lesson_data.get('examples', [])
+        },
+        'interactiveElements': lesson_data.get('interactiveElements', []),
+        'quizzes': lesson_data.get('quizzes', []),
+        'examContent': lesson_data.get('examContent', []),
+        'objectives': lesson_data.get('objectives', []),
+        'prerequisites': lesson_data.get('prerequisites', []),
+        'resources': lesson_data.get('resources', []),
+        'metadata': {
+            'difficulty_level': metadata.get('difficulty_level', 'intermediate'),
+            'estimated_duration': metadata.get('estimated_duration', 30),
+            'tags': metadata.get('tags', []),
+            'subject': lesson_data.get('subject', ''),
+            'topic': lesson_data.get('topic', ''),
+            'grade_level': lesson_data.get('gradeLevel', ''),
+            'curriculum_alignment': lesson_data.get('curriculumAlignment', {})
+        }
+    }
+    return CompiledLesson(lesson_ref, lesson_path, content_hash, freeze(payload))
+
+
+class CompiledLessonCache:
+    """
+    Compiled lessons by (lesson path, content hash), LRU-bounded. Every
+    session on the same lesson version shares one frozen payload, so there
+    is nothing to copy per request; an edited lesson hashes differently and
+    is compiled afresh. tools_for(subject) returns the interactive tools to
+    assign from.
+
+    Hashing a lesson costs about as much as compiling it, so the loader
+    reports each document it reads from Firestore with note_loaded() and
+    lookups for that path reuse the hash taken then. Those hashes are kept
+    for up to max_entries paths, least recently used first out.
+    """
+
+    def __init__(self, tools_for, seed='', max_entries=512):
+        self.tools_for = tools_for
+        self.seed = seed
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = OrderedDict()  # lesson_path -> content hash of the document last loaded
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def note_loaded(self, lesson_path, lesson_data):
+        """Record the version of a lesson document just read from the database."""
+        content_hash = lesson_content_hash(lesson_data)
+        with self._lock:
+            self._versions[lesson_path] = content_hash
+            self._versions.move_to_end(lesson_path)
+            while len(self._versions) > self.max_entries:
+                self._versions.popitem(last=False)
+        return content_hash
+
+    def version(self, lesson_path, lesson_data):
+        """Content hash of the lesson, as recorded when it was loaded if it was."""
+        with self._lock:
+            content_hash = self._versions.get(lesson_path)
+            if content_hash is not None:
+                self._versions.move_to_end(lesson_path)
+        return content_hash or self.note_loaded(lesson_path, lesson_data)
+
+    def get_or_compile(self, lesson_ref, lesson_path, lesson_data):
+        content_hash = self.version(lesson_path, lesson_data)
+        key = (lesson_path, content_hash)
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+
+        compiled = compile_lesson(
+            lesson_ref, lesson_path, lesson_data, self.tools_for(lesson_data.get('subject', '')),
+            seed=self.seed, content_hash=content_hash
+        )
+        logger.debug(f"Compiled lesson {lesson_path} at version {content_hash[:12]}")
+        with self._lock:
+            # Another thread may have compiled the same version meanwhile; keep the first
+            compiled = self._entries.setdefault(key, compiled)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return compiled
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'versions': len(self._versions),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0
+            }
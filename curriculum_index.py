@@ -0,0 +1,179 @@
+import logging
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ('country', 'curriculum', 'grade', 'level', 'subject')
+
+# Compact, immutable record per lesson; the lesson body stays in Firestore
+LessonEntry = namedtuple('LessonEntry', LEVELS + ('lesson_ref', 'path', 'title', 'topic'))
+
+
+def parse_lesson_doc_path(path):
+    """
+    Split countries/{c}/curriculums/{cu}/grades/{g}/levels/{l}/subjects/{s}/lessonRef/{ref}
+    into its coordinates, or return None if the path has a different shape.
+    """
+    parts = path.strip('/').split('/')
+    expected = ('countries', 'curriculums', 'grades', 'levels', 'subjects', 'lessonRef')
+    if len(parts) != 12 or tuple(parts[0::2]) != expected:
+        return None
+    return dict(zip(LEVELS + ('lesson_ref',), parts[1::2]))
+
+
+class CurriculumIndex:
+    """
+    In-memory index of every lesson in the curriculum hierarchy.
+
+    Lessons are looked up by lesson_ref in O(1) and listed by any prefix of
+    (country, curriculum, grade, level, subject). The index is filled from a
+    collection-group snapshot of all lessonRef documents and kept fresh by
+    the same listener, so serving requests never queries Firestore.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._by_ref = {}   # lesson_ref -> {path: LessonEntry}
+        self._tree = {}     # country -> curriculum -> grade -> level -> subject -> {lesson_ref: LessonEntry}
+        self._ready = threading.Event()
+        self._watch = None
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(entries) for entries in self._by_ref.values())
+
+    def upsert(self, path, data):
+        coords = parse_lesson_doc_path(path)
+        if coords is None:
+            return None
+        entry = LessonEntry(
+            path=path,
+            title=data.get('lessonTitle') or data.get('title', ''),
+            topic=data.get('topic', ''),
+            **coords
+        )
+        with self._lock:
+            self._by_ref.setdefault(entry.lesson_ref, {})[path] = entry
+            node = self._tree
+            for level in LEVELS:
+                node = node.setdefault(getattr(entry, level), {})
+            node[entry.lesson_ref] = entry
+        return entry
+
+    def remove(self, path):
+        coords = parse_lesson_doc_path(path)
+        if coords is None:
+            return
+        with self._lock:
+            entries = self._by_ref.get(coords['lesson_ref'], {})
+            entries.pop(path, None)
+            if not entries:
+                self._by_ref.pop(coords['lesson_ref'], None)
+            # Walk down, then prune empty branches on the way back up
+            nodes = [self._tree]
+            for level in LEVELS:
+                child = nodes[-1].get(coords[level])
+                if child is None:
+                    return
+                nodes.append(child)
+            nodes[-1].pop(coords['lesson_ref'], None)
+            for level, parent in zip(reversed(LEVELS), reversed(nodes[:-1])):
+                if parent[coords[level]]:
+                    break
+                del parent[coords[level]]
+
+    def lookup(self, lesson_ref):
+        """Entry for lesson_ref, or None. If the ref exists under several paths the first path wins."""
+        with self._lock:
+            entries = self._by_ref.get(lesson_ref)
+            if not entries:
+                return None
+            return entries[min(entries)]
+
+    def lookup_all(self, lesson_ref):
+        with self._lock:
+            return [entry for _, entry in sorted(self._by_ref.get(lesson_ref, {}).items())]
+
+    def list_lessons(self, country=None, curriculum=None, grade=None, level=None, subject=None):
+        """
+        Entries under a prefix of the hierarchy, sorted by path. Coordinates
+        must be given outermost first, e.g. country and curriculum and grade.
+        """
+        prefix = [country, curriculum, grade, level, subject]
+        given = [value for value in prefix if value]
+        if prefix[:len(given)] != given:
+            raise ValueError("Prefix must be given outermost first: country, curriculum, grade, level, subject")
+
+        with self._lock:
+            node = self._tree
+            for value in given:
+                node = node.get(value)
+                if node is None:
+                    return []
+            results = []
+            self._collect(node, len(LEVELS) - len(given), results)
+        return sorted(results, key=lambda entry: entry.path)
+
+    def _collect(self, node, depth, results):
+        if depth == 0:
+            results.extend(node.values())
+            return
+        for child in node.values():
+            self._collect(child, depth - 1, results)
+
+    def load(self, documents):
+        """Replace the index contents with (path, data) pairs from a snapshot."""
+        with self._lock:
+            self._by_ref = {}
+            self._tree = {}
+            for path, data in documents:
+                self.upsert(path, data)
+        self._ready.set()
+
+    # ===== FIRESTORE SYNC =====
+    def start(self, db, collection_id='lessonRef'):
+        """
+        Subscribe to every lessonRef collection. The first callback carries
+        the full snapshot and marks the index ready; later callbacks carry
+        only the changes.
+        """
+        if self._watch is not None:
+            return
+        self._watch = db.collection_group(collection_id).on_snapshot(self._on_snapshot)
+
+    def wait_until_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def _on_snapshot(self, snapshots, changes, read_time):
+        try:
+            if not self._ready.is_set():
+                self.load((snapshot.reference.path, snapshot.to_dict() or {}) for snapshot in snapshots)
+                logger.info(f"Curriculum index loaded with {len(self)} lessons")
+                return
+            for change in changes:
+                path = change.document.reference.path
+                if change.type.name == 'REMOVED':
+                    self.remove(path)
+                else:
+                    self.upsert(path, change.document.to_dict() or {})
+        except Exception as e:
+            logger.error(f"Error applying curriculum index update: {e}", exc_info=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'lessons': sum(len(entries) for entries in self._by_ref.values()),
+                'lesson_refs': len(self._by_ref),
+                'countries': len(self._tree)
+            }
@@ -0,0 +1,4 @@
+"""Firestore limits shared by the modules that write in batches."""
+
+# Firestore rejects a batched write of more than 500 operations
+MAX_BATCH_WRITES = 500
@@ -0,0 +1,124 @@
+import math
+
+
+def calculate_engagement(time_spent, total_duration):
+    """Share of the planned lesson duration the student has spent, as a 0-100 percentage."""
+    if not total_duration or total_duration <= 0:
+        return 0
+    return round(min(max(time_spent, 0) / total_duration, 1) * 100, 2)
+
+
+class InteractionAggregate:
+    """
+    Running statistics over a student's interactions with a lesson.
+
+    update() folds in one interaction and merge() combines two aggregates,
+    both in O(1) of the history length, so analytics can combine partial
+    aggregates from many sessions without replaying their interactions.
+    """
+
+    __slots__ = (
+        'count',
+        'response_time_count',
+        'response_time_total',
+        'response_time_sum_sq',
+        'tool_usage',
+        'topics_mastered',
+        'topics_struggled'
+    )
+
+    def __init__(self):
+        self.count = 0
+        self.response_time_count = 0
+        self.response_time_total = 0.0
+        self.response_time_sum_sq = 0.0
+        self.tool_usage = {}
+        self.topics_mastered = set()
+        self.topics_struggled = set()
+
+    def update(self, interaction):
+        self.count += 1
+        response_time = interaction.get('response_time')
+        if isinstance(response_time, (int, float)) and not isinstance(response_time, bool) and response_time >= 0:
+            self.response_time_count += 1
+            self.response_time_total += response_time
+            self.response_time_sum_sq += response_time * response_time
+        tool = interaction.get('tool')
+        if tool:
+            self.tool_usage[tool] = self.tool_usage.get(tool, 0) + 1
+        self.topics_mastered.update(interaction.get('topics_mastered') or [])
+        self.topics_struggled.update(interaction.get('topics_struggled') or [])
+        return self
+
+    def merge(self, other):
+        self.count += other.count
+        self.response_time_count += other.response_time_count
+        self.response_time_total += other.response_time_total
+        self.response_time_sum_sq += other.response_time_sum_sq
+        for tool, uses in other.tool_usage.items():
+            self.tool_usage[tool] = self.tool_usage.get(tool, 0) + uses
+        self.topics_mastered |= other.topics_mastered
+        self.topics_struggled |= other.topics_struggled
+        return self
+
+    @property
+    def avg_response_time(self):
+        if not self.response_time_count:
+            return 0
+        return self.response_time_total / self.response_time_count
+
+    @property
+    def response_time_stddev(self):
+        if not self.response_time_count:
+            return 0
+        mean = self.avg_response_time
+        variance = self.response_time_sum_sq / self.response_time_count - mean * mean
+        return math.sqrt(max(variance, 0))
+
+    def to_document(self):
+        """Absolute field values of the lesson_analysis document, derived fields included."""
+        return {
+            'interaction_count': self.count,
+            'response_time_count': self.response_time_count,
+            'response_time_total': self.response_time_total,
+            'response_time_sum_sq': self.response_time_sum_sq,
+            'avg_response_time': self.avg_response_time,
+            'response_time_stddev': self.response_time_stddev,
+            'tool_usage': dict(self.tool_usage),
+            'topics_mastered': sorted(self.topics_mastered),
+            'topics_struggled': sorted(self.topics_struggled)
+        }
+
+    def to_increments(self):
+        """
+        This aggregate as a delta on the lesson_analysis document, using
+        Increment and ArrayUnion transforms so concurrent writers never
+        read-modify-write. Derived fields such as avg_response_time cannot
+        be written this way; see to_document().
+        """
+        from firebase_admin import firestore
+
+        update = {'interaction_count': firestore.Increment(self.count)}
+        if self.response_time_count:
+            update['response_time_count'] = firestore.Increment(self.response_time_count)
+            update['response_time_total'] = firestore.Increment(self.response_time_total)
+            update['response_time_sum_sq'] = firestore.Increment(self.response_time_sum_sq)
+        if self.tool_usage:
+            update['tool_usage'] = {tool: firestore.Increment(uses) for tool, uses in self.tool_usage.items()}
+        if self.topics_mastered:
+            update['topics_mastered'] = firestore.ArrayUnion(sorted(self.topics_mastered))
+        if self.topics_struggled:
+            update['topics_struggled'] = firestore.ArrayUnion(sorted(self.topics_struggled))
+        return update
+
+    @classmethod
+    def from_document(cls, doc_data):
+        aggregate = cls()
+        aggregate.count = doc_data.get('interaction_count', 0)
+        aggregate.response_time_count = doc_data.get('response_time_count', 0)
+        aggregate.response_time_total = doc_data.get('response_time_total', 0.0)
+        aggregate.response_time_sum_sq = doc_data.get('response_time_sum_sq', 0.0)
+        aggregate.tool_usage = dict(doc_data.get('tool_usage') or {})
+        aggregate.topics_mastered = set(doc_data.get('topics_mastered') or [])
+        aggregate.topics_struggled = set(doc_data.get('topics_struggled') or [])
+        return aggregate
@@ -0,0 +1,91 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+class LessonCache:
+    """
+    In-process read-through cache for lesson documents.
+    Entries are keyed by full Firestore document path, evicted LRU once
+    max_entries is reached and expire after ttl_seconds.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # path -> (expires_at, data)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, path):
+        """Return a copy of the cached document, or None on miss/expiry."""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, data = entry
+            if expires_at <= time.monotonic():
+                del self._entries[path]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(path)
+            self.hits += 1
+        # Callers mutate lesson_data freely, so never hand out the cached object
+        return copy.deepcopy(data)
+
+    def set(self, path, data, ttl_seconds=None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        entry = (time.monotonic() + ttl, copy.deepcopy(data))
+        with self._lock:
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, path, loader):
+        """
+        Read-through lookup: return the cached document for path, calling
+        loader() and caching its result on a miss. Loader exceptions propagate
+        and nothing is cached.
+        """
+        data = self.get(path)
+        if data is not None:
+            return data
+        data = loader()
+        if data is not None:
+            self.set(path, data)
+        return data
+
+    def invalidate(self, path):
+        with self._lock:
+            if self._entries.pop(path, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0
+            }
@@ -0,0 +1,349 @@
+"""
+Bulk lesson import from NDJSON or a zip of lessons.
+
+Each record names where the lesson lives and carries its body:
+
+    {"country": "NG", "curriculum": "NERDC", "grade": "JSS1", "level": "1",
+     "subject": "Science", "lesson_ref": "SCI-001", "lesson": {...}}
+
+A zip may hold .ndjson/.jsonl files of such records, or .json files with one
+record (or a list of records) each. Run from the command line with
+
+    python lesson_import.py curriculum.ndjson --checkpoint curriculum.checkpoint
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from firestore_limits import MAX_BATCH_WRITES
+from lesson_validation import LessonValidator
+
+logger = logging.getLogger(__name__)
+
+COORDINATE_FIELDS = ('country', 'curriculum', 'grade', 'level', 'subject', 'lesson_ref')
+PARENT_SEGMENTS = (
+    ('countries', 'country'),
+    ('curriculums', 'curriculum'),
+    ('grades', 'grade'),
+    ('levels', 'level'),
+    ('subjects', 'subject')
+)
+# Lessons live in the lessonRef collection under their subject, where
+# find_lesson_by_ref and the curriculum index look for them
+LESSON_COLLECTION = 'lessonRef'
+
+
+# ===== PARSING =====
+def iter_ndjson(lines, source='<stream>'):
+    """Yield one record per non-blank line; malformed lines yield {'_error': ...} instead of stopping."""
+    for line_number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            yield {'_error': f"{source}:{line_number}: invalid JSON: {e.msg}"}
+
+
+def iter_zip(file):
+    """Yield records from every .ndjson, .jsonl and .json member, in name order."""
+    with zipfile.ZipFile(file) as archive:
+        for name in sorted(archive.namelist()):
+            lower = name.lower()
+            if lower.endswith(('.ndjson', '.jsonl')):
+                with archive.open(name) as member:
+                    yield from iter_ndjson(member, source=name)
+            elif lower.endswith('.json'):
+                try:
+                    data = json.loads(archive.read(name))
+                except json.JSONDecodeError as e:
+                    yield {'_error': f"{name}: invalid JSON: {e.msg}"}
+                    continue
+                yield from (data if isinstance(data, list) else [data])
+
+
+def iter_import_records(file, filename=''):
+    """Pick the parser from the file name, falling back to sniffing for a zip archive."""
+    if filename.lower().endswith('.zip') or (not filename and zipfile.is_zipfile(file)):
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        return iter_zip(file)
+    return iter_ndjson(file, source=filename or '<stream>')
+
+
+def is_document_id(value):
+    """Whether value can stand as one segment of a document path, so the path keeps its shape."""
+    return isinstance(value, str) and bool(value) and '/' not in value and value not in ('.', '..')
+
+
+def lesson_path(record, collection=LESSON_COLLECTION):
+    return (
+        f"countries/{record['country']}/curriculums/{record['curriculum']}/grades/{record['grade']}"
+        f"/levels/{record['level']}/subjects/{record['subject']}/{collection}/{record['lesson_ref']}"
+    )
+
+
+def parent_paths(record):
+    """(path, type) for the five documents above a lesson, outermost first."""
+    paths = []
+    current = []
+    for collection, field in PARENT_SEGMENTS:
+        current.append(f"{collection}/{record[field]}")
+        paths.append(('/'.join(current), field))
+    return paths
+
+
+# ===== VALIDATION WORKERS =====
+_worker_validator = None
+
+
+def _init_validation_worker(schema):
+    global _worker_validator
+    _worker_validator = LessonValidator(schema)
+
+
+def _validate_chunk(records):
+    """Errors per record index in the chunk; runs in a worker process."""
+    failures = {}
+    for index, record in enumerate(records):
+        if '_error' in record:
+            failures[index] = [{'path': '<record>', 'message': record['_error'], 'validator': 'parse'}]
+            continue
+        missing = [field for field in COORDINATE_FIELDS if not record.get(field)]
+        if missing:
+            failures[index] = [{'path': '<record>', 'message': f"Missing fields: {', '.join(missing)}",
+                                'validator': 'required'}]
+            continue
+        invalid = [field for field in COORDINATE_FIELDS if not is_document_id(record[field])]
+        if invalid:
+            failures[index] = [{'path': field, 'message': f"{field} must be a string without '/' and not '.' or '..'",
+                                'validator': 'pattern'} for field in invalid]
+            continue
+        if not isinstance(record.get('lesson'), dict):
+            failures[index] = [{'path': 'lesson', 'message': 'lesson must be an object', 'validator': 'type'}]
+            continue
+        errors = _worker_validator.errors(record['lesson'])
+        if errors:
+            failures[index] = errors
+    return failures
+
+
+# ===== CHECKPOINTS =====
+class ImportCheckpoint:
+    """
+    Number of leading records that are fully handled (committed or rejected),
+    kept in a small JSON file. Rerunning the same input with the same
+    checkpoint skips those records.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.committed_records = 0
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.committed_records = json.load(f).get('committed_records', 0)
+
+    def save(self, committed_records):
+        self.committed_records = committed_records
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'committed_records': committed_records, 'updated_at': time.time()}, f)
+        os.replace(tmp_path, self.path)
+
+
+# ===== IMPORTER =====
+class LessonImporter:
+    """
+    Streams records through a validation process pool and commits valid
+    lessons in batched writes of up to 500, with at most commit_concurrency
+    batches in flight. Parent documents are created once per import: each
+    new parent path is checked with a single get_all per chunk and written
+    only if missing. on_committed(paths), when given, is called with the
+    lesson paths of each batch once it is committed.
+    """
+
+    def __init__(self, db, schema, batch_size=MAX_BATCH_WRITES, validate_workers=None,
+                 commit_concurrency=4, checkpoint=None, collection=LESSON_COLLECTION, max_reported_errors=100,
+                 on_committed=None):
+        self.db = db
+        self.schema = schema
+        self.batch_size = min(batch_size, MAX_BATCH_WRITES)
+        self.validate_workers = validate_workers if validate_workers is not None else (os.cpu_count() or 1)
+        self.commit_concurrency = max(1, commit_concurrency)
+        self.checkpoint = checkpoint or ImportCheckpoint(None)
+        self.collection = collection
+        self.max_reported_errors = max_reported_errors
+        self.on_committed = on_committed
+        self._known_parents = set()
+        self._lock = threading.Lock()
+        self._completed_chunks = {}  # start -> end, for chunks finished out of order
+        self._watermark = 0
+        self.report = {'read': 0, 'skipped': 0, 'imported': 0, 'invalid': 0, 'parents_created': 0,
+                       'batches': 0, 'errors': []}
+
+    def run(self, records):
+        started = time.perf_counter()
+        self._watermark = self.checkpoint.committed_records
+        chunks = self._chunks(records)
+
+        if self.validate_workers > 1:
+            validator_pool = ProcessPoolExecutor(
+                max_workers=self.validate_workers,
+                # spawn, not fork: the parent holds gRPC channels that must not be forked
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_validation_worker,
+                initargs=(self.schema,)
+            )
+        else:
+            _init_validation_worker(self.schema)
+            validator_pool = None
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.commit_concurrency) as commit_pool:
+                pending_commits = set()
+                for start, chunk, failures in self._validated(chunks, validator_pool):
+                    writes = self._handle_chunk(start, chunk, failures)
+                    # Keep at most commit_concurrency batches in flight
+                    while len(pending_commits) >= self.commit_concurrency:
+                        done, pending_commits = wait(pending_commits, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    pending_commits.add(commit_pool.submit(self._commit_chunk, start, len(chunk), writes))
+                for future in pending_commits:
+                    future.result()
+        finally:
+            if validator_pool is not None:
+                validator_pool.shutdown()
+
+        self.report['committed_records'] = self._watermark
+        self.report['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+        return self.report
+
+    def _chunks(self, records):
+        """Yield (start index, records) chunks, skipping what the checkpoint already covers."""
+        chunk = []
+        start = None
+        for index, record in enumerate(records):
+            self.report['read'] += 1
+            if index < self.checkpoint.committed_records:
+                self.report['skipped'] += 1
+                continue
+            if start is None:
+                start = index
+            chunk.append(record)
+            if len(chunk) >= self.batch_size:
+                yield start, chunk
+                chunk, start = [], None
+        if chunk:
+            yield start, chunk
+
+    def _validated(self, chunks, validator_pool):
+        """Validate ahead of the writer, keeping a bounded number of chunks in the pool."""
+        if validator_pool is None:
+            for start, chunk in chunks:
+                yield start, chunk, _validate_chunk(chunk)
+            return
+
+        in_flight = []
+        for start, chunk in chunks:
+            in_flight.append((start, chunk, validator_pool.submit(_validate_chunk, chunk)))
+            if len(in_flight) >= self.validate_workers * 2:
+                start, chunk, future = in_flight.pop(0)
+                yield start, chunk, future.result()
+        for start, chunk, future in in_flight:
+            yield start, chunk, future.result()
+
+    def _handle_chunk(self, start, chunk, failures):
+        """Record failures, create any parents not seen yet, and return the lesson writes."""
+        for index, errors in sorted(failures.items()):
+            self.report['invalid'] += 1
+            if len(self.report['errors']) < self.max_reported_errors:
+                self.report['errors'].append({'record': start + index, 'errors': errors})
+
+        valid = [record for index, record in enumerate(chunk) if index not in failures]
+        self._ensure_parents(valid)
+        return [(lesson_path(record, self.collection), record['lesson']) for record in valid]
+
+    def _ensure_parents(self, records):
+        from firebase_admin import firestore
+
+        new_parents = {}
+        for record in records:
+            for path, parent_type in parent_paths(record):
+                if path not in self._known_parents:
+                    new_parents[path] = parent_type
+        if not new_parents:
+            return
+
+        # Parents go ahead of the lessons that need them, in their own batches
+        missing = [snapshot.reference for snapshot in self.db.get_all([self.db.document(path) for path in new_parents])
+                   if not snapshot.exists]
+        for offset in range(0, len(missing), MAX_BATCH_WRITES):
+            batch = self.db.batch()
+            for reference in missing[offset:offset + MAX_BATCH_WRITES]:
+                batch.set(reference, {
+                    'created_at': firestore.SERVER_TIMESTAMP,
+                    'type': new_parents[reference.path]
+                })
+            batch.commit()
+        self._known_parents.update(new_parents)
+        self.report['parents_created'] += len(missing)
+
+    def _commit_chunk(self, start, size, writes):
+        if writes:
+            batch = self.db.batch()
+            for path, lesson in writes:
+                batch.set(self.db.document(path), lesson)
+            batch.commit()
+            if self.on_committed is not None:
+                self.on_committed([path for path, _ in writes])
+        with self._lock:
+            self.report['imported'] += len(writes)
+            self.report['batches'] += 1 if writes else 0
+            # Advance the checkpoint only over a contiguous run of finished chunks
+            self._completed_chunks[start] = start + size
+            advanced = False
+            while self._watermark in self._completed_chunks:
+                self._watermark = self._completed_chunks.pop(self._watermark)
+                advanced = True
+            if advanced:
+                self.checkpoint.save(self._watermark)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Import lessons from NDJSON or a zip into Firestore.')
+    parser.add_argument('source', help='.ndjson/.jsonl file or .zip archive')
+    parser.add_argument('--checkpoint', help='checkpoint file; rerun with the same file to resume')
+    parser.add_argument('--batch-size', type=int, default=MAX_BATCH_WRITES)
+    parser.add_argument('--workers', type=int, default=None, help='validation processes (default: CPU count)')
+    parser.add_argument('--concurrency', type=int, default=4, help='batch commits in flight')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from main import LESSON_SCHEMA, db
+
+    importer = LessonImporter(
+        db, LESSON_SCHEMA,
+        batch_size=args.batch_size,
+        validate_workers=args.workers,
+        commit_concurrency=args.concurrency,
+        checkpoint=ImportCheckpoint(args.checkpoint)
+    )
+    with open(args.source, 'rb') as f:
+        report = importer.run(iter_import_records(f, args.source))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
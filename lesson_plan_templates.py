@@ -0,0 +1,287 @@
+"""
+Precomputed, student-agnostic lesson plan templates.
+
+/generate-lesson-plan builds its prompt from the lesson document, grade,
+subject and curriculum; the student ID only fills a few greeting lines. The
+job here walks every lesson in the curriculum, generates the plan once with
+STUDENT_PLACEHOLDER in place of the ID, and stores it keyed by lesson path
+with the hash of the prompt it came from. The endpoint then only has to swap
+the placeholder for the real ID.
+
+A stored template is used only while its hash matches the prompt the request
+would send, so editing a lesson, its objectives or the prompt itself makes
+the old template stale rather than wrong. Rerunning the job regenerates only
+stale or missing templates, which is also how an interrupted run resumes:
+
+    python lesson_plan_templates.py --country NG --concurrency 4
+"""
+import argparse
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+from curriculum_index import LEVELS, parse_lesson_doc_path
+from lesson_cache import LessonCache
+from llm_gateway import LLMUnavailableError
+
+logger = logging.getLogger(__name__)
+
+STUDENT_PLACEHOLDER = '{{STUDENT_ID}}'
+PLACEHOLDER_INSTRUCTION = (
+    f"\n        Wherever the student's ID would appear, write the placeholder {STUDENT_PLACEHOLDER} "
+    "exactly as shown; it is replaced with the real ID when the lesson is delivered."
+)
+
+TEMPLATE_ENDPOINT = 'lesson-plan-template'
+
+
+def content_hash(prompt):
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+
+def template_doc_id(lesson_path):
+    # Lesson paths contain slashes, which document IDs cannot
+    return hashlib.sha1(lesson_path.encode('utf-8')).hexdigest()
+
+
+def personalize(template_text, student_id):
+    return template_text.replace(STUDENT_PLACEHOLDER, student_id)
+
+
+def lesson_objectives(lesson_data):
+    """The objectives stored on the lesson, or [] if it has none usable in a prompt."""
+    objectives = lesson_data.get('learningObjectives') or lesson_data.get('objectives') or []
+    if not isinstance(objectives, list) or not all(isinstance(item, str) for item in objectives):
+        return []
+    return objectives
+
+
+class LessonPlanTemplateStore:
+    """
+    Templates in a Firestore collection, one document per lesson, read
+    through an in-process cache. Lessons without a template are cached too
+    (as an empty record), so a miss costs one Firestore read per TTL.
+    """
+
+    def __init__(self, db, collection='lesson_plan_templates', max_entries=2048, ttl_seconds=600):
+        self.db = db
+        self.collection = collection
+        self._cache = LessonCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def _document(self, lesson_path):
+        return self.db.collection(self.collection).document(template_doc_id(lesson_path))
+
+    def get(self, lesson_path):
+        def load():
+            snapshot = self._document(lesson_path).get()
+            return (snapshot.to_dict() or {}) if snapshot.exists else {}
+
+        return self._cache.get_or_load(lesson_path, load) or None
+
+    def lookup(self, lesson_path, prompt):
+        """Template text for the lesson if it was generated from this exact prompt, else None."""
+        record = self.get(lesson_path)
+        if record and record.get('content_hash') == content_hash(prompt):
+            self._count('hits')
+            return record.get('lesson_plan')
+        self._count('stale' if record else 'misses')
+        return None
+
+    def stored_hashes(self, lesson_paths):
+        """{lesson_path: content_hash} for the given lessons that already have a template."""
+        if not lesson_paths:
+            return {}
+        paths_by_id = {template_doc_id(path): path for path in lesson_paths}
+        references = [self.db.collection(self.collection).document(doc_id) for doc_id in paths_by_id]
+        return {
+            paths_by_id[snapshot.id]: snapshot.get('content_hash')
+            for snapshot in self.db.get_all(references, field_paths=['content_hash'])
+            if snapshot.exists
+        }
+
+    def put(self, lesson_path, prompt_hash, lesson_plan, model_name=None):
+        record = {
+            'lesson_path': lesson_path,
+            'content_hash': prompt_hash,
+            'lesson_plan': lesson_plan,
+            'model': model_name,
+            'generated_at': datetime.now(timezone.utc)
+        }
+        self._document(lesson_path).set(record)
+        self._cache.set(lesson_path, record)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.stale
+            counters = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0
+            }
+        return {**counters, 'cached_lessons': self._cache.stats()['size']}
+
+
+class LessonPlanTemplateJob:
+    """
+    Generates a template for every lesson that lacks an up-to-date one.
+
+    build_prompt(lesson_data, coords, learning_objectives) returns the
+    student-agnostic prompt for a lesson, where coords holds its country,
+    curriculum, grade, level, subject and lesson_ref. Lessons are read in
+    chunks; each chunk's stored hashes are fetched with one get_all, and
+    stale lessons are generated with at most concurrency Gemini calls in
+    flight. A template is written as soon as it is generated, so a failed
+    run loses at most the calls that were in flight.
+    """
+
+    def __init__(self, db, model, build_prompt, store, concurrency=4, chunk_size=100, force=False,
+                 max_attempts=3, timeout=120, max_reported_errors=100):
+        self.db = db
+        self.model = model
+        self.build_prompt = build_prompt
+        self.store = store
+        self.concurrency = max(1, concurrency)
+        self.chunk_size = chunk_size
+        self.force = force
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.max_reported_errors = max_reported_errors
+        self._lock = threading.Lock()
+        self.report = {'lessons': 0, 'generated': 0, 'up_to_date': 0, 'skipped': 0, 'failed': 0, 'errors': []}
+
+    def lesson_documents(self, country=None, curriculum=None, grade=None, level=None, subject=None,
+                         collection_id='lessonRef'):
+        """(path, coords, data) for every lesson under the given prefix of the hierarchy."""
+        prefix = {'country': country, 'curriculum': curriculum, 'grade': grade, 'level': level, 'subject': subject}
+        for snapshot in self.db.collection_group(collection_id).stream():
+            path = snapshot.reference.path
+            coords = parse_lesson_doc_path(path)
+            if coords is None:
+                continue
+            if any(value and coords[field] != value for field, value in prefix.items()):
+                continue
+            yield path, coords, snapshot.to_dict() or {}
+
+    def run(self, documents):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            pending = set()
+            for chunk in self._chunks(documents):
+                for path, prompt in self._stale(chunk):
+                    # Read lessons only as fast as Gemini keeps up with them
+                    while len(pending) >= self.concurrency * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    pending.add(pool.submit(self._generate, path, prompt))
+            wait(pending)
+
+        self.report['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+        return self.report
+
+    def _chunks(self, documents):
+        chunk = []
+        for document in documents:
+            self.report['lessons'] += 1
+            chunk.append(document)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _stale(self, chunk):
+        """(path, prompt) for lessons in the chunk whose stored template is missing or out of date."""
+        prompts = {}
+        for path, coords, data in chunk:
+            objectives = lesson_objectives(data)
+            if not objectives:
+                self.report['skipped'] += 1
+                self._error(path, 'Lesson has no learning objectives')
+                continue
+            prompts[path] = self.build_prompt(data, coords, objectives)
+
+        stored = {} if self.force else self.store.stored_hashes(list(prompts))
+        for path, prompt in prompts.items():
+            if stored.get(path) == content_hash(prompt):
+                self.report['up_to_date'] += 1
+            else:
+                yield path, prompt
+
+    def _generate(self, path, prompt):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                response = self.model.generate_content(
+                    prompt,
+                    request_options={'timeout': self.timeout},
+                    endpoint=TEMPLATE_ENDPOINT
+                )
+                if not response.text:
+                    raise ValueError('Empty response from AI')
+                self.store.put(path, content_hash(prompt), response.text, getattr(self.model, 'model_name', None))
+            except LLMUnavailableError as e:
+                # Shed by the gateway: interactive traffic has the quota, so wait and try again
+                if attempt < self.max_attempts:
+                    time.sleep(e.retry_after)
+                    continue
+                return self._failed(path, e)
+            except Exception as e:
+                return self._failed(path, e)
+            with self._lock:
+                self.report['generated'] += 1
+            logger.info(f"Generated lesson plan template for {path}")
+            return
+
+    def _failed(self, path, error):
+        logger.error(f"Lesson plan template failed for {path}: {error}")
+        with self._lock:
+            self.report['failed'] += 1
+        self._error(path, str(error))
+
+    def _error(self, path, message):
+        with self._lock:
+            if len(self.report['errors']) < self.max_reported_errors:
+                self.report['errors'].append({'lesson_path': path, 'error': message})
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Pre-generate lesson plan templates for the curriculum.')
+    for level in LEVELS:
+        parser.add_argument(f'--{level}', help=f'only lessons in this {level}')
+    parser.add_argument('--concurrency', type=int, default=4, help='Gemini calls in flight')
+    parser.add_argument('--chunk-size', type=int, default=100)
+    parser.add_argument('--force', action='store_true', help='regenerate templates that are up to date')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from main import build_lesson_plan_template_prompt, db, lesson_plan_templates, model
+
+    def build_prompt(lesson_data, coords, learning_objectives):
+        return build_lesson_plan_template_prompt(
+            lesson_data, coords['lesson_ref'], learning_objectives,
+            coords['country'], coords['curriculum'], coords['grade'], coords['subject']
+        )
+
+    job = LessonPlanTemplateJob(
+        db, model, build_prompt, lesson_plan_templates,
+        concurrency=args.concurrency,
+        chunk_size=args.chunk_size,
+        force=args.force
+    )
+    report = job.run(job.lesson_documents(**{level: getattr(args, level) for level in LEVELS}))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
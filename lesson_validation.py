@@ -0,0 +1,48 @@
+def format_error_path(error):
+    """JSON-pointer-like location of a validation error, e.g. 'sections/0/title'."""
+    return '/'.join(str(part) for part in error.absolute_path) or '<root>'
+
+
+class LessonValidator:
+    """
+    A JSON-schema validator compiled once and reused for every document.
+
+    jsonschema.validate() checks the schema itself and builds a new validator
+    on each call; here that happens once in the constructor. errors() reports
+    every problem in a document rather than stopping at the first.
+    """
+
+    def __init__(self, schema):
+        from jsonschema import validators
+
+        validator_class = validators.validator_for(schema)
+        validator_class.check_schema(schema)
+        self.schema = schema
+        self._validator = validator_class(schema)
+
+    def is_valid(self, document):
+        return self._validator.is_valid(document)
+
+    def errors(self, document):
+        """All validation errors as [{'path', 'message', 'validator'}], in document order."""
+        errors = sorted(self._validator.iter_errors(document), key=lambda error: list(map(str, error.absolute_path)))
+        return [
+            {
+                'path': format_error_path(error),
+                'message': error.message,
+                'validator': error.validator
+            }
+            for error in errors
+        ]
+
+    def validate_many(self, documents):
+        """
+        Validate an iterable of documents and return {index: errors} for the
+        invalid ones only. Valid documents, the common case in an import, take
+        the short-circuiting is_valid() path and never build error objects.
+        """
+        failures = {}
+        for index, document in enumerate(documents):
+            if not self._validator.is_valid(document):
+                failures[index] = self.errors(document)
+        return failures
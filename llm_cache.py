@@ -0,0 +1,301 @@
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+from lesson_cache import LessonCache
+from metrics import span
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_prompt(prompt):
+    """Collapse whitespace so indentation changes in f-string prompts don't change keys."""
+    if not isinstance(prompt, str):
+        prompt = json.dumps(prompt, sort_keys=True, default=str)
+    return _WHITESPACE_RE.sub(' ', prompt).strip()
+
+
+def _config_to_dict(generation_config):
+    if generation_config is None:
+        return None
+    if isinstance(generation_config, dict):
+        return generation_config
+    if hasattr(generation_config, '__dict__'):
+        return {k: v for k, v in vars(generation_config).items() if v is not None}
+    return str(generation_config)
+
+
+def make_cache_key(prompt, generation_config=None, model_name=None):
+    """Deterministic SHA-256 key for a prompt plus the generation config."""
+    payload = {
+        'model': model_name,
+        'prompt': normalize_prompt(prompt),
+        'generation_config': _config_to_dict(generation_config)
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class MemoryBackend(LessonCache):
+    """In-process LRU backend with per-entry TTL."""
+
+    def __init__(self, max_entries=512, ttl_seconds=3600):
+        super().__init__(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+
+class SQLiteBackend:
+    """On-disk backend, shared by every worker process on the instance."""
+
+    def __init__(self, path, ttl_seconds=3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS llm_responses ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires_at FROM llm_responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= time.time():
+                self._conn.execute('DELETE FROM llm_responses WHERE key = ?', (key,))
+                return None
+            return row[0]
+
+    def set(self, key, value, ttl_seconds=None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO llm_responses (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, value, time.time() + ttl)
+            )
+
+    def invalidate(self, key):
+        with self._lock:
+            self._conn.execute('DELETE FROM llm_responses WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM llm_responses')
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute('SELECT COUNT(*) FROM llm_responses').fetchone()[0]
+        return {'backend': 'sqlite', 'path': self.path, 'size': size}
+
+
+def create_cache_backend(kind, **options):
+    """Build a backend from its name: 'memory', 'sqlite' or 'none'."""
+    kind = (kind or 'memory').lower()
+    if kind == 'none':
+        return None
+    if kind == 'memory':
+        return MemoryBackend(**options)
+    if kind == 'sqlite':
+        return SQLiteBackend(**options)
+    raise ValueError(f"Unknown LLM cache backend: {kind}")
+
+
+class CachedResponse:
+    """Stand-in for a Gemini response served from the cache."""
+
+    cached = True
+
+    def __init__(self, text):
+        self.text = text
+
+    def __bool__(self):
+        return True
+
+
+class CachedModel:
+    """
+    Wraps a GenerativeModel so generate_content is served from a response
+    cache. Only calls tagged with an endpoint that has a TTL are cached;
+    everything else, and any call with use_cache=False, goes straight through.
+
+    With forward_endpoint=True the endpoint tag is passed on to the wrapped
+    model, e.g. an LLMGateway that picks a priority lane from it.
+    """
+
+    def __init__(self, model, backend, endpoint_ttls=None, disabled_endpoints=None, forward_endpoint=False):
+        self.model = model
+        self.backend = backend
+        self.forward_endpoint = forward_endpoint
+        # Identical cacheable prompts in flight at once share one upstream call
+        self._flight = SingleFlight('gemini')
+        self.endpoint_ttls = dict(endpoint_ttls or {})
+        self.disabled_endpoints = set(disabled_endpoints or [])
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def _ttl_for(self, endpoint, use_cache):
+        if self.backend is None or not use_cache or endpoint is None:
+            return None
+        if endpoint in self.disabled_endpoints:
+            return None
+        ttl = self.endpoint_ttls.get(endpoint)
+        return ttl if ttl and ttl > 0 else None
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _lookup(self, prompt, endpoint, use_cache, kwargs):
+        """Return (key, ttl, cached_response); key is None when the call bypasses the cache."""
+        ttl = self._ttl_for(endpoint, use_cache)
+        if ttl is None or kwargs.get('stream'):
+            self._count('bypassed')
+            return None, None, None
+
+        # Read per call: the wrapped model may only be built on first use
+        key = make_cache_key(prompt, kwargs.get('generation_config'), getattr(self.model, 'model_name', None))
+        cached_text = self.backend.get(key)
+        if cached_text is not None:
+            self._count('hits')
+            logger.debug(f"LLM cache hit for {endpoint}")
+            return key, ttl, CachedResponse(cached_text)
+
+        self._count('misses')
+        return key, ttl, None
+
+    def _store(self, key, ttl, response):
+        if key is None:
+            return
+        try:
+            text = response.text if response else None
+        except ValueError:
+            # Blocked or empty candidates; let the caller see the raw response
+            text = None
+        if text:
+            self.backend.set(key, text, ttl)
+
+    def _upstream_kwargs(self, endpoint, kwargs):
+        if self.forward_endpoint:
+            return {**kwargs, 'endpoint': endpoint}
+        return kwargs
+
+    def generate_content(self, prompt, *args, endpoint=None, use_cache=True, **kwargs):
+        key, ttl, cached = self._lookup(prompt, endpoint, use_cache, kwargs)
+        if cached is not None:
+            return cached
+
+        def call_upstream():
+            with span('gemini'):
+                response = self.model.generate_content(prompt, *args, **self._upstream_kwargs(endpoint, kwargs))
+            self._store(key, ttl, response)
+            return response
+
+        if key is None:
+            return call_upstream()
+        return self._flight.do(key, call_upstream)
+
+    def stream_content(self, prompt, *args, endpoint=None, use_cache=True, stream_info=None, **kwargs):
+        """
+        Yield response text as it arrives. A cache hit is yielded as one
+        chunk; on a miss Gemini is called with stream=True and the full text
+        is cached once the stream completes, so streamed and non-streamed
+        requests share entries.
+
+        Closing the generator early (e.g. the client disconnected) cancels
+        the upstream stream and caches nothing. If stream_info is a dict it
+        receives 'cached' and, when Gemini reports it, 'usage' metadata.
+        """
+        info = stream_info if stream_info is not None else {}
+        key, ttl, cached = self._lookup(prompt, endpoint, use_cache, kwargs)
+        info['cached'] = cached is not None
+        if cached is not None:
+            yield cached.text
+            return
+
+        with span('gemini'):
+            response = self.model.generate_content(
+                prompt, *args, stream=True, **self._upstream_kwargs(endpoint, kwargs)
+            )
+        parts = []
+        completed = False
+        try:
+            for chunk in response:
+                usage = getattr(chunk, 'usage_metadata', None)
+                if usage:
+                    info['usage'] = usage
+                text = chunk.text
+                if text:
+                    parts.append(text)
+                    yield text
+            completed = True
+        finally:
+            if not completed:
+                _cancel_stream(response)
+        if key is not None and parts:
+            self.backend.set(key, ''.join(parts), ttl)
+
+    async def generate_content_async(self, prompt, *args, endpoint=None, use_cache=True, **kwargs):
+        key, ttl, cached = self._lookup(prompt, endpoint, use_cache, kwargs)
+        if cached is not None:
+            return cached
+
+        async def call_upstream():
+            with span('gemini'):
+                response = await self.model.generate_content_async(
+                    prompt, *args, **self._upstream_kwargs(endpoint, kwargs)
+                )
+            self._store(key, ttl, response)
+            return response
+
+        if key is None:
+            return await call_upstream()
+        return await self._flight.do_async(key, call_upstream)
+
+    def stats(self):
+        with self._lock:
+            stats = {'hits': self.hits, 'misses': self.misses, 'bypassed': self.bypassed}
+        stats['coalesced'] = self._flight.stats()
+        stats['endpoint_ttls'] = self.endpoint_ttls
+        stats['disabled_endpoints'] = sorted(self.disabled_endpoints)
+        if self.backend is not None:
+            stats['backend'] = self.backend.stats()
+        return stats
+
+
+def _cancel_stream(response):
+    """Best-effort cancel of an abandoned Gemini stream so it stops generating upstream."""
+    close = getattr(type(response), 'close', None)
+    if callable(close):
+        # Streams from LLMGateway cancel upstream and give back their slot
+        response.close()
+        return
+    # The SDK keeps the gRPC stream on a private attribute; cancel it if we can reach it
+    cancel = getattr(getattr(response, '_iterator', None), 'cancel', None)
+    if callable(cancel):
+        try:
+            cancel()
+        except Exception as e:
+            logger.debug(f"Could not cancel Gemini stream: {e}")
+
+
+def endpoints_from_env(value):
+    """Parse a comma-separated endpoint list such as LLM_CACHE_DISABLED_ENDPOINTS."""
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
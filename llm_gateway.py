@@ -0,0 +1,402 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# google.api_core.exceptions classes (and builtins) worth retrying, matched by
+# name so this module never imports the Google SDK
+RETRYABLE_ERRORS = {
+    'ResourceExhausted',     # 429 quota
+    'TooManyRequests',
+    'ServiceUnavailable',    # 503
+    'InternalServerError',   # 500
+    'GatewayTimeout',
+    'DeadlineExceeded',      # 504 / client deadline
+    'TimeoutError',
+    'ConnectionError'
+}
+
+
+def is_retryable(error):
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+
+class LLMUnavailableError(Exception):
+    """Raised instead of calling Gemini when the gateway sheds load; retry after retry_after seconds."""
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows rate requests per second on average, with bursts of up to capacity."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """Take a token and return 0, or return the seconds until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    async def acquire_async(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+
+class PriorityLimiter:
+    """
+    At most max_in_flight holders at a time. When full, waiters are admitted
+    by priority (lower number first) and then arrival order, so interactive
+    endpoints overtake batch ones in the queue. Threads and coroutines share
+    the same queue.
+    """
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._waiters = []  # (priority, seq, wake, state)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _try_enter(self, priority, wake):
+        """Take a slot now, or enqueue wake() to be called when one is handed over."""
+        with self._lock:
+            if self.in_flight < self.max_in_flight and not self._waiters:
+                self.in_flight += 1
+                return True, None
+            state = {'granted': False, 'cancelled': False}
+            heapq.heappush(self._waiters, (priority, next(self._seq), wake, state))
+            return False, state
+
+    def _cancel(self, state):
+        with self._lock:
+            if state['granted']:
+                return False  # the slot arrived while timing out; caller now owns it
+            state['cancelled'] = True
+            return True
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                _, _, wake, state = heapq.heappop(self._waiters)
+                if not state['cancelled']:
+                    # Hand the slot straight to the next waiter; in_flight stays the same
+                    state['granted'] = True
+                    wake()
+                    return
+            self.in_flight -= 1
+
+    def acquire(self, priority, timeout):
+        event = threading.Event()
+        entered, state = self._try_enter(priority, event.set)
+        if entered:
+            return True
+        if event.wait(timeout):
+            return True
+        return not self._cancel(state)
+
+    async def acquire_async(self, priority, timeout):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        entered, state = self._try_enter(priority, wake)
+        if entered:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return not self._cancel(state)
+        except asyncio.CancelledError:
+            # Don't leak a slot that was handed over just as the caller went away
+            if not self._cancel(state):
+                self.release()
+            raise
+
+    def waiting(self):
+        with self._lock:
+            return sum(1 for *_, state in self._waiters if not state['cancelled'])
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive upstream failures and rejects
+    calls for reset_timeout seconds, then lets a single trial call through
+    (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise LLMUnavailableError if the call should not go upstream."""
+        with self._lock:
+            if self.state == 'closed':
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == 'open' and remaining > 0:
+                raise LLMUnavailableError('Gemini circuit is open', retry_after=remaining)
+            if self._trial_in_flight:
+                raise LLMUnavailableError('Gemini circuit is half-open', retry_after=1.0)
+            self.state = 'half-open'
+            self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def end_call(self):
+        """Free the half-open trial slot if the call ended without a verdict."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == 'half-open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.warning(f"Gemini circuit opened after {self.failures} consecutive failures")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class GatewayStream:
+    """
+    A streamed Gemini response that keeps its gateway slot until it has been
+    read to the end, failed or been closed. Only then is the slot released
+    and the circuit breaker told how the call went. Other attributes are
+    those of the wrapped response.
+    """
+
+    def __init__(self, gateway, response):
+        self._gateway = gateway
+        self._response = response
+        self._settled = False
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __iter__(self):
+        outcome = None
+        try:
+            for chunk in self._response:
+                yield chunk
+            outcome = 'success'
+        except Exception as e:
+            if is_retryable(e):
+                logger.warning(f"Gemini stream failed: {e}")
+                outcome = 'failure'
+            raise
+        finally:
+            self._settle(outcome)
+
+    def close(self):
+        """Cancel the upstream stream (best effort) and free the slot without a verdict."""
+        cancel = getattr(getattr(self._response, '_iterator', None), 'cancel', None)
+        if callable(cancel) and not self._settled:
+            try:
+                cancel()
+            except Exception as e:
+                logger.debug(f"Could not cancel Gemini stream: {e}")
+        self._settle(None)
+
+    def __del__(self):
+        self._settle(None)
+
+    def _settle(self, outcome):
+        with self._lock:
+            if self._settled:
+                return
+            self._settled = True
+        gateway = self._gateway
+        if outcome == 'success':
+            gateway.breaker.record_success()
+        elif outcome == 'failure':
+            gateway.breaker.record_failure()
+            gateway._count('failures')
+        else:
+            gateway.breaker.end_call()
+        gateway.limiter.release()
+
+
+class LLMGateway:
+    """
+    Sits between CachedModel and the Gemini model, so only real upstream
+    calls are throttled. Every call passes through, in order: a priority
+    lane slot (bounded in-flight requests), the circuit breaker, a rate-limit
+    token, and a retry loop with jittered exponential backoff on retryable
+    errors. Load that cannot be admitted within queue_timeout is shed with
+    LLMUnavailableError rather than piling up. A stream=True call returns a
+    GatewayStream, which holds its slot until the stream is done with.
+
+    endpoint_priorities maps CachedModel endpoint names to a lane number,
+    lower first; unknown endpoints and background work use default_priority.
+    """
+
+    def __init__(self, model, requests_per_second=5.0, burst=None, max_in_flight=8,
+                 endpoint_priorities=None, default_priority=10, max_attempts=3,
+                 base_delay=0.5, max_delay=8.0, queue_timeout=10.0, breaker=None):
+        self.model = model
+        self.bucket = TokenBucket(requests_per_second, burst)
+        self.limiter = PriorityLimiter(max_in_flight)
+        self.breaker = breaker or CircuitBreaker()
+        self.endpoint_priorities = dict(endpoint_priorities or {})
+        self.default_priority = default_priority
+        # At least one attempt, or a misconfigured gateway would return None without calling Gemini
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.shed = 0
+        self.failures = 0
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def _priority(self, endpoint):
+        return self.endpoint_priorities.get(endpoint, self.default_priority)
+
+    def _backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, delay)
+
+    def _count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def _shed(self, message, retry_after):
+        self._count('shed')
+        return LLMUnavailableError(message, retry_after)
+
+    def generate_content(self, prompt, *args, endpoint=None, **kwargs):
+        if not self.limiter.acquire(self._priority(endpoint), self.queue_timeout):
+            raise self._shed('Too many Gemini requests in flight', self.queue_timeout)
+        streaming = False
+        try:
+            self.breaker.before_call()
+            try:
+                for attempt in range(1, self.max_attempts + 1):
+                    if not self.bucket.acquire(self.queue_timeout):
+                        raise self._shed('Gemini rate limit reached', 1.0)
+                    self._count('calls')
+                    try:
+                        response = self.model.generate_content(prompt, *args, **kwargs)
+                    except Exception as e:
+                        self._after_failure(e, attempt)
+                        time.sleep(self._backoff(attempt))
+                        continue
+                    if kwargs.get('stream'):
+                        # The slot and the breaker verdict wait until the stream has been read
+                        streaming = True
+                        return GatewayStream(self, response)
+                    self.breaker.record_success()
+                    return response
+            finally:
+                if not streaming:
+                    self.breaker.end_call()
+        finally:
+            if not streaming:
+                self.limiter.release()
+
+    async def generate_content_async(self, prompt, *args, endpoint=None, **kwargs):
+        if not await self.limiter.acquire_async(self._priority(endpoint), self.queue_timeout):
+            raise self._shed('Too many Gemini requests in flight', self.queue_timeout)
+        try:
+            self.breaker.before_call()
+            try:
+                for attempt in range(1, self.max_attempts + 1):
+                    if not await self.bucket.acquire_async(self.queue_timeout):
+                        raise self._shed('Gemini rate limit reached', 1.0)
+                    self._count('calls')
+                    try:
+                        response = await self.model.generate_content_async(prompt, *args, **kwargs)
+                    except Exception as e:
+                        self._after_failure(e, attempt)
+                        await asyncio.sleep(self._backoff(attempt))
+                        continue
+                    self.breaker.record_success()
+                    return response
+            finally:
+                self.breaker.end_call()
+        finally:
+            self.limiter.release()
+
+    def _after_failure(self, error, attempt):
+        """Record a failed attempt and return if another should follow; raise otherwise."""
+        if not is_retryable(error):
+            # A bad request says nothing about upstream health
+            raise error
+        self.breaker.record_failure()
+        self._count('failures')
+        if attempt >= self.max_attempts or self.breaker.state == 'open':
+            logger.error(f"Gemini call failed after {attempt} attempts: {error}")
+            raise LLMUnavailableError(f"Gemini unavailable: {error}", retry_after=self.max_delay) from error
+        self._count('retries')
+        logger.warning(f"Retryable Gemini error (attempt {attempt}): {error}")
+
+    def stats(self):
+        with self._lock:
+            counters = {
+                'calls': self.calls,
+                'retries': self.retries,
+                'failures': self.failures,
+                'shed': self.shed
+            }
+        return {
+            **counters,
+            'in_flight': self.limiter.in_flight,
+            'queued': self.limiter.waiting(),
+            'circuit': self.breaker.state
+        }
@@ -1,32 +1,68 @@
 # ===== IMPORTS =====
+import time
+from startup import LazyModule, LazyProxy, LazyResource, prewarm, record_timing, startup_timings
+
+_module_import_started = time.perf_counter()
+
 import random  # Add this import
+import atexit
+import copy
+import io
 from datetime import datetime, timezone  # Add timezone import
-from flask import Flask, request, jsonify, Request  # Added Request import
+from flask import Flask, request, jsonify, Request, Response, g, stream_with_context  # Added Request import
 import os
 import json
 import traceback
-from firebase_admin import firestore, initialize_app, credentials
-import firebase_admin
 import logging
 import uuid
 from flask_cors import CORS
-import google.generativeai as genai
 from dotenv import load_dotenv
-from google.api_core import exceptions
-from google.generativeai.types import GenerationConfig  # Add this import
-from jsonschema import validate, ValidationError  # Add this import
 from typing import Dict, List  # Add this import
 import re  # Add this import
 from json import JSONEncoder
-
-# Configure logging FIRST
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from firestore_limits import MAX_BATCH_WRITES
+from lesson_cache import LessonCache
+from llm_cache import CachedModel, create_cache_backend, endpoints_from_env
+from llm_gateway import LLMGateway, LLMUnavailableError
+from work_queue import WorkerPool, create_work_queue
+from interaction_aggregate import InteractionAggregate, calculate_engagement
+from compiled_lesson import CompiledLessonCache
+from curriculum_index import CurriculumIndex
+from session_engine import InvalidTransition, SessionEngine, SessionNotFound
+from session_state import SessionStateStore
+from singleflight import single_flight, single_flight_stats
+from lesson_validation import LessonValidator
+from lesson_import import ImportCheckpoint, LessonImporter, iter_import_records
+from lesson_plan_templates import PLACEHOLDER_INSTRUCTION, STUDENT_PLACEHOLDER, LessonPlanTemplateStore, personalize
+from prompt_templates import PromptTemplate, budgets_from_env, estimate_tokens, prompt_template_stats
+from metrics import registry as metrics_registry, server_timing_header, span
+from serialization import compress_body, create_serializer
+from structured_logging import configure_logging, sample_rates_from_env, truncated
+from streaming import LESSON_PLAN_SECTIONS, STREAM_HEADERS, SectionTracker, StreamStats, negotiate_stream_format
+
+# Configure logging FIRST: JSON lines written from a background thread, INFO by default
+log_listener = configure_logging(
+    level=os.getenv('LOG_LEVEL', 'INFO'),
+    json_output=os.getenv('LOG_FORMAT', 'json').lower() == 'json',
+    sample_rates=sample_rates_from_env(os.getenv('LOG_SAMPLE_RATES')),
+    max_chars=int(os.getenv('LOG_MAX_CHARS', '2000'))
 )
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)  # Define logger here
 
+# Heavy SDKs are imported on first use rather than on every cold start
+firebase_admin = LazyModule('firebase_admin')
+firestore = LazyModule('firebase_admin.firestore')
+genai = LazyModule('google.generativeai')
+jsonschema = LazyModule('jsonschema')
+
 # ===== RESPONSE HANDLER =====
+# orjson or msgspec when installed, stdlib json otherwise
+response_serializer = create_serializer(os.getenv('RESPONSE_SERIALIZER', 'auto'))
+RESPONSE_COMPRESSION = tuple(
+    encoding.strip() for encoding in os.getenv('RESPONSE_COMPRESSION', 'br,gzip').split(',') if encoding.strip()
+)
+
 def create_response(success: bool, message: str, data=None, status_code=200):
     """Construct standardized API responses"""
     response = {
@@ -38,15 +74,56 @@ def create_response(success: bool, message: str, data=None, status_code=200):
     if data:
         response['data'] = data
         
-    logger.debug(f"Constructed response: {response}")
-    # Use the custom encoder to serialize the response
-    return json.dumps(response, cls=FirestoreJSONEncoder), status_code, {'Content-Type': 'application/json'}
+    logger.debug("Constructed response: %s", truncated(response))
+    # SERVER_TIMESTAMP sentinels and datetimes are handled by serialization.encode_default
+    with span('json_encode'):
+        body = response_serializer.dumps(response)
+    return body, status_code, {'Content-Type': 'application/json'}
 
 # Initialize Flask app first
 app = Flask(__name__)
 # app.config['SERVER_NAME'] = 'localhost:8080'  # Remove this line
 CORS(app, origins=['*'], allow_headers=['Content-Type'], methods=['POST'])
 
+# ===== REQUEST TIMING =====
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
+
+@app.before_request
+def start_request_trace():
+    # Label by route template, not the raw path, to keep metric cardinality bounded
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_token = metrics_registry.start_trace(endpoint)
+
+@app.after_request
+def finish_request_trace(response):
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        trace, elapsed = metrics_registry.finish_trace(token, response.status_code)
+        if SERVER_TIMING_ENABLED:
+            response.headers['Server-Timing'] = server_timing_header(trace, elapsed)
+    return response
+
+@app.teardown_request
+def abandon_request_trace(error=None):
+    # after_request is skipped when a view raises; still count the request
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        metrics_registry.finish_trace(token, 500)
+
+@app.after_request
+def compress_response(response):
+    """gzip or brotli JSON bodies for clients that accept it; streams are left alone."""
+    if (not RESPONSE_COMPRESSION or response.mimetype != 'application/json'
+            or response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    with span('compress'):
+        body, encoding = compress_body(response.get_data(), request.headers.get('Accept-Encoding'), RESPONSE_COMPRESSION)
+    if encoding:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+    return response
+
 # Add a custom JSON encoder to handle Firestore Sentinel objects
 class FirestoreJSONEncoder(JSONEncoder):
     def default(self, obj):
@@ -58,31 +135,153 @@ class FirestoreJSONEncoder(JSONEncoder):
 # Update the Flask app configuration to use the custom encoder
 app.json_encoder = FirestoreJSONEncoder
 
-# Initialize Firebase Admin
-if not firebase_admin._apps:
+load_dotenv()
+
+# ===== LAZY CLIENTS =====
+# Firebase, Firestore and Gemini are set up on first use (or by /health?prewarm=true),
+# once per process, so importing this module stays cheap on a cold start.
+def init_firebase_app():
+    """Initialize the default Firebase app if nothing has yet."""
+    if not firebase_admin._apps:
+        try:
+            if os.getenv('GOOGLE_APPLICATION_CREDENTIALS'):
+                cred = firebase_admin.credentials.Certificate(os.getenv('GOOGLE_APPLICATION_CREDENTIALS'))
+                firebase_admin.initialize_app(cred)
+            else:
+                firebase_admin.initialize_app()
+            logger.info("Firebase initialized successfully")  # Now safe to use logger
+        except Exception as e:
+            logger.error(f"Error initializing Firebase: {e}")
+            raise
+    return firebase_admin.get_app()
+
+firebase_app_resource = LazyResource('firebase', init_firebase_app)
+
+def init_firestore():
+    firebase_app_resource.get()
     try:
-        if os.getenv('GOOGLE_APPLICATION_CREDENTIALS'):
-            cred = credentials.Certificate(os.getenv('GOOGLE_APPLICATION_CREDENTIALS'))
-            firebase_admin.initialize_app(cred)
-        else:
-            firebase_admin.initialize_app()
-        logger.info("Firebase initialized successfully")  # Now safe to use logger
+        client = firestore.client()
+        logger.info("Firestore client initialized successfully")
     except Exception as e:
-        logger.error(f"Error initializing Firebase: {e}")
+        logger.error(f"Error initializing Firestore client: {e}")
         raise
+    # The index listener needs the client, so it starts with it
+    if os.getenv('CURRICULUM_INDEX_ENABLED', 'true').lower() == 'true':
+        curriculum_index.start(client)
+        atexit.register(curriculum_index.stop)
+    return client
 
-# Initialize Firestore
-try:
-    db = firestore.client()
-    logger.info("Firestore client initialized successfully")
-except Exception as e:
-    logger.error(f"Error initializing Firestore client: {e}")
-    raise
+def init_gemini_model():
+    genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+    return genai.GenerativeModel('gemini-pro')
 
-# Initialize Gemini
-load_dotenv()
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-model = genai.GenerativeModel('gemini-pro')
+db_resource = LazyResource('firestore', init_firestore)
+gemini_resource = LazyResource('gemini', init_gemini_model)
+db = LazyProxy(db_resource)
+
+def curriculum_index_ready():
+    """
+    Whether the curriculum index can answer lookups. The index starts with
+    the Firestore client, so routes that only read the index initialize it
+    here rather than waiting for some other route to touch db.
+    """
+    db_resource.get()
+    return curriculum_index.ready
+
+# Identical prompts are served from the response cache; TTLs are per endpoint
+LLM_CACHE_TTLS = {
+    'generate-lesson-plan': 24 * 3600,
+    'generate-lesson-notes': 24 * 3600,
+    'ai-tutor': 3600,
+    'generate-summary': 3600,
+    'generate-blooms-summary': 3600
+}
+llm_cache_backend_name = os.getenv('LLM_CACHE_BACKEND', 'memory')
+llm_cache_options = {}
+if llm_cache_backend_name == 'sqlite':
+    llm_cache_options['path'] = os.getenv('LLM_CACHE_SQLITE_PATH', '/tmp/llm_cache.sqlite3')
+elif llm_cache_backend_name == 'memory':
+    llm_cache_options['max_entries'] = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '512'))
+
+# Cache misses go through the gateway, which throttles them to our Gemini quota.
+# Lower lanes are admitted first; untagged and background calls queue last.
+LLM_ENDPOINT_PRIORITIES = {
+    'ai-tutor': 0,
+    'generate-lesson-plan': 1,
+    'generate-lesson-notes': 2,
+    'generate-summary': 5,
+    'generate-blooms-summary': 5,
+    'generate-final-report': 5,
+    # Offline template generation (lesson_plan_templates.py) only uses spare quota
+    'lesson-plan-template': 20
+}
+llm_gateway = LLMGateway(
+    LazyProxy(gemini_resource),
+    requests_per_second=float(os.getenv('LLM_REQUESTS_PER_SECOND', '5')),
+    burst=int(os.getenv('LLM_BURST', '10')),
+    max_in_flight=int(os.getenv('LLM_MAX_IN_FLIGHT', '8')),
+    endpoint_priorities=LLM_ENDPOINT_PRIORITIES,
+    max_attempts=int(os.getenv('LLM_MAX_ATTEMPTS', '3')),
+    queue_timeout=float(os.getenv('LLM_QUEUE_TIMEOUT_SECONDS', '10'))
+)
+model = CachedModel(
+    llm_gateway,
+    backend=create_cache_backend(llm_cache_backend_name, **llm_cache_options),
+    endpoint_ttls=LLM_CACHE_TTLS,
+    disabled_endpoints=endpoints_from_env(os.getenv('LLM_CACHE_DISABLED_ENDPOINTS')),
+    forward_endpoint=True
+)
+
+# Estimated input tokens allowed per prompt; oversized fields are shrunk to fit.
+# PROMPT_TOKEN_BUDGETS='generate-summary=2000,...' overrides these.
+PROMPT_TOKEN_BUDGETS = {
+    'generate-lesson-plan': 6000,
+    'initialize-lesson': 4000,
+    'lesson-generation': 3000,
+    'generate-lesson-notes': 3000,
+    'generate-final-report': 4000,
+    'generate-summary': 3000,
+    'generate-blooms-summary': 3000,
+    'ai-tutor': 2000
+}
+PROMPT_TOKEN_BUDGETS.update(budgets_from_env(os.getenv('PROMPT_TOKEN_BUDGETS')))
+
+# Lesson documents rarely change, so reads go through an in-process cache
+lesson_cache = LessonCache(
+    max_entries=int(os.getenv('LESSON_CACHE_MAX_ENTRIES', '1024')),
+    ttl_seconds=float(os.getenv('LESSON_CACHE_TTL_SECONDS', '300'))
+)
+
+# lesson_ref -> path index over the whole curriculum, kept fresh by a Firestore
+# listener that init_firestore() starts
+curriculum_index = CurriculumIndex()
+
+# time_spent updates are buffered per session and written behind as one Increment
+session_states = SessionStateStore(
+    db,
+    flush_interval=float(os.getenv('SESSION_STATE_FLUSH_INTERVAL_SECONDS', '5')),
+    max_dirty=int(os.getenv('SESSION_STATE_MAX_DIRTY', '20')),
+    max_unflushed_seconds=float(os.getenv('SESSION_STATE_MAX_UNFLUSHED_SECONDS', '30')),
+    max_sessions=int(os.getenv('SESSION_STATE_MAX_SESSIONS', '10000')),
+    touch_collection='lesson_sessions'
+)
+atexit.register(session_states.stop)
+
+# Pause/resume/progress transitions, and expiry of sessions idle for SESSION_IDLE_TIMEOUT_MINUTES
+session_engine = SessionEngine(db, session_states=session_states)
+SESSION_IDLE_TIMEOUT_SECONDS = float(os.getenv('SESSION_IDLE_TIMEOUT_MINUTES', '120')) * 60
+SESSION_SWEEP_INTERVAL_SECONDS = float(os.getenv('SESSION_SWEEP_INTERVAL_SECONDS', '0'))
+if SESSION_SWEEP_INTERVAL_SECONDS > 0:
+    session_engine.start_sweeper(SESSION_SWEEP_INTERVAL_SECONDS, SESSION_IDLE_TIMEOUT_SECONDS)
+    atexit.register(session_engine.stop_sweeper)
+
+# Student-agnostic lesson plans pre-generated by lesson_plan_templates.py
+LESSON_PLAN_TEMPLATES_ENABLED = os.getenv('LESSON_PLAN_TEMPLATES_ENABLED', 'true').lower() == 'true'
+lesson_plan_templates = LessonPlanTemplateStore(
+    db,
+    collection=os.getenv('LESSON_PLAN_TEMPLATES_COLLECTION', 'lesson_plan_templates'),
+    ttl_seconds=float(os.getenv('LESSON_PLAN_TEMPLATES_CACHE_TTL_SECONDS', '600'))
+)
 
 # ===== DYNAMIC COMPLIANCE SYSTEM =====
 BLOOMS_VERBS = {
@@ -190,13 +389,20 @@ LESSON_SCHEMA = {
     }
 }
 
+# Compiled once on first use; validating a lesson no longer re-checks the schema
+lesson_validator_resource = LazyResource('lesson_validator', lambda: LessonValidator(LESSON_SCHEMA))
+lesson_validator = LazyProxy(lesson_validator_resource)
+
+def lesson_validation_errors(data):
+    """Every schema violation in a lesson, as [{'path', 'message', 'validator'}]."""
+    with span('schema_validation'):
+        return lesson_validator.errors(data)
+
 def validate_lesson(data):
-    try:
-        validate(instance=data, schema=LESSON_SCHEMA)
-        return True
-    except ValidationError as e:
-        logger.error(f"Validation failed: {e.message}")
-        return False
+    errors = lesson_validation_errors(data)
+    for error in errors:
+        logger.error(f"Validation failed at {error['path']}: {error['message']}")
+    return not errors
 
 def validate_blooms_verbs(content, grade_level):
     required_verbs = BLOOMS_VERBS.get(grade_level, [])
@@ -205,7 +411,7 @@ def validate_blooms_verbs(content, grade_level):
     missing_verbs = [verb for verb in required_verbs if verb not in content_lower]
     
     if missing_verbs:
-        raise ValidationError(
+        raise jsonschema.ValidationError(
             f"Lesson content missing required Bloom's verbs for {grade_level}: {', '.join(missing_verbs)}"
         )
     
@@ -237,6 +443,89 @@ def parse_lesson_path(path: str) -> dict:
 #     logger.error(f"An error occurred: {e}")
 #     # ...
 
+GENERIC_INTERACTIVE_TOOLS = [
+    "virtual whiteboard",
+    "interactive quiz",
+    "digital flashcards",
+    "progress tracker",
+    "discussion board",
+    "practice exercises",
+    "visual aids",
+    "collaborative workspace"
+]
+
+def subject_interactive_tools(subject):
+    """Subject-specific tools, or generic ones for subjects without any."""
+    subject_tools = INTERACTIVE_TOOLS.get(subject, [])
+    if not subject_tools:
+        logger.warning(f"No specific tools found for {subject}, using generic interactive tools")
+        return GENERIC_INTERACTIVE_TOOLS
+    return subject_tools
+
+# Enhanced lessons are compiled once per lesson version and shared, read-only, by
+# every session on it. LESSON_ELEMENT_SEED reshuffles the interactive elements.
+compiled_lessons = CompiledLessonCache(
+    subject_interactive_tools,
+    seed=os.getenv('LESSON_ELEMENT_SEED', ''),
+    max_entries=int(os.getenv('COMPILED_LESSON_MAX_ENTRIES', '512'))
+)
+
+def build_enhanced_lesson_data(lesson_ref, lesson_path, lesson_data):
+    """
+    The compiled lesson sessions start from: interactive elements filled in
+    and the payload built, without modifying lesson_data. Returns a
+    CompiledLesson whose payload is frozen and shared.
+    """
+    # Validate input data
+    if not lesson_data:
+        raise ValueError("No lesson data provided")
+    return compiled_lessons.get_or_compile(lesson_ref, lesson_path, lesson_data)
+
+def build_session_documents(session_id, student_id, lesson_ref, lesson_path, compiled_lesson):
+    """
+    The lesson_sessions and lesson_states documents for a new session. The
+    session references the compiled lesson version rather than copying it;
+    the lesson state holds only what is specific to the student.
+    """
+    enhanced_lesson_data = compiled_lesson.payload
+    metadata = enhanced_lesson_data['metadata']
+    # Create session data
+    session_data = {
+        'session_id': session_id,
+        'student_id': student_id,
+        'lesson_ref': lesson_ref,
+        'lesson_path': lesson_path,
+        'lesson_version': compiled_lesson.content_hash,
+        'status': 'active',
+        'created_at': firestore.SERVER_TIMESTAMP,
+        'last_interaction': firestore.SERVER_TIMESTAMP,
+        'progress': 0,
+        'completion_status': 'in_progress',
+        'elapsed_seconds': 0,
+        'active_since': firestore.SERVER_TIMESTAMP,
+        'last_modified': firestore.SERVER_TIMESTAMP
+    }
+    
+    # Create lesson state with dynamic duration
+    lesson_state = {
+        'status': 'active',
+        'current_section': 0,
+        'completed_sections': [],
+        'quiz_attempts': 0,
+        'current_score': 0,
+        'interactive_elements_state': {},
+        'time_spent': 0,
+        'total_duration': metadata['estimated_duration'],
+        'last_activity': firestore.SERVER_TIMESTAMP,
+        'interaction_history': [],
+        'learning_path': {
+            'current_module': 0,
+            'modules_completed': [],
+            'next_objectives': enhanced_lesson_data['objectives'][:3] if enhanced_lesson_data['objectives'] else []
+        }
+    }
+    return session_data, lesson_state
+
 def initialize_lesson_data(student_id, lesson_ref, lesson_path, lesson_data):
     """
     Centralized function for initializing sessions and lesson states.
@@ -245,120 +534,28 @@ def initialize_lesson_data(student_id, lesson_ref, lesson_path, lesson_data):
     logger.info(f"Initializing lesson data for lesson: {lesson_ref}")
     
     try:
-        # Validate input data
-        if not lesson_data:
-            raise ValueError("No lesson data provided")
-
-        # Extract subject and metadata
-        subject = lesson_data.get('subject', '')
-        metadata = lesson_data.get('metadata', {})
-        
-        logger.debug(f"Processing lesson for subject: {subject}")
-
-        # Ensure we have the minimum required data structure
-        lesson_data.setdefault('key_concepts', [])
-        lesson_data.setdefault('sections', [])
-        lesson_data.setdefault('interactiveElements', [])
-        lesson_data.setdefault('quizzes', [])
-
-        # Get subject-specific tools or use defaults
-        subject_tools = INTERACTIVE_TOOLS.get(subject, [])
-        if not subject_tools:
-            logger.warning(f"No specific tools found for {subject}, using generic interactive tools")
-            subject_tools = [
-                "virtual whiteboard",
-                "interactive quiz",
-                "digital flashcards",
-                "progress tracker",
-                "discussion board",
-                "practice exercises",
-                "visual aids",
-                "collaborative workspace"
-            ]
-
-        # Update interactive elements ensuring we have at least basic interactivity
-        for section in lesson_data.get('sections', []):
-            if 'interactive_element' not in section:
-                section['interactive_element'] = random.choice(subject_tools)
-                logger.debug(f"Added interactive element: {section['interactive_element']}")
-
-        # Create enhanced lesson data with dynamic fields
-        enhanced_lesson_data = {
-            'lessonRef': lesson_ref,
-            'title': lesson_data.get('title', 'Untitled Lesson'),
-            'content': {
-                'introduction': lesson_data.get('introduction', ''),
-                'sections': lesson_data.get('sections', []),
-                'key_concepts': lesson_data.get('key_concepts', []),
-                'examples': lesson_data.get('examples', [])
-            },
-            'interactiveElements': lesson_data.get('interactiveElements', []),
-            'quizzes': lesson_data.get('quizzes', []),
-            'examContent': lesson_data.get('examContent', []),
-            'objectives': lesson_data.get('objectives', []),
-            'prerequisites': lesson_data.get('prerequisites', []),
-            'resources': lesson_data.get('resources', []),
-            'metadata': {
-                'difficulty_level': metadata.get('difficulty_level', 'intermediate'),
-                'estimated_duration': metadata.get('estimated_duration', 30),
-                'tags': metadata.get('tags', []),
-                'subject': subject,
-                'topic': lesson_data.get('topic', ''),
-                'grade_level': lesson_data.get('gradeLevel', ''),
-                'curriculum_alignment': lesson_data.get('curriculumAlignment', {})
-            }
-        }
+        compiled_lesson = build_enhanced_lesson_data(lesson_ref, lesson_path, lesson_data)
 
         # Generate unique session ID
         session_id = f"session_{str(uuid.uuid4())}"
+        session_data, lesson_state = build_session_documents(
+            session_id, student_id, lesson_ref, lesson_path, compiled_lesson
+        )
         
-        # Create session data
-        session_data = {
-            'session_id': session_id,
-            'student_id': student_id,
-            'lesson_ref': lesson_ref,
-            'lesson_path': lesson_path,
-            'status': 'active',
-            'created_at': firestore.SERVER_TIMESTAMP,
-            'last_interaction': firestore.SERVER_TIMESTAMP,
-            'progress': 0,
-            'completion_status': 'in_progress',
-            'last_modified': firestore.SERVER_TIMESTAMP
-        }
-        
-        logger.info(f"Creating session with ID: {session_id}")
+        # Session and state documents are written in one atomic batch commit
+        logger.info(f"Creating session and lesson state with ID: {session_id}")
         try:
-            db.collection('lesson_sessions').document(session_id).set(session_data)
+            batch = db.batch()
+            batch.set(db.collection('lesson_sessions').document(session_id), session_data)
+            batch.set(db.collection('lesson_states').document(session_id), lesson_state)
+            with span('firestore.write'):
+                batch.commit()
         except Exception as e:
-            logger.error(f"Error creating session document: {e}", exc_info=True)
+            logger.error(f"Error creating session documents: {e}", exc_info=True)
             raise  # Re-raise the exception to be handled by the caller
+        session_states.prime(session_id, lesson_state)
 
-        # Create lesson state with dynamic duration
-        lesson_state = {
-            'current_section': 0,
-            'completed_sections': [],
-            'quiz_attempts': 0,
-            'current_score': 0,
-            'interactive_elements_state': {},
-            'time_spent': 0,
-            'total_duration': metadata.get('estimated_duration', 30),
-            'last_activity': firestore.SERVER_TIMESTAMP,
-            'interaction_history': [],
-            'learning_path': {
-                'current_module': 0,
-                'modules_completed': [],
-                'next_objectives': enhanced_lesson_data['objectives'][:3] if enhanced_lesson_data['objectives'] else []
-            }
-        }
-        
-        logger.info(f"Creating lesson state for session: {session_id}")
-        try:
-            db.collection('lesson_states').document(session_id).set(lesson_state)
-        except Exception as e:
-            logger.error(f"Error creating lesson state document: {e}", exc_info=True)
-            raise  # Re-raise the exception
-
-        return session_id, enhanced_lesson_data, lesson_state
+        return session_id, compiled_lesson.payload, lesson_state
 
     except Exception as e:
         if tool not in allowed_tools:
@@ -373,6 +570,49 @@ def initialize_lesson_data(student_id, lesson_ref, lesson_path, lesson_data):
     
     return lesson_data
 
+# Each student's session writes two documents
+CLASSROOM_SESSIONS_PER_BATCH = MAX_BATCH_WRITES // 2
+CLASSROOM_MAX_STUDENTS = int(os.getenv('CLASSROOM_MAX_STUDENTS', '500'))
+
+def initialize_classroom_sessions(student_ids, lesson_ref, lesson_path, lesson_data):
+    """
+    Start one session per student on the same lesson. The lesson is enhanced
+    once and every student's session and state documents are written in
+    batches of CLASSROOM_SESSIONS_PER_BATCH students.
+    Returns (sessions, failed_student_ids, enhanced_lesson_data, lesson_state);
+    students in a batch that failed to commit have no session.
+    """
+    compiled_lesson = build_enhanced_lesson_data(lesson_ref, lesson_path, lesson_data)
+    sessions = []
+    failed_student_ids = []
+    lesson_state = None
+
+    for offset in range(0, len(student_ids), CLASSROOM_SESSIONS_PER_BATCH):
+        chunk = student_ids[offset:offset + CLASSROOM_SESSIONS_PER_BATCH]
+        batch = db.batch()
+        created = []
+        for student_id in chunk:
+            session_id = f"session_{str(uuid.uuid4())}"
+            session_data, lesson_state = build_session_documents(
+                session_id, student_id, lesson_ref, lesson_path, compiled_lesson
+            )
+            batch.set(db.collection('lesson_sessions').document(session_id), session_data)
+            batch.set(db.collection('lesson_states').document(session_id), lesson_state)
+            created.append({'student_id': student_id, 'session_id': session_id})
+        try:
+            with span('firestore.write'):
+                batch.commit()
+        except Exception as e:
+            logger.error(f"Error creating {len(chunk)} classroom sessions: {e}", exc_info=True)
+            failed_student_ids.extend(chunk)
+            continue
+        for session in created:
+            session_states.prime(session['session_id'], lesson_state)
+        sessions.extend(created)
+
+    logger.info(f"Created {len(sessions)} classroom sessions for lesson: {lesson_ref}")
+    return sessions, failed_student_ids, compiled_lesson.payload, lesson_state
+
 def calculate_progress(lesson_state):
     """
     Calculate the progress of the lesson based on completed sections.
@@ -383,15 +623,16 @@ def calculate_progress(lesson_state):
         return 0
     return (completed_sections / total_sections) * 100
 
-def generate_lesson_prompt(grade, subject, curriculum):
-    return f"""
+LESSON_GENERATION_PROMPT = PromptTemplate(
+    'lesson-generation',
+    """
     Generate a COMPLETE lesson plan for {grade} following {curriculum} standards.
     Include ALL sections below with STRICT adherence to:
     
-    - 3 interactive elements from: {INTERACTIVE_TOOLS.get(subject, [])}
+    - 3 interactive elements from: {interactive_tools}
     - 2 quizzes (1 multiple-choice, 1 practical)
     - Nigerian context examples
-    - Bloom's verbs: {BLOOMS_VERBS.get(grade, [])}
+    - Bloom's verbs: {blooms_verbs}
     
     Respond ONLY in this JSON format:
     {{
@@ -419,7 +660,17 @@ def generate_lesson_prompt(grade, subject, curriculum):
             "tags": ["...", ...]
         }}
     }}
-    """
+    """,
+    budget=PROMPT_TOKEN_BUDGETS.get('lesson-generation')
+)
+
+def generate_lesson_prompt(grade, subject, curriculum):
+    return LESSON_GENERATION_PROMPT.render(
+        grade=grade,
+        curriculum=curriculum,
+        interactive_tools=INTERACTIVE_TOOLS.get(subject, []),
+        blooms_verbs=BLOOMS_VERBS.get(grade, [])
+    )
 
 def enhance_nigerian_context(lesson_data):
     nigerian_keywords = ["Nigeria", "Nigerian", "Naija", "Lagos", "Abuja"]
@@ -438,7 +689,8 @@ def enhance_nigerian_context(lesson_data):
 def validate_response(gemini_response):
     try:
         data = json.loads(gemini_response)
-        validate(instance=data, schema=LESSON_SCHEMA)
+        if not lesson_validator.is_valid(data):
+            return False
         
         # Check for interactive elements
         if sum(1 for section in data['sections'] if section.get('interactive_element')) < 2:
@@ -449,7 +701,7 @@ def validate_response(gemini_response):
             return False
             
         return True
-    except (json.JSONDecodeError, ValidationError):
+    except (json.JSONDecodeError, jsonschema.ValidationError):
         return False
 
 def adjust_difficulty(lesson_data, student_history):
@@ -471,12 +723,396 @@ def adjust_difficulty(lesson_data, student_history):
     
     return lesson_data
 
-# ===== ROUTES =====
+# ===== SHARED REQUEST HELPERS =====
+# Used by the Flask routes below and by the async handlers in asgi_app.py
+GEMINI_TIMEOUT = 30  # seconds
+
+def llm_unavailable_response(error):
+    """503 with Retry-After for calls the LLM gateway shed or gave up on."""
+    logger.warning(f"Gemini unavailable: {error}")
+    body, status_code, headers = create_response(
+        False, 'AI service is busy, please retry shortly', {'retry_after': round(error.retry_after, 1)}, status_code=503
+    )
+    headers['Retry-After'] = str(max(1, int(error.retry_after + 0.999)))
+    return body, status_code, headers
+
+BLOOM_LEVELS = ["remembering", "understanding", "applying", "analyzing", "evaluating", "creating"]
+
+def build_bloom_prompt(interaction_text):
+    return (
+        f"Analyze the following student interaction text:\n\n"
+        f"\"{interaction_text}\"\n\n"
+        "1. Identify which Bloom's taxonomy level (remembering, understanding, applying, analyzing, evaluating, creating) best applies.\n"
+        "2. Provide a short reason or rationale.\n"
+    )
+
+def bloom_level_key(bloom_result):
+    """bloom_analysis counter that a classifier reply is tallied under."""
+    level = bloom_result.strip().lower()
+    return level if level in BLOOM_LEVELS else "unknown"
+
+def lesson_analysis_id(student_id, lesson_ref):
+    return f"{student_id}_{lesson_ref}"
+
+def build_interaction_writes(student_id, lesson_ref, interaction_data, engagement_rate):
+    """
+    Writes that record one interaction without reading anything back.
+    Returns (interaction_doc, analysis_update): the interaction is appended as
+    its own document in the lesson_analysis/{id}/interactions log, and the
+    aggregates on the lesson_analysis document advance by atomic transforms,
+    so the cost per interaction stays constant however long the session runs.
+    The Bloom level is filled in later by the background classifier.
+    """
+    interaction_data['interaction_id'] = str(uuid.uuid4())
+    interaction_data['bloom_level'] = 'pending'
+
+    interaction_doc = dict(interaction_data)
+    interaction_doc['recorded_at'] = firestore.SERVER_TIMESTAMP
+
+    analysis_update = InteractionAggregate().update(interaction_data).to_increments()
+    analysis_update.update({
+        'student_id': student_id,
+        'lesson_ref': lesson_ref,
+        'engagement_rate': engagement_rate,
+        'last_interaction_at': firestore.SERVER_TIMESTAMP
+    })
+    return interaction_doc, analysis_update
+
+def analysis_averages(analysis, interaction_data):
+    """
+    Derived fields of a lesson_analysis document once interaction_data is
+    folded into it. Transforms cannot maintain an average, so these are
+    written alongside the running sums from the document as read.
+    """
+    aggregate = InteractionAggregate.from_document(analysis).merge(InteractionAggregate().update(interaction_data))
+    return {'avg_response_time': aggregate.avg_response_time}
+
+def record_interaction(student_id, lesson_ref, interaction_data, engagement_rate):
+    """
+    Append an interaction to the log and fold it into the aggregates in one
+    transaction. Only the lesson_analysis document is read, to keep
+    avg_response_time current, so the cost stays constant.
+    """
+    interaction_doc, analysis_update = build_interaction_writes(
+        student_id, lesson_ref, interaction_data, engagement_rate
+    )
+    analysis_ref = db.collection('lesson_analysis').document(lesson_analysis_id(student_id, lesson_ref))
+    interaction_ref = analysis_ref.collection('interactions').document(interaction_doc['interaction_id'])
+
+    @firestore.transactional
+    def write(transaction):
+        analysis = analysis_ref.get(transaction=transaction).to_dict() or {}
+        transaction.create(interaction_ref, interaction_doc)
+        transaction.set(analysis_ref, {**analysis_update, **analysis_averages(analysis, interaction_data)}, merge=True)
+
+    with span('firestore.write'):
+        write(db.transaction())
+    return interaction_doc['interaction_id']
+
+def enqueue_bloom_classification(student_id, lesson_ref, interaction_data):
+    """Queue an interaction recorded by record_interaction for Bloom classification."""
+    bloom_workers.submit({
+        'analysis_id': lesson_analysis_id(student_id, lesson_ref),
+        'interaction_id': interaction_data['interaction_id'],
+        'text': interaction_data.get('text', '')
+    })
+
+TUTOR_PROMPT = PromptTemplate(
+    'ai-tutor',
+    "The student asked: '{question}'. Provide a detailed explanation for the lesson '{lesson_path}'.",
+    elastic=('question',),
+    budget=PROMPT_TOKEN_BUDGETS.get('ai-tutor')
+)
+SUMMARY_PROMPT = PromptTemplate(
+    'generate-summary',
+    "Based on this data: {analytics_data}, create a detailed performance summary.",
+    elastic=('analytics_data',),
+    budget=PROMPT_TOKEN_BUDGETS.get('generate-summary')
+)
+BLOOMS_SUMMARY_PROMPT = PromptTemplate(
+    'generate-blooms-summary',
+    "Analyze this data: {bloom_data}, and summarize cognitive engagement across Bloom's levels.",
+    elastic=('bloom_data',),
+    budget=PROMPT_TOKEN_BUDGETS.get('generate-blooms-summary')
+)
+
+def build_tutor_prompt(question, lesson_path):
+    return TUTOR_PROMPT.render(question=question, lesson_path=lesson_path)
+
+def build_summary_prompt(analytics_data):
+    return SUMMARY_PROMPT.render(analytics_data=analytics_data)
+
+def build_blooms_summary_prompt(bloom_data):
+    return BLOOMS_SUMMARY_PROMPT.render(bloom_data=bloom_data)
+
+LESSON_PLAN_REQUIRED_FIELDS = {
+    'lessonRef': str,
+    'studentId': str,
+    'learningObjectives': list,
+    'country': str,
+    'curriculum': str,
+    'grade': str,
+    'level': str,
+    'subject': str
+}
+
+def parse_lesson_plan_request(data):
+    """
+    Validate a /generate-lesson-plan payload.
+    Returns the required fields; raises ValueError on invalid input.
+    """
+    if not data:
+        raise ValueError('Invalid JSON data')
+
+    missing = [field for field, _ in LESSON_PLAN_REQUIRED_FIELDS.items() if field not in data]
+    if missing:
+        raise ValueError(f'Missing required fields: {", ".join(missing)}')
+
+    learning_objectives = data['learningObjectives']
+    if not isinstance(learning_objectives, list) or len(learning_objectives) == 0:
+        raise ValueError("Invalid learning objectives format")
+
+    return {field: data[field] for field in LESSON_PLAN_REQUIRED_FIELDS}
+
+LESSON_PLAN_PROMPT = PromptTemplate(
+    'generate-lesson-plan',
+    """
+        You are an AI teacher preparing a comprehensive lesson plan for an individual student, {student_id}, on the topic of '{topic}' for {grade} level. This lesson plan is for you to deliver directly to this student in a one-on-one, interactive online setting.
+
+        Subject: {subject}
+        Topic: {topic}
+        Grade Level: {grade}
+        Country: {country}
+        Curriculum: {curriculum}
+        Lesson Reference: {lesson_ref}
+        Student ID: {student_id}
+
+        Learning Objectives:
+        - {learning_objectives}
+
+        Lesson Duration: {lesson_duration} (Please adhere to this duration)
+
+        Lesson Structure:
+        1. Introduction (approx. {intro_time}):
+            - As the AI teacher, I will begin by greeting the student personally, using their ID, {student_id}.
+            - I will introduce the topic, {topic}, and explain why it's relevant to them.
+            - I will use an engaging opening, such as a surprising fact or a real-world scenario related to {topic}, to capture the student's attention. **Do not use video clips.**
+        2. Key Concepts (approx. {key_concepts_time}):
+            - I will explain the key concepts clearly and concisely, using simple, age-appropriate language for {grade} students.
+            - I will use a virtual whiteboard to write down definitions and create simple diagrams or charts.
+            - For each key concept, I will pause and ask the student a question to check for understanding, encouraging them to respond in the chat. For example, I might ask, "{student_id}, can you give me an example of [key concept] in your daily life?".
+            - I will provide at least 3 real-world examples to illustrate each concept, ensuring they are relevant to students' lives in {country}.
+        3. Guided Practice (approx. {guided_practice_time}):
+            - I will engage the student in interactive activities to practice the concepts.
+            - For example, I might present a problem on the virtual whiteboard and ask the student to solve it step-by-step, providing guidance and feedback through the chat.
+            - I will use questions like, "{student_id}, how would you apply [key concept] in this situation?" to encourage critical thinking.
+            - I will provide immediate feedback and prompts during these activities to keep the student on track.
+        4. Assessment (approx. {assessment_time}):
+            - I will conduct a short quiz with exactly 10 questions to assess the student's understanding.
+            - The quiz will include a variety of question types: 
+                - 4 multiple-choice questions
+                - 3 fill-in-the-gap questions
+                - 3 short answer questions.
+            - **Generate specific quiz questions and answers relevant to '{topic}' and '{subject}', suitable for '{grade}' students in '{country}' following the '{curriculum}' curriculum. Ensure that these questions align with the Bloom's Taxonomy levels: {blooms_levels}. Provide the correct answers to the quiz questions immediately after each question.**
+            - I will provide immediate feedback on each answer, explaining the correct answer if the student's response is incorrect.
+        5. Conclusion (approx. {conclusion_time}):
+            - I will summarize the key takeaways from the lesson, emphasizing the main learning objectives.
+            - I will offer encouraging words and acknowledge the student's participation, using their ID, {student_id}.
+            - I will preview the next lesson or suggest related topics for the student to explore.
+
+        Interactive Elements:
+        - Throughout the lesson, I will frequently ask questions and encourage the student to respond in the chat.
+        - I will use polls to quickly check for understanding and keep the student engaged.
+        - I will use a virtual whiteboard for interactive problem-solving and demonstrations.
+        - I will provide immediate feedback on student responses and adapt my teaching style based on their interaction.
+        - I will use interactive elements such as **graphs, charts, animations, flashcards, drag-and-drop activities, and simulations** to enhance understanding and engagement. **Do not suggest videos.**
+
+        Visual Aids:
+        - I will use diagrams, images, and charts to explain complex concepts visually.
+        - **Instead of video clips, I will use animations and interactive simulations** to demonstrate practical examples of the key concepts.
+
+        Tone and Style:
+        - I will maintain a conversational, encouraging, and engaging tone throughout the lesson.
+        - I will keep the language simple and easy to understand, suitable for {grade} students.
+        - I will address the student directly using their ID, {student_id}.
+        - I will use positive reinforcement and encouragement to build confidence.
+
+        Differentiation:
+        - For a student who is struggling, I will offer additional explanations, simplified examples, and one-on-one support through the chat.
+        - For an advanced student, I will pose extra challenge questions related to {topic} and encourage them to explore the subject further independently.
+
+        Materials:
+        - Virtual whiteboard
+        - Presentation software (e.g., Google Slides, PowerPoint)
+        - Digital resources (e.g., relevant websites, interactive simulations, **but no videos**)
+        - Poll creation tool
+        - Chat feature for student interaction
+
+        Please generate the complete lesson plan now, following the specified structure and guidelines, assuming the role of the AI teacher delivering the lesson in a personalized, one-on-one online setting. **Generate specific examples and quiz questions. Do not include any video suggestions or placeholders.**
+    """,
+    elastic=('learning_objectives', 'blooms_levels'),
+    budget=PROMPT_TOKEN_BUDGETS.get('generate-lesson-plan')
+)
+
+def lesson_plan_prompt_fields(lesson_data):
+    """The parts of the /generate-lesson-plan prompt that come from the lesson document."""
+    # Data extraction with fallbacks
+    metadata = lesson_data.get('metadata', {})
+    blooms_levels = metadata.get('blooms_level', metadata.get('BloomsLevel', ["unspecified"]))
+    lesson_time_length = metadata.get('estimated_duration', '30 min')
+
+    # Time allocation logic
+    instructional_steps = lesson_data.get('instructionalSteps') or []
+    if not instructional_steps:
+        logger.warning("No instructional steps found in document")
+    time_allocation = {
+        'intro': lesson_data.get('introduction', {}).get('sectionTimeLength', '5 min'),
+        'key_concepts': '10 min',
+        'guided_practice': '10 min',
+        'assessment': '5 min',
+        'conclusion': '5 min'
+    }
+
+    for step in instructional_steps:
+        title = step.get('sectionTitle', '').lower()
+        if 'key concept' in title:
+            time_allocation['key_concepts'] = step.get('sectionTimeLength', time_allocation['key_concepts'])
+        elif 'guided practice' in title:
+            time_allocation['guided_practice'] = step.get('sectionTimeLength', time_allocation['guided_practice'])
+        elif 'assessment' in title:
+            time_allocation['assessment'] = step.get('sectionTimeLength', time_allocation['assessment'])
+
+    return {
+        'topic': lesson_data.get('topic', 'Untitled Topic'),
+        'lesson_duration': lesson_time_length,
+        'intro_time': time_allocation['intro'],
+        'key_concepts_time': time_allocation['key_concepts'],
+        'guided_practice_time': time_allocation['guided_practice'],
+        'assessment_time': time_allocation['assessment'],
+        'conclusion_time': time_allocation['conclusion'],
+        'blooms_levels': ", ".join(blooms_levels)
+    }
+
+def lesson_prompt_template(template, lesson_path, lesson_data, lesson_fields):
+    """
+    template with lesson_fields(lesson_data) filled in. With the lesson's
+    path known, that is done once per lesson version and reused.
+    """
+    if lesson_path is None:
+        return template.bind(**lesson_fields(lesson_data))
+    version = compiled_lessons.version(lesson_path, lesson_data)
+    return template.bind_cached((lesson_path, version), lambda: lesson_fields(lesson_data))
+
+def build_lesson_plan_prompt(lesson_data, lesson_ref, student_id, learning_objectives,
+                             country, curriculum, grade, subject, lesson_path=None):
+    """Build the Gemini prompt for /generate-lesson-plan from a lesson document."""
+    template = lesson_prompt_template(LESSON_PLAN_PROMPT, lesson_path, lesson_data, lesson_plan_prompt_fields)
+    return template.render(
+        student_id=student_id,
+        lesson_ref=lesson_ref,
+        learning_objectives=", ".join(learning_objectives),
+        country=country,
+        curriculum=curriculum,
+        grade=grade,
+        subject=subject
+    )
+
+def build_lesson_plan_template_prompt(lesson_data, lesson_ref, learning_objectives,
+                                      country, curriculum, grade, subject, lesson_path=None):
+    """The /generate-lesson-plan prompt with a placeholder where the student ID goes."""
+    return build_lesson_plan_prompt(
+        lesson_data, lesson_ref, STUDENT_PLACEHOLDER, learning_objectives,
+        country, curriculum, grade, subject, lesson_path=lesson_path
+    ) + PLACEHOLDER_INSTRUCTION
+
+def lookup_lesson_plan_template(lesson_path, lesson_data, params):
+    """
+    The pre-generated plan for this lesson, personalized for the student, or
+    None if there is no template matching what the request would generate.
+    """
+    if not LESSON_PLAN_TEMPLATES_ENABLED:
+        return None
+    prompt = build_lesson_plan_template_prompt(
+        lesson_data, params['lessonRef'], params['learningObjectives'],
+        params['country'], params['curriculum'], params['grade'], params['subject'], lesson_path=lesson_path
+    )
+    try:
+        with span('lesson_plan_template'):
+            template = lesson_plan_templates.lookup(lesson_path, prompt)
+    except Exception as e:
+        logger.warning(f"Lesson plan template lookup failed, generating live: {e}")
+        return None
+    return personalize(template, params['studentId']) if template else None
+
+INITIALIZE_LESSON_PROMPT = PromptTemplate(
+    'initialize-lesson',
+    """
+            Generate a COMPLETE lesson plan for {grade} students in {country} following {curriculum}.
+            Include ALL sections below:
+
+            # Required Format
+            ## Lesson Title: {lesson_title}
+
+            ### Key Concepts (3-5 items):
+            {key_concepts}
+
+            ### Interactive Elements:
+            {interactive_elements}
+
+            ### Lesson Sections (45 minute total):
+            1. Introduction ({intro_time}):
+                - Hook: {hook}
+                - Objectives: {learning_objectives}
+
+            2. Core Content:
+                {core_content}
+
+            3. Practice Activities:
+                {practice_activities}
+
+            4. Assessment:
+                - {quiz_count} quiz questions
+                - Practical application questions
+
+            ### Differentiation Strategies:
+            {differentiation}
+
+            Format response as JSON with all relevant sections.""",
+    elastic=('key_concepts', 'interactive_elements', 'hook', 'learning_objectives', 'core_content',
+             'practice_activities', 'differentiation'),
+    budget=PROMPT_TOKEN_BUDGETS.get('initialize-lesson')
+)
+
+def initialize_lesson_prompt_fields(lesson_data):
+    """The parts of the /initialize-lesson prompt that come from the lesson document."""
+    instructional_steps = lesson_data.get('instructionalSteps', [])
+    return {
+        'lesson_title': lesson_data.get('lessonTitle', '[Creative Title Here]'),
+        'key_concepts': ', '.join(lesson_data.get('key_concepts', [])),
+        'interactive_elements': ', '.join([step.get('tool', '') for step in instructional_steps]),
+        'intro_time': lesson_data.get('introduction', {}).get('sectionTimeLength', '5 min'),
+        'hook': lesson_data.get('introduction', {}).get('text', ''),
+        'core_content': ', '.join([step.get('description', '') for step in instructional_steps]),
+        'practice_activities': ', '.join(lesson_data.get('extensionActivities', [])),
+        'quiz_count': len(lesson_data.get('quizzesAndAssessments', [])),
+        'differentiation': lesson_data.get('adaptiveStrategies', '')
+    }
+
+def build_initialize_lesson_prompt(lesson_data, learning_objectives, grade, country, curriculum, lesson_path=None):
+    """Lesson prompt returned by /initialize-lesson; it does not depend on the student."""
+    template = lesson_prompt_template(INITIALIZE_LESSON_PROMPT, lesson_path, lesson_data, initialize_lesson_prompt_fields)
+    return template.render(
+        learning_objectives=', '.join(learning_objectives),
+        grade=grade,
+        country=country,
+        curriculum=curriculum
+    )
+
 @app.route('/initialize-lesson', methods=['POST'])
 def initialize_lesson():
     try:
         data = request.get_json()
-        logger.debug(f"Received initialization request with data: {data}")
+        logger.debug("Received initialization request with data: %s", truncated(data))
 
         student_id = data.get('student_id')
         lesson_ref = data.get('lesson_ref')
@@ -509,7 +1145,7 @@ def initialize_lesson():
                 lesson_ref, country, curriculum, grade, level, subject
             )
             logger.debug(f"Found lesson at path: {lesson_path}")
-            logger.debug(f"Lesson data: {lesson_data}")
+            logger.debug("Lesson data: %s", truncated(lesson_data))
 
             # Update the learning objectives in lesson_data
             lesson_data['learningObjectives'] = learning_objectives
@@ -528,38 +1164,9 @@ def initialize_lesson():
             logger.debug(f"Lesson initialized with session_id: {session_id}")
 
             # Generate lesson prompt with the learning objectives
-            lesson_prompt = f"""
-            Generate a COMPLETE lesson plan for {grade} students in {country} following {curriculum}.
-            Include ALL sections below:
-
-            # Required Format
-            ## Lesson Title: {lesson_data.get('lessonTitle', '[Creative Title Here]')}
-
-            ### Key Concepts (3-5 items):
-            {', '.join(lesson_data.get('key_concepts', []))}
-
-            ### Interactive Elements:
-            {', '.join([step.get('tool', '') for step in lesson_data.get('instructionalSteps', [])])}
-
-            ### Lesson Sections (45 minute total):
-            1. Introduction ({lesson_data.get('introduction', {}).get('sectionTimeLength', '5 min')}):
-                - Hook: {lesson_data.get('introduction', {}).get('text', '')}
-                - Objectives: {', '.join(learning_objectives)}
-
-            2. Core Content:
-                {', '.join([step.get('description', '') for step in lesson_data.get('instructionalSteps', [])])}
-
-            3. Practice Activities:
-                {', '.join(lesson_data.get('extensionActivities', []))}
-
-            4. Assessment:
-                - {len(lesson_data.get('quizzesAndAssessments', []))} quiz questions
-                - Practical application questions
-
-            ### Differentiation Strategies:
-            {lesson_data.get('adaptiveStrategies', '')}
-
-            Format response as JSON with all relevant sections."""
+            lesson_prompt = build_initialize_lesson_prompt(
+                lesson_data, learning_objectives, grade, country, curriculum, lesson_path=lesson_path
+            )
 
         except Exception as e:
             logger.error(f"Error initializing lesson data: {str(e)}", exc_info=True)
@@ -580,6 +1187,81 @@ def initialize_lesson():
         logger.error(f"Unexpected error in initialize_lesson: {str(e)}", exc_info=True)
         return create_response(False, "Internal server error", status_code=500)
 
+@app.route('/initialize-classroom', methods=['POST'])
+def initialize_classroom():
+    """
+    Start the same lesson for a whole class: one lesson read, one enhanced
+    lesson build and a batched commit per 250 students, instead of a full
+    /initialize-lesson round per student. Takes student_ids plus the fields
+    /initialize-lesson takes, and returns every student's session_id.
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return create_response(False, 'Invalid JSON data', status_code=400)
+
+        student_ids = data.get('student_ids')
+        lesson_ref = data.get('lesson_ref')
+        country = data.get('country')
+        curriculum = data.get('curriculum')
+        grade = data.get('grade')
+        level = data.get('level')
+        subject = data.get('subject')
+        learning_objectives = data.get('learningObjectives', [])
+
+        missing = [field for field, value in {
+            'student_ids': student_ids,
+            'lesson_ref': lesson_ref,
+            'country': country,
+            'curriculum': curriculum,
+            'grade': grade,
+            'level': level,
+            'subject': subject
+        }.items() if not value]
+        if missing:
+            return create_response(False, f'Missing required fields: {", ".join(missing)}', status_code=400)
+        if not isinstance(student_ids, list) or not all(isinstance(student_id, str) and student_id for student_id in student_ids):
+            return create_response(False, 'student_ids must be a list of non-empty strings', status_code=400)
+        # A student listed twice still gets one session
+        student_ids = list(dict.fromkeys(student_ids))
+        if len(student_ids) > CLASSROOM_MAX_STUDENTS:
+            return create_response(False, f'At most {CLASSROOM_MAX_STUDENTS} students per request', status_code=400)
+
+        try:
+            lesson_path, lesson_data = find_lesson_by_ref(
+                lesson_ref, country, curriculum, grade, level, subject
+            )
+            lesson_data['learningObjectives'] = learning_objectives
+        except Exception as e:
+            logger.error(f"Error finding lesson: {str(e)}", exc_info=True)
+            return create_response(False, str(e), status_code=404)
+
+        sessions, failed_student_ids, enhanced_data, lesson_state = initialize_classroom_sessions(
+            student_ids, lesson_ref, lesson_path, lesson_data
+        )
+        result = {
+            'sessions': sessions,
+            'lessonData': enhanced_data,
+            'state': lesson_state,
+            'lessonPrompt': build_initialize_lesson_prompt(
+                lesson_data, learning_objectives, grade, country, curriculum, lesson_path=lesson_path
+            )
+        }
+        if failed_student_ids:
+            # Sessions that were committed stay; the client retries only the failed students
+            result['failed_student_ids'] = failed_student_ids
+            return create_response(
+                False,
+                f'Initialized {len(sessions)} of {len(student_ids)} sessions',
+                result,
+                status_code=500
+            )
+        return create_response(True, f'Initialized {len(sessions)} sessions', result)
+
+    except Exception as e:
+        logger.error(f"Unexpected error in initialize_classroom: {str(e)}", exc_info=True)
+        return create_response(False, "Internal server error", status_code=500)
+
 @app.route('/pause-lesson', methods=['POST'])
 def pause_lesson():
     try:
@@ -591,12 +1273,13 @@ def pause_lesson():
         if not session_id:
             return create_response(False, 'Missing session_id', status_code=400)
 
-        db.collection('lesson_sessions').document(session_id).update({
-            'status': 'paused',
-            'last_active': timestamp,
-            'pause_reason': reason
-        })
-        return create_response(True, 'Lesson paused successfully')
+        with span('firestore.write'):
+            session = session_engine.pause(session_id, timestamp, reason)
+        return create_response(True, 'Lesson paused successfully', session)
+    except SessionNotFound as e:
+        return create_response(False, str(e), status_code=404)
+    except InvalidTransition as e:
+        return create_response(False, str(e), status_code=409)
     except Exception as e:
         logger.error(f"Full error details: {traceback.format_exc()}")
         logger.debug(f"Current create_response type: {type(create_response)}")
@@ -612,11 +1295,13 @@ def resume_lesson():
         if not session_id:
             return create_response(False, 'Missing session_id', status_code=400)
 
-        db.collection('lesson_sessions').document(session_id).update({
-            'status': 'active',
-            'last_resumed': timestamp
-        })
-        return create_response(True, 'Lesson resumed successfully')
+        with span('firestore.write'):
+            session = session_engine.resume(session_id, timestamp)
+        return create_response(True, 'Lesson resumed successfully', session)
+    except SessionNotFound as e:
+        return create_response(False, str(e), status_code=404)
+    except InvalidTransition as e:
+        return create_response(False, str(e), status_code=409)
     except Exception as e:
         logger.error(f"Full error details: {traceback.format_exc()}")
         logger.debug(f"Current create_response type: {type(create_response)}")
@@ -651,10 +1336,21 @@ def generate_notes():
 def fetch_lesson_data(lesson_ref):
     """
     Fetch lesson data from Firestore based on the lesson_ref.
+    The curriculum index resolves the ref to its path without a query.
     """
     try:
-        # Query Firestore for the lesson document
-        lesson_query = db.collection('lessons').where('lessonRef', '==', lesson_ref).get()
+        entry = curriculum_index.lookup(lesson_ref)
+        if entry is not None:
+            _, lesson_data = find_lesson_by_ref(
+                lesson_ref, entry.country, entry.curriculum, entry.grade, entry.level, entry.subject
+            )
+            return lesson_data
+        if curriculum_index_ready():
+            return None
+
+        # Index still loading: query Firestore for the lesson document
+        with span('firestore.read'):
+            lesson_query = db.collection('lessons').where('lessonRef', '==', lesson_ref).get()
         if lesson_query:
             return lesson_query[0].to_dict()  # Return the first matching document
         return None
@@ -669,110 +1365,54 @@ def process_interaction():
         student_id = data.get('student_id')
         lesson_ref = data.get('lesson_ref')
         session_id = data.get('session_id')  # Added session_id
-        interaction_data = data.get('interaction_data', {})
-        interaction_duration = interaction_data.get('duration', 0)  # In minutes
-
-        if not all([student_id, lesson_ref, session_id]):
-            return create_response(False, 'Missing required fields', status_code=400)
-
-        # Get lesson state to update time spent
-        lesson_state_ref = db.collection('lesson_states').document(session_id)
-        lesson_state = lesson_state_ref.get().to_dict() or {}
-        
-        # Update time spent with validation
-        current_time_spent = lesson_state.get('time_spent', 0)
-        new_time_spent = current_time_spent + max(interaction_duration, 0)  # Prevent negative values
-        total_duration = lesson_state.get('total_duration', 30)  # Default to 30 mins
-        
-        # Update lesson state
-        lesson_state_ref.update({'time_spent': new_time_spent})
-
-        # Calculate meaningful engagement rate
-        engagement_rate = calculate_engagement(new_time_spent, total_duration)
-
-        # Rest of the processing remains similar but uses engagement_rate
-        doc_ref = db.collection('lesson_analysis').document(f"{student_id}_{lesson_ref}")
-        doc = doc_ref.get()
-        
-        if (doc.exists()):
-            doc_data = doc.to_dict()
-            interactions = doc_data.get('interactions', [])
-        else:
-            doc_data = {
-                'student_id': student_id,
-                'lesson_ref': lesson_ref,
-                'interactions': [],
-                'engagement_rate': 0,
-                'avg_response_time': 0,
-                'tool_usage': {},
-                'topics_mastered': [],
-                'topics_struggled': [],
-                'bloom_analysis': {}
-            }
-            interactions = []
-
-        # 1. Get the interaction text
-        interaction_text = interaction_data.get('text', '')
+        interaction_data = data.get('interaction_data', {})
+        interaction_duration = interaction_data.get('duration', 0)  # In minutes
 
-        # 2. Build a prompt for Gemini
-        prompt = (
-            f"Analyze the following student interaction text:\n\n"
-            f"\"{interaction_text}\"\n\n"
-            "1. Identify which Bloom's taxonomy level (remembering, understanding, applying, analyzing, evaluating, creating) best applies.\n"
-            "2. Provide a short reason or rationale.\n"
-        )
+        if not all([student_id, lesson_ref, session_id]):
+            return create_response(False, 'Missing required fields', status_code=400)
 
-        # 3. Send the prompt to Gemini
-        try:
-            gemini_response = model.generate_content(
-                prompt,
-                request_options={'timeout': 30}  # 30-second timeout
+        # Update time spent with validation; the write to lesson_states is buffered
+        with span('session_state'):
+            new_time_spent, total_duration = session_states.add_time_spent(
+                session_id, max(interaction_duration, 0)  # Prevent negative values
             )
-            if gemini_response:
-                bloom_result = gemini_response.text.strip()
-            else:
-                bloom_result = "Unable to classify"
-        except Exception as e:
-            logger.error(f"Gemini API Error: {str(e)}")
-            return create_response(False, f"Gemini API Error: {str(e)}", status_code=500)
 
-        # 4. Parse or store the result
-        interaction_data['bloom_level'] = bloom_result
+        # Calculate meaningful engagement rate
+        engagement_rate = calculate_engagement(new_time_spent, total_duration)
 
-        # 5. Append the new interaction and update analysis
-        interactions.append(interaction_data)
+        # 1. Append the raw interaction to the log and update the running aggregates
+        interaction_id = record_interaction(student_id, lesson_ref, interaction_data, engagement_rate)
 
-        valid_levels = ["remembering", "understanding", "applying", "analyzing", "evaluating", "creating"]
-        bloom_analysis = doc_data.get('bloom_analysis', {})
-        if bloom_result.lower() in valid_levels:
-            bloom_analysis[bloom_result.lower()] = bloom_analysis.get(bloom_result.lower(), 0) + 1
-        else:
-            bloom_analysis["unknown"] = bloom_analysis.get("unknown", 0) + 1
-
-        avg_response_time = calculate_avg_response_time(interactions)
-        tool_usage = aggregate_tool_usage(interactions)
-        topics_mastered = update_topics(doc_data, interaction_data, 'mastered')
-        topics_struggled = update_topics(doc_data, interaction_data, 'struggled')
-
-        # 6. Update document data and save to Firestore in lesson_analysis collection
-        doc_data.update({
-            'interactions': interactions,
-            'engagement_rate': engagement_rate,
-            'avg_response_time': avg_response_time,
-            'tool_usage': tool_usage,
-            'topics_mastered': topics_mastered,
-            'topics_struggled': topics_struggled,
-            'bloom_analysis': bloom_analysis
+        # 2. Bloom classification happens in the background workers
+        enqueue_bloom_classification(student_id, lesson_ref, interaction_data)
+        return create_response(True, "Interaction processed successfully", {
+            'interaction_id': interaction_id,
+            'engagement_rate': engagement_rate
         })
 
-        doc_ref.set(doc_data)
-        return create_response(True, "Interaction processed successfully", doc_data)
-
     except Exception as e:
         logger.error(f"Full error details: {traceback.format_exc()}")
         logger.debug(f"Current create_response type: {type(create_response)}")
         return create_response(False, str(e), status_code=500)
 
+@app.route('/lesson-analysis/<student_id>/<lesson_ref>', methods=['GET'])
+def get_lesson_analysis(student_id, lesson_ref):
+    """
+    The lesson_analysis document for a student and lesson, with
+    response_time_stddev derived from the running sums kept there.
+    """
+    try:
+        with span('firestore.read'):
+            doc = db.collection('lesson_analysis').document(lesson_analysis_id(student_id, lesson_ref)).get()
+        if not doc.exists:
+            return create_response(False, 'No analysis found for this student and lesson', status_code=404)
+        analysis = doc.to_dict() or {}
+        analysis.update(InteractionAggregate.from_document(analysis).to_document())
+        return create_response(True, 'Lesson analysis retrieved', analysis)
+    except Exception as e:
+        logger.error(f"Full error details: {traceback.format_exc()}")
+        return create_response(False, str(e), status_code=500)
+
 @app.route('/save-progress', methods=['POST'])
 def save_progress():  # <-- Removed extra parameter
     try:
@@ -785,14 +1425,17 @@ def save_progress():  # <-- Removed extra parameter
         if not all([session_id, user_id, lesson_ref, progress is not None]):
             return create_response(False, 'Missing required fields', status_code=400)
 
-        db.collection('lesson_progress').document(session_id).set({
-            'session_id': session_id,
-            'lesson_ref': lesson_ref,
-            'progress': progress,
-            'updated_at': firestore.SERVER_TIMESTAMP  # Corrected line
-        })
+        # Progress, the session and its lesson state are written in one transaction
+        with span('firestore.write'):
+            session = session_engine.save_progress(session_id, lesson_ref, progress)
 
-        return create_response(True, 'Progress saved successfully')
+        return create_response(True, 'Progress saved successfully', session)
+    except SessionNotFound as e:
+        return create_response(False, str(e), status_code=404)
+    except InvalidTransition as e:
+        return create_response(False, str(e), status_code=409)
+    except ValueError as e:
+        return create_response(False, str(e), status_code=400)
     except Exception as e:
         logger.error(f"Full error details: {traceback.format_exc()}")
         logger.debug(f"Current create_response type: {type(create_response)}")
@@ -809,16 +1452,106 @@ def ai_tutor():
         if not all([student_id, question, lesson_path]):
             return create_response(False, 'Missing required fields', status_code=400)
 
-        prompt = f"The student asked: '{question}'. Provide a detailed explanation for the lesson '{lesson_path}'."
-        response = model.generate_content(prompt)
+        prompt = build_tutor_prompt(question, lesson_path)
+        response = model.generate_content(
+            prompt, endpoint='ai-tutor', use_cache=data.get('use_cache', True)
+        )
         explanation = response.text if response else "No response generated."
 
         return create_response(True, 'Response generated successfully', {'explanation': explanation})
+    except LLMUnavailableError as e:
+        return llm_unavailable_response(e)
     except Exception as e:
         logger.error(f"Full error details: {traceback.format_exc()}")
         logger.debug(f"Current create_response type: {type(create_response)}")
         return create_response(False, str(e), status_code=500)
 
+tutor_stream_stats = StreamStats()
+
+def token_usage(usage_metadata, prompt, output_text):
+    """Token counts from Gemini usage metadata, estimated when the response carries none."""
+    if usage_metadata is not None:
+        return {
+            'input_tokens': usage_metadata.prompt_token_count,
+            'output_tokens': usage_metadata.candidates_token_count,
+            'estimated': False
+        }
+    return {
+        'input_tokens': estimate_tokens(prompt),
+        'output_tokens': estimate_tokens(output_text) if output_text else 0,
+        'estimated': True
+    }
+
+@app.route('/ai-tutor/stream', methods=['POST'])
+def ai_tutor_stream():
+    """
+    Streaming variant of /ai-tutor: the explanation is sent as 'token'
+    events as Gemini produces it. If the client disconnects, the Gemini
+    stream is cancelled instead of being read to the end. Token counts and
+    time to first byte are sent in the final 'done' event and recorded.
+    """
+    started = time.perf_counter()
+    try:
+        data = request.get_json()
+        student_id = data.get('student_id')
+        question = data.get('question')
+        lesson_path = data.get('lesson_path')
+
+        if not all([student_id, question, lesson_path]):
+            return create_response(False, 'Missing required fields', status_code=400)
+    except Exception as e:
+        logger.error(f"Full error details: {traceback.format_exc()}")
+        return create_response(False, str(e), status_code=500)
+
+    format_event, mimetype = negotiate_stream_format(request.headers.get('Accept'))
+    prompt = build_tutor_prompt(question, lesson_path)
+    use_cache = data.get('use_cache', True)
+
+    def generate():
+        stream_info = {}
+        chunks = model.stream_content(prompt, endpoint='ai-tutor', use_cache=use_cache, stream_info=stream_info)
+        parts = []
+        ttfb_ms = None
+        status = 'cancelled'  # Unless the loop finishes or fails, the client went away
+        try:
+            for text in chunks:
+                if ttfb_ms is None:
+                    ttfb_ms = (time.perf_counter() - started) * 1000
+                parts.append(text)
+                yield format_event('token', {'text': text})
+            status = 'completed'
+        except Exception as e:
+            status = 'error'
+            logger.error(f"Gemini Error: {str(e)}")
+            yield format_event('error', {'success': False, 'message': str(e)})
+        finally:
+            # Stops consuming the Gemini stream when the socket has closed
+            chunks.close()
+            usage = token_usage(stream_info.get('usage'), prompt, ''.join(parts))
+            tutor_stream_stats.record(status, ttfb_ms, usage['output_tokens'])
+            logger.info(
+                f"AI tutor stream {status} for {student_id}: ttfb_ms={ttfb_ms}, "
+                f"output_tokens={usage['output_tokens']}, cached={stream_info.get('cached')}"
+            )
+
+        if status == 'completed':
+            yield format_event('done', {
+                'success': True,
+                'message': 'Response generated successfully',
+                'ttfb_ms': ttfb_ms,
+                'cached': stream_info.get('cached', False),
+                **usage
+            })
+
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=STREAM_HEADERS)
+
+@app.route('/stream-stats', methods=['GET'])
+def stream_stats():
+    """Report outcome, time-to-first-byte and token counters for streaming endpoints."""
+    return create_response(True, 'Stream statistics retrieved', {
+        'ai_tutor': tutor_stream_stats.snapshot()
+    })
+
 @app.route('/generate-summary', methods=['POST'])
 def generate_summary():
     try:
@@ -828,11 +1561,15 @@ def generate_summary():
         if not analytics_data:
             return create_response(False, 'Missing analytics data', status_code=400)
 
-        prompt = f"Based on this data: {analytics_data}, create a detailed performance summary."
-        response = model.generate_content(prompt)
+        prompt = build_summary_prompt(analytics_data)
+        response = model.generate_content(
+            prompt, endpoint='generate-summary', use_cache=data.get('use_cache', True)
+        )
         summary = response.text if response else "No summary generated."
 
         return create_response(True, 'Summary generated successfully', {'summary': summary})
+    except LLMUnavailableError as e:
+        return llm_unavailable_response(e)
     except Exception as e:
         logger.error(f"Full error details: {traceback.format_exc()}")
         logger.debug(f"Current create_response type: {type(create_response)}")
@@ -847,11 +1584,15 @@ def generate_blooms_summary():
         if not bloom_data:
             return create_response(False, 'Missing Bloom\'s data', status_code=400)
 
-        prompt = f"Analyze this data: {bloom_data}, and summarize cognitive engagement across Bloom's levels."
-        response = model.generate_content(prompt)
+        prompt = build_blooms_summary_prompt(bloom_data)
+        response = model.generate_content(
+            prompt, endpoint='generate-blooms-summary', use_cache=data.get('use_cache', True)
+        )
         summary = response.text if response else "No summary generated."
 
         return create_response(True, 'Bloom\'s summary generated successfully', {'summary': summary})
+    except LLMUnavailableError as e:
+        return llm_unavailable_response(e)
     except Exception as e:
         logger.error(f"Full error details: {traceback.format_exc()}")
         logger.debug(f"Current create_response type: {type(create_response)}")
@@ -890,7 +1631,8 @@ def save_lesson_notes():
 
         # Save to Firestore in the lesson_notes collection
         doc_ref = db.collection('lesson_notes').document(lesson_ref)
-        doc_ref.set(lesson_notes)
+        with span('firestore.write'):
+            doc_ref.set(lesson_notes)
 
         return create_response(True, "Lesson notes saved successfully.")
     except Exception as e:
@@ -898,6 +1640,37 @@ def save_lesson_notes():
         logger.debug(f"Current create_response type: {type(create_response)}")
         return create_response(False, str(e), status_code=500)
 
+LESSON_NOTES_PROMPT = PromptTemplate(
+    'generate-lesson-notes',
+    (
+        "Generate age-appropriate homework for a {grade_level} student based on the following lesson:\n\n"
+        "**Lesson Title:** {lesson_title}\n"
+        "**Subject:** {subject}\n"
+        "**Topic:** {topic}\n"
+        "**Key Concepts:** {key_concepts}\n"
+        "**Examples:** {examples}\n"
+        "**Summary:** {summary}\n\n"
+        "**Instructions for Homework:**\n"
+        "1. Create fun and interactive homework tasks that reinforce the lesson content.\n"
+        "2. Use simple, age-appropriate language suitable for a {grade_level} student.\n"
+        "3. Include at least one practice activity, one fun activity, and one exploration task.\n\n"
+        "Please generate the homework now."
+    ),
+    elastic=('key_concepts', 'examples', 'summary'),
+    budget=PROMPT_TOKEN_BUDGETS.get('generate-lesson-notes')
+)
+
+def build_lesson_notes_prompt(grade_level, subject, lesson_title, topic, key_concepts, examples, summary):
+    return LESSON_NOTES_PROMPT.render(
+        grade_level=grade_level,
+        lesson_title=lesson_title,
+        subject=subject,
+        topic=topic,
+        key_concepts=', '.join(key_concepts),
+        examples=', '.join(examples) if examples else 'No examples available.',
+        summary=summary
+    )
+
 @app.route('/generate-lesson-notes', methods=['POST'])
 def generate_lesson_notes():
     try:
@@ -923,29 +1696,22 @@ def generate_lesson_notes():
         grade_level = grade  # e.g., "Junior Secondary School 3"
 
         # Craft a detailed and age-appropriate prompt for Gemini
-        prompt = (
-            f"Generate age-appropriate homework for a {grade_level} student based on the following lesson:\n\n"
-            f"**Lesson Title:** {lesson_title}\n"
-            f"**Subject:** {subject}\n"
-            f"**Topic:** {topic}\n"
-            f"**Key Concepts:** {', '.join(key_concepts)}\n"
-            f"**Examples:** {', '.join(examples) if examples else 'No examples available.'}\n"
-            f"**Summary:** {lesson_summary}\n\n"
-            "**Instructions for Homework:**\n"
-            "1. Create fun and interactive homework tasks that reinforce the lesson content.\n"
-            "2. Use simple, age-appropriate language suitable for a {grade_level} student.\n"
-            "3. Include at least one practice activity, one fun activity, and one exploration task.\n\n"
-            "Please generate the homework now."
+        prompt = build_lesson_notes_prompt(
+            grade_level, subject, lesson_title, topic, key_concepts, examples, lesson_summary
         )
 
         # Request homework from Gemini
-        logger.info(f"Sending prompt to Gemini: {prompt}")  # Log for debugging
+        logger.debug("Sending prompt to Gemini (%d chars): %s", len(prompt), truncated(prompt, 500))
         try:
-            gemini_response = model.generate_content(prompt)
+            gemini_response = model.generate_content(
+                prompt, endpoint='generate-lesson-notes', use_cache=data.get('use_cache', True)
+            )
             if (gemini_response):
                 homework_content = gemini_response.text
             else:
                 homework_content = "Gemini could not generate homework."
+        except LLMUnavailableError as e:
+            return llm_unavailable_response(e)
         except Exception as e:
             logger.error(f"Gemini API Error: {str(e)}")
             return create_response(False, f"Gemini API Error: {str(e)}", status_code=500)
@@ -1013,6 +1779,25 @@ def get_sample_lesson_ref():
         subject = data.get('subject')
         lesson_ref = data.get('lesson_ref')
 
+        if curriculum_index_ready():
+            # Resolve the lesson from the index instead of probing paths
+            if lesson_ref:
+                entry = curriculum_index.lookup(lesson_ref)
+            else:
+                entries = curriculum_index.list_lessons(country, curriculum, grade, level, subject)
+                entry = entries[0] if entries else None
+            if entry is None:
+                return create_response(False, f'No lesson found at specified path', status_code=404)
+
+            lesson_path, lesson_data = find_lesson_by_ref(
+                entry.lesson_ref, entry.country, entry.curriculum, entry.grade, entry.level, entry.subject
+            )
+            return create_response(True, 'Sample lesson reference retrieved', {
+                'lessonRef': entry.lesson_ref,
+                'fullPath': lesson_path,
+                'lessonData': lesson_data
+            })
+
         # Construct the document reference
         doc_path = f"countries/{country}/curriculums/{curriculum}/grades/{grade}/levels/{level}/subjects/{subject}"
         doc_ref = db.document(doc_path)
@@ -1020,7 +1805,8 @@ def get_sample_lesson_ref():
         logger.info(f"Attempting to fetch lesson at path: {doc_ref.path}")
         
         # Get the document
-        lesson_doc = doc_ref.get()
+        with span('firestore.read'):
+            lesson_doc = doc_ref.get()
         
         if not lesson_doc.exists:
             logger.error(f"No lesson found at path: {doc_ref.path}")
@@ -1028,7 +1814,7 @@ def get_sample_lesson_ref():
             
         lesson_data = lesson_doc.to_dict()
         logger.info(f"Found lesson: {lesson_doc.id}")
-        logger.info(f"Lesson data: {lesson_data}")
+        logger.debug("Lesson data: %s", truncated(lesson_data))
 
         # Return the found lesson data with its full path information
         return create_response(True, 'Sample lesson reference retrieved', {
@@ -1041,6 +1827,33 @@ def get_sample_lesson_ref():
         logger.error(f"Error getting sample lesson ref: {e}")
         return create_response(False, str(e), status_code=500)
 
+FINAL_REPORT_PROMPT = PromptTemplate(
+    'generate-final-report',
+    (
+        "You are generating a final lesson summary for student '{student_id}' on lesson '{lesson_ref}' "
+        "dated {report_date}. The data below is strictly about a student's classroom performance, "
+        "not brand engagement.\n\n"
+        "Analytics Data: {analytics_data}\n"
+        "Bloom's Taxonomy Data: {bloom_data}\n\n"
+        "Please produce a single comprehensive summary discussing:\n"
+        "1. The student's overall performance and engagement (use analytics_data).\n"
+        "2. The student's cognitive engagement across Bloom's levels (use bloom_data).\n"
+        "3. Keep the report short, direct, and educational.\n"
+        "4. Conclude by re-stating the lesson reference and today's date.\n"
+    ),
+    elastic=('analytics_data', 'bloom_data'),
+    budget=PROMPT_TOKEN_BUDGETS.get('generate-final-report')
+)
+
+def build_final_report_prompt(student_id, lesson_ref, report_date, analytics_data, bloom_data):
+    return FINAL_REPORT_PROMPT.render(
+        student_id=student_id,
+        lesson_ref=lesson_ref,
+        report_date=report_date,
+        analytics_data=analytics_data,
+        bloom_data=bloom_data
+    )
+
 @app.route('/generate-final-report', methods=['POST'])
 def generate_final_report():
     """
@@ -1066,29 +1879,21 @@ def generate_final_report():
         report_date_str = datetime.utcnow().strftime("%d %B %Y")
 
         # 2. Craft a single prompt that merges analytics and Bloom data in a lesson context
-        final_prompt = (
-            f"You are generating a final lesson summary for student '{student_id}' on lesson '{lesson_ref}' "
-            f"dated {report_date_str}. The data below is strictly about a student's classroom performance, "
-            f"not brand engagement.\n\n"
-            f"Analytics Data: {analytics_data}\n"
-            f"Bloom's Taxonomy Data: {bloom_data}\n\n"
-            "Please produce a single comprehensive summary discussing:\n"
-            "1. The student's overall performance and engagement (use analytics_data).\n"
-            "2. The student's cognitive engagement across Bloom's levels (use bloom_data).\n"
-            "3. Keep the report short, direct, and educational.\n"
-            "4. Conclude by re-stating the lesson reference and today's date.\n"
-        )
+        final_prompt = build_final_report_prompt(student_id, lesson_ref, report_date_str, analytics_data, bloom_data)
 
         # 3. Generate content from Gemini
         try:
             gemini_response = model.generate_content(
                 final_prompt,
+                endpoint='generate-final-report',
                 request_options={'timeout': 30}  # 30-second timeout
             )
             if gemini_response:
                 final_report = gemini_response.text
             else:
                 final_report = "No final report generated."
+        except LLMUnavailableError as e:
+            return llm_unavailable_response(e)
         except Exception as e:
             logger.error(f"Gemini API Error: {str(e)}")
             return create_response(False, f"Gemini API Error: {str(e)}", status_code=500)
@@ -1110,7 +1915,8 @@ def generate_final_report():
             "created_at": datetime.utcnow().isoformat(),
             "report_date": report_date_str
         }
-        db.collection('student_reports').document(f"{student_id}_{lesson_ref}").set(report_data, merge=True)
+        with span('firestore.write'):
+            db.collection('student_reports').document(f"{student_id}_{lesson_ref}").set(report_data, merge=True)
 
         return create_response(True, 'Final merged report generated successfully', {
             'report': final_report_with_heading
@@ -1125,7 +1931,7 @@ def get_lesson_content():
     try:
         logger.info("==== /lesson-content endpoint called ====")
         data = request.get_json()
-        logger.debug(f"Request data: {data}")
+        logger.debug("Request data: %s", truncated(data))
 
         # Validate input
         student_id = data.get('student_id')
@@ -1146,7 +1952,7 @@ def get_lesson_content():
         try:
             lesson_path, doc_data = find_lesson_by_ref(lesson_ref, country, curriculum, grade, level, subject)
             logger.info(f"Fetched document from path: {lesson_path}")
-            logger.debug(f"Document data: {doc_data}")
+            logger.debug("Document data: %s", truncated(doc_data))
         except ValueError as e:
             logger.error(f"Firestore document error: {str(e)}")
             return create_response(False, str(e), status_code=404)
@@ -1174,38 +1980,17 @@ def get_lesson_content():
 def generate_lesson_plan():
     try:
         data = request.get_json()
-        if not data:
-            return create_response(False, 'Invalid JSON data', status_code=400)
-
-        # Parameter extraction with validation
-        required_fields = {
-            'lessonRef': str,
-            'studentId': str,
-            'learningObjectives': list,
-            'country': str,
-            'curriculum': str,
-            'grade': str,
-            'level': str,
-            'subject': str
-        }
-
-        missing = [field for field, _ in required_fields.items() if field not in data]
-        if missing:
-            return create_response(False, f'Missing required fields: {", ".join(missing)}', status_code=400)
+        params = parse_lesson_plan_request(data)
 
         # Extract parameters
-        lesson_ref = data['lessonRef']
-        student_id = data['studentId']
-        learning_objectives = data['learningObjectives']
-        country = data['country']
-        curriculum = data['curriculum']
-        grade = data['grade']
-        level = data['level']
-        subject = data['subject']
-
-        # Add validation for learning_objectives
-        if not isinstance(learning_objectives, list) or len(learning_objectives) == 0:
-            return create_response(False, "Invalid learning objectives format", status_code=400)
+        lesson_ref = params['lessonRef']
+        student_id = params['studentId']
+        learning_objectives = params['learningObjectives']
+        country = params['country']
+        curriculum = params['curriculum']
+        grade = params['grade']
+        level = params['level']
+        subject = params['subject']
 
         # Firestore document retrieval
         try:
@@ -1213,7 +1998,7 @@ def generate_lesson_plan():
             lesson_path, lesson_data = find_lesson_by_ref(
                 lesson_ref, country, curriculum, grade, level, subject
             )
-            logger.debug(f"Retrieved lesson data: {lesson_data}")
+            logger.debug("Retrieved lesson data: %s", truncated(lesson_data))
             if not lesson_data:
                 return create_response(False, "Lesson document not found", status_code=404)
 
@@ -1221,114 +2006,27 @@ def generate_lesson_plan():
             logger.error(f"Firestore error: {str(e)}")
             return create_response(False, "Database error", status_code=500)
 
-        # Data extraction with fallbacks
-        metadata = lesson_data.get('metadata', {})
-        blooms_levels = metadata.get('blooms_level', metadata.get('BloomsLevel', ["unspecified"]))
-        lesson_time_length = metadata.get('estimated_duration', '30 min')
-
-        # Time allocation logic
-        instructional_steps = lesson_data.get('instructionalSteps') or []
-        if not instructional_steps:
-            logger.warning("No instructional steps found in document")
-        time_allocation = {
-            'intro': lesson_data.get('introduction', {}).get('sectionTimeLength', '5 min'),
-            'key_concepts': '10 min',
-            'guided_practice': '10 min',
-            'assessment': '5 min',
-            'conclusion': '5 min'
-        }
-
-        for step in instructional_steps:
-            title = step.get('sectionTitle', '').lower()
-            if 'key concept' in title:
-                time_allocation['key_concepts'] = step.get('sectionTimeLength', time_allocation['key_concepts'])
-            elif 'guided practice' in title:
-                time_allocation['guided_practice'] = step.get('sectionTimeLength', time_allocation['guided_practice'])
-            elif 'assessment' in title:
-                time_allocation['assessment'] = step.get('sectionTimeLength', time_allocation['assessment'])
+        # Most lessons have a pre-generated plan that only needs the student's ID
+        if data.get('use_cache', True):
+            lesson_plan = lookup_lesson_plan_template(lesson_path, lesson_data, params)
+            if lesson_plan:
+                logger.info(f"Serving pre-generated lesson plan for {lesson_ref}")
+                return create_response(True, "Lesson plan generated successfully", {"lesson_plan": lesson_plan})
 
         # Construct final prompt
-        prompt = f"""
-        You are an AI teacher preparing a comprehensive lesson plan for an individual student, {student_id}, on the topic of '{lesson_data.get('topic', 'Untitled Topic')}' for {grade} level. This lesson plan is for you to deliver directly to this student in a one-on-one, interactive online setting.
-
-        Subject: {subject}
-        Topic: {lesson_data.get('topic', 'Untitled Topic')}
-        Grade Level: {grade}
-        Country: {country}
-        Curriculum: {curriculum}
-        Lesson Reference: {lesson_ref}
-        Student ID: {student_id}
-
-        Learning Objectives:
-        - {", ".join(learning_objectives)}
-
-        Lesson Duration: {lesson_time_length} (Please adhere to this duration)
-
-        Lesson Structure:
-        1. Introduction (approx. {time_allocation['intro']}):
-            - As the AI teacher, I will begin by greeting the student personally, using their ID, {student_id}.
-            - I will introduce the topic, {lesson_data.get('topic', 'Untitled Topic')}, and explain why it's relevant to them.
-            - I will use an engaging opening, such as a surprising fact or a real-world scenario related to {lesson_data.get('topic', 'Untitled Topic')}, to capture the student's attention. **Do not use video clips.**
-        2. Key Concepts (approx. {time_allocation['key_concepts']}):
-            - I will explain the key concepts clearly and concisely, using simple, age-appropriate language for {grade} students.
-            - I will use a virtual whiteboard to write down definitions and create simple diagrams or charts.
-            - For each key concept, I will pause and ask the student a question to check for understanding, encouraging them to respond in the chat. For example, I might ask, "{student_id}, can you give me an example of [key concept] in your daily life?".
-            - I will provide at least 3 real-world examples to illustrate each concept, ensuring they are relevant to students' lives in {country}.
-        3. Guided Practice (approx. {time_allocation['guided_practice']}):
-            - I will engage the student in interactive activities to practice the concepts.
-            - For example, I might present a problem on the virtual whiteboard and ask the student to solve it step-by-step, providing guidance and feedback through the chat.
-            - I will use questions like, "{student_id}, how would you apply [key concept] in this situation?" to encourage critical thinking.
-            - I will provide immediate feedback and prompts during these activities to keep the student on track.
-        4. Assessment (approx. {time_allocation['assessment']}):
-            - I will conduct a short quiz with exactly 10 questions to assess the student's understanding.
-            - The quiz will include a variety of question types: 
-                - 4 multiple-choice questions
-                - 3 fill-in-the-gap questions
-                - 3 short answer questions.
-            - **Generate specific quiz questions and answers relevant to '{lesson_data.get('topic', 'Untitled Topic')}' and '{subject}', suitable for '{grade}' students in '{country}' following the '{curriculum}' curriculum. Ensure that these questions align with the Bloom's Taxonomy levels: {", ".join(blooms_levels)}. Provide the correct answers to the quiz questions immediately after each question.**
-            - I will provide immediate feedback on each answer, explaining the correct answer if the student's response is incorrect.
-        5. Conclusion (approx. {time_allocation['conclusion']}):
-            - I will summarize the key takeaways from the lesson, emphasizing the main learning objectives.
-            - I will offer encouraging words and acknowledge the student's participation, using their ID, {student_id}.
-            - I will preview the next lesson or suggest related topics for the student to explore.
-
-        Interactive Elements:
-        - Throughout the lesson, I will frequently ask questions and encourage the student to respond in the chat.
-        - I will use polls to quickly check for understanding and keep the student engaged.
-        - I will use a virtual whiteboard for interactive problem-solving and demonstrations.
-        - I will provide immediate feedback on student responses and adapt my teaching style based on their interaction.
-        - I will use interactive elements such as **graphs, charts, animations, flashcards, drag-and-drop activities, and simulations** to enhance understanding and engagement. **Do not suggest videos.**
-
-        Visual Aids:
-        - I will use diagrams, images, and charts to explain complex concepts visually.
-        - **Instead of video clips, I will use animations and interactive simulations** to demonstrate practical examples of the key concepts.
-
-        Tone and Style:
-        - I will maintain a conversational, encouraging, and engaging tone throughout the lesson.
-        - I will keep the language simple and easy to understand, suitable for {grade} students.
-        - I will address the student directly using their ID, {student_id}.
-        - I will use positive reinforcement and encouragement to build confidence.
-
-        Differentiation:
-        - For a student who is struggling, I will offer additional explanations, simplified examples, and one-on-one support through the chat.
-        - For an advanced student, I will pose extra challenge questions related to {lesson_data.get('topic', 'Untitled Topic')} and encourage them to explore the subject further independently.
-
-        Materials:
-        - Virtual whiteboard
-        - Presentation software (e.g., Google Slides, PowerPoint)
-        - Digital resources (e.g., relevant websites, interactive simulations, **but no videos**)
-        - Poll creation tool
-        - Chat feature for student interaction
-
-        Please generate the complete lesson plan now, following the specified structure and guidelines, assuming the role of the AI teacher delivering the lesson in a personalized, one-on-one online setting. **Generate specific examples and quiz questions. Do not include any video suggestions or placeholders.**
-        """
+        prompt = build_lesson_plan_prompt(
+            lesson_data, lesson_ref, student_id, learning_objectives,
+            country, curriculum, grade, subject, lesson_path=lesson_path
+        )
 
         # Corrected Gemini API call
         try:
             logger.info("Generating lesson plan with Gemini")
             gemini_response = model.generate_content(
                 prompt,
-                request_options={'timeout': 30}  # Add timeout within request_options
+                request_options={'timeout': GEMINI_TIMEOUT},
+                endpoint='generate-lesson-plan',
+                use_cache=data.get('use_cache', True)
             )
 
             if not gemini_response.text:
@@ -1337,6 +2035,8 @@ def generate_lesson_plan():
             # Return the generated lesson plan directly in the response
             return create_response(True, "Lesson plan generated successfully", {"lesson_plan": gemini_response.text})
 
+        except LLMUnavailableError as e:
+            return llm_unavailable_response(e)
         except Exception as e:
             logger.error(f"Gemini Error: {str(e)}")
             return create_response(False, "AI service unavailable", status_code=503)
@@ -1349,6 +2049,85 @@ def generate_lesson_plan():
         logger.exception(f"Unexpected error: {str(e)}")  # Log full traceback
         return create_response(False, "Internal server error", status_code=500)
 
+@app.route('/generate-lesson-plan/stream', methods=['POST'])
+def generate_lesson_plan_stream():
+    """
+    Streaming variant of /generate-lesson-plan. Plan text is forwarded as
+    Gemini produces it, as Server-Sent Events (or JSON lines when the client
+    accepts application/x-ndjson), with a section event marking where each
+    part of the plan starts. A matching pre-generated plan is streamed
+    instead of generating one. Request errors use the usual JSON envelope.
+    """
+    try:
+        data = request.get_json()
+        params = parse_lesson_plan_request(data)
+        use_cache = data.get('use_cache', True)
+
+        try:
+            lesson_path, lesson_data = find_lesson_by_ref(
+                params['lessonRef'], params['country'], params['curriculum'],
+                params['grade'], params['level'], params['subject']
+            )
+        except Exception as e:
+            logger.error(f"Firestore error: {str(e)}")
+            return create_response(False, "Database error", status_code=500)
+
+        lesson_plan = lookup_lesson_plan_template(lesson_path, lesson_data, params) if use_cache else None
+        prompt = None if lesson_plan else build_lesson_plan_prompt(
+            lesson_data, params['lessonRef'], params['studentId'], params['learningObjectives'],
+            params['country'], params['curriculum'], params['grade'], params['subject'],
+            lesson_path=lesson_path
+        )
+
+    except ValueError as e:
+        logger.error(f"Validation error: {str(e)}")
+        return create_response(False, str(e), status_code=400)
+
+    except Exception as e:
+        logger.exception(f"Unexpected error: {str(e)}")
+        return create_response(False, "Internal server error", status_code=500)
+
+    format_event, mimetype = negotiate_stream_format(request.headers.get('Accept'))
+
+    def plan_text():
+        if lesson_plan:
+            logger.info(f"Streaming pre-generated lesson plan for {params['lessonRef']}")
+            yield lesson_plan
+            return
+        yield from model.stream_content(
+            prompt,
+            request_options={'timeout': GEMINI_TIMEOUT},
+            endpoint='generate-lesson-plan',
+            use_cache=use_cache
+        )
+
+    def generate():
+        tracker = SectionTracker()
+        length = 0
+        yield format_event('start', {
+            'lessonRef': params['lessonRef'],
+            'sections': [name for name, _ in LESSON_PLAN_SECTIONS]
+        })
+        try:
+            for text in plan_text():
+                yield format_event('chunk', {'text': text})
+                length += len(text)
+                for section, offset in tracker.feed(text):
+                    yield format_event('section', {'section': section, 'offset': offset})
+            for section, offset in tracker.flush():
+                yield format_event('section', {'section': section, 'offset': offset})
+        except Exception as e:
+            logger.error(f"Gemini Error: {str(e)}")
+            yield format_event('error', {'success': False, 'message': "AI service unavailable"})
+            return
+
+        if not length:
+            yield format_event('error', {'success': False, 'message': "Empty response from AI"})
+            return
+        yield format_event('done', {'success': True, 'message': "Lesson plan generated successfully", 'length': length})
+
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=STREAM_HEADERS)
+
 @app.route('/countries/<country>/curriculums/<curriculum>/grades/<grade>/levels/<level>/subjects/<subject>/lessons/<lesson_ref>', methods=['POST'])
 def create_lesson(country, curriculum, grade, level, subject, lesson_ref):
     try:
@@ -1356,40 +2135,212 @@ def create_lesson(country, curriculum, grade, level, subject, lesson_ref):
             f"countries/{country}/curriculums/{curriculum}/grades/{grade}"
             f"/levels/{level}/subjects/{subject}/lessons/{lesson_ref}"
         )
-        
-        if not doc_ref.get().exists:
-            # Create parent collections
-            parent_segments = [
-                ("countries", country),
-                ("curriculums", curriculum),
-                ("grades", grade),
-                ("levels", level),
-                ("subjects", subject),
-                ("lessons", lesson_ref)
-            ]
-            
-            current_path = []
-            for collection, document in parent_segments:
-                current_path.append(f"{collection}/{document}")
-                parent_ref = db.document("/".join(current_path))
-                
-                if not parent_ref.get().exists:
-                    parent_ref.set({
-                        'created_at': firestore.SERVER_TIMESTAMP,
-                        'type': collection[:-1]  # e.g., "country" instead of "countries"
-                    })
-
-        # Save lesson data with validation
+
+        # Validate before writing anything, so a bad payload leaves no parent documents behind
         lesson_data = request.get_json()
-        if validate_lesson(lesson_data):
-            doc_ref.set(lesson_data)
-            return create_response(True, "Lesson created successfully")
-        return create_response(False, "Invalid lesson format", status_code=400)
+        errors = lesson_validation_errors(lesson_data)
+        if errors:
+            return create_response(False, "Invalid lesson format", {'errors': errors}, status_code=400)
+
+        # One get_all round-trip checks every parent; one batch commit writes
+        # the missing parents together with the lesson
+        parent_types = dict(lesson_parent_paths(country, curriculum, grade, level, subject))
+        with span('firestore.read'):
+            snapshots = list(db.get_all([db.document(path) for path in parent_types]))
+        batch = db.batch()
+        for snapshot in snapshots:
+            if not snapshot.exists:
+                batch.set(snapshot.reference, {
+                    'created_at': firestore.SERVER_TIMESTAMP,
+                    'type': parent_types[snapshot.reference.path]
+                })
+        batch.set(doc_ref, lesson_data)
+        with span('firestore.write'):
+            batch.commit()
+
+        lesson_cache.invalidate(doc_ref.path)
+        lesson_cache.invalidate(lesson_doc_path(country, curriculum, grade, level, subject, lesson_ref))
+        return create_response(True, "Lesson created successfully")
 
     except Exception as e:
         logger.error(f"Lesson creation error: {str(e)}")
         return create_response(False, "Failed to create lesson", status_code=500)
 
+@app.route('/curriculum/lessons', methods=['GET'])
+def list_curriculum_lessons():
+    """
+    List lessons under a prefix of the curriculum hierarchy, e.g.
+    ?country=NG&curriculum=NERDC&grade=JSS1 or a full subject coordinate.
+    """
+    try:
+        if not curriculum_index_ready():
+            return create_response(False, 'Curriculum index is still loading', status_code=503)
+
+        entries = curriculum_index.list_lessons(
+            request.args.get('country'),
+            request.args.get('curriculum'),
+            request.args.get('grade'),
+            request.args.get('level'),
+            request.args.get('subject')
+        )
+        return create_response(True, 'Lessons retrieved', {
+            'count': len(entries),
+            'lessons': [entry._asdict() for entry in entries]
+        })
+    except ValueError as e:
+        return create_response(False, str(e), status_code=400)
+    except Exception as e:
+        logger.error(f"Error listing lessons: {e}")
+        return create_response(False, str(e), status_code=500)
+
+@app.route('/curriculum/lessons/<lesson_ref>', methods=['GET'])
+def lookup_curriculum_lesson(lesson_ref):
+    """Resolve a lesson_ref to its full path and metadata from the curriculum index."""
+    try:
+        if not curriculum_index_ready():
+            return create_response(False, 'Curriculum index is still loading', status_code=503)
+    except Exception as e:
+        logger.error(f"Error starting curriculum index: {e}")
+        return create_response(False, str(e), status_code=500)
+
+    entries = curriculum_index.lookup_all(lesson_ref)
+    if not entries:
+        return create_response(False, f'No lesson found for ref: {lesson_ref}', status_code=404)
+    return create_response(True, 'Lesson located', {
+        'lesson': entries[0]._asdict(),
+        'duplicates': [entry.path for entry in entries[1:]]
+    })
+
+def invalidate_lesson_paths(paths):
+    """Drop cached copies of lessons that were just rewritten."""
+    for path in paths:
+        lesson_cache.invalidate(path)
+
+@app.route('/lessons/import', methods=['POST'])
+def import_lessons():
+    """
+    Bulk-import lessons from an NDJSON body, a zip body (application/zip) or
+    an uploaded 'file'. Pass ?import_id=... to checkpoint progress and resume
+    an interrupted import by repeating the same request.
+    """
+    try:
+        upload = request.files.get('file')
+        if upload is not None:
+            records = iter_import_records(upload.stream, upload.filename or '')
+        elif request.mimetype in ('application/zip', 'application/x-zip-compressed'):
+            records = iter_import_records(io.BytesIO(request.get_data()), 'upload.zip')
+        else:
+            records = iter_import_records(request.stream, 'upload.ndjson')
+
+        checkpoint_path = None
+        import_id = request.args.get('import_id')
+        if import_id:
+            if not re.fullmatch(r'[A-Za-z0-9_-]{1,64}', import_id):
+                return create_response(False, "import_id may only contain letters, digits, '-' and '_'", status_code=400)
+            checkpoint_dir = os.getenv('LESSON_IMPORT_CHECKPOINT_DIR', '/tmp/lesson-imports')
+            os.makedirs(checkpoint_dir, exist_ok=True)
+            checkpoint_path = os.path.join(checkpoint_dir, f"{import_id}.json")
+
+        importer = LessonImporter(
+            db, LESSON_SCHEMA,
+            validate_workers=int(os.getenv('LESSON_IMPORT_VALIDATE_WORKERS', '0')),
+            commit_concurrency=int(os.getenv('LESSON_IMPORT_COMMIT_CONCURRENCY', '4')),
+            checkpoint=ImportCheckpoint(checkpoint_path),
+            on_committed=invalidate_lesson_paths
+        )
+        report = importer.run(records)
+
+        return create_response(True, f"Imported {report['imported']} lessons", report)
+    except Exception as e:
+        logger.error(f"Full error details: {traceback.format_exc()}")
+        return create_response(False, str(e), status_code=500)
+
+@app.route('/sessions/expire-idle', methods=['POST'])
+def expire_idle_sessions():
+    """
+    Expire active and paused sessions with no interaction for idle_minutes
+    (default SESSION_IDLE_TIMEOUT_MINUTES). Meant for a scheduler; pass
+    max_sessions to bound a single run.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        idle_minutes = data.get('idle_minutes', SESSION_IDLE_TIMEOUT_SECONDS / 60)
+        max_sessions = data.get('max_sessions')
+        if not isinstance(idle_minutes, (int, float)) or idle_minutes <= 0:
+            return create_response(False, 'idle_minutes must be a positive number', status_code=400)
+        if max_sessions is not None and (not isinstance(max_sessions, int) or max_sessions <= 0):
+            return create_response(False, 'max_sessions must be a positive integer', status_code=400)
+
+        with span('firestore.write'):
+            report = session_engine.expire_idle(idle_minutes * 60, max_sessions=max_sessions)
+        return create_response(True, f"Expired {report['expired']} idle sessions", report)
+    except Exception as e:
+        logger.error(f"Full error details: {traceback.format_exc()}")
+        return create_response(False, str(e), status_code=500)
+
+@app.route('/prompt-stats', methods=['GET'])
+def prompt_stats():
+    """Render counts, estimated token sizes and shrink counters per prompt template."""
+    return create_response(True, 'Prompt statistics retrieved', prompt_template_stats())
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    """Report hit, miss and eviction counters for the in-process caches."""
+    return create_response(True, 'Cache statistics retrieved', {
+        'lesson_cache': lesson_cache.stats(),
+        'llm_cache': model.stats(),
+        'curriculum_index': curriculum_index.stats(),
+        'single_flight': single_flight_stats(),
+        'lesson_plan_templates': lesson_plan_templates.stats(),
+        'session_states': session_states.stats(),
+        'compiled_lessons': compiled_lessons.stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Request and span latency histograms in Prometheus text format."""
+    startup_seconds = {(('component', component),): ms / 1000 for component, ms in startup_timings().items()}
+    gateway_stats = llm_gateway.stats()
+    gateway_stats['circuit_open'] = int(gateway_stats.pop('circuit') != 'closed')
+    body = metrics_registry.render_prometheus(gauges={
+        'startup_seconds': startup_seconds,
+        'llm_gateway': {(('stat', name),): value for name, value in gateway_stats.items()},
+        'single_flight_coalesced': {
+            (('group', name),): stats['coalesced'] for name, stats in single_flight_stats().items()
+        },
+        'session_state': {(('stat', name),): value for name, value in session_states.stats().items()},
+        'prompt_max_estimated_tokens': {
+            (('template', name),): stats['max_estimated_tokens'] for name, stats in prompt_template_stats().items()
+        },
+        'prompt_shrunk': {(('template', name),): stats['shrunk'] for name, stats in prompt_template_stats().items()}
+    })
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+@app.route('/health', methods=['GET'])
+def health():
+    """
+    Liveness check. With ?prewarm=true (or STARTUP_PREWARM_ON_HEALTH=true) it
+    also initializes Firestore, Gemini and the lesson validator, so a startup
+    probe can pay the cold-start cost before real traffic does.
+    """
+    prewarm_requested = request.args.get('prewarm', os.getenv('STARTUP_PREWARM_ON_HEALTH', 'false'))
+    failures = {}
+    if prewarm_requested.lower() == 'true':
+        failures = prewarm(db_resource, gemini_resource, lesson_validator_resource)
+
+    data = {
+        'initialized': {
+            resource.name: resource.initialized
+            for resource in (db_resource, gemini_resource, lesson_validator_resource)
+        },
+        'curriculum_index_ready': curriculum_index.ready,
+        'startup_timings_ms': startup_timings()
+    }
+    if failures:
+        data['prewarm_failures'] = failures
+        return create_response(False, 'Prewarm failed', data, status_code=503)
+    return create_response(True, 'OK', data)
+
 # ===== OPTIMIZE LESSON TIMING =====
 def optimize_lesson_timing(lesson_plan: Dict, desired_total_minutes: int) -> Dict:
     """Optimizes lesson timing using Gemini's text response with natural language processing"""
@@ -1417,37 +2368,66 @@ def optimize_lesson_timing(lesson_plan: Dict, desired_total_minutes: int) -> Dic
         logging.error(f"Error in time optimization: {str(e)}")
         return lesson_plan
 
+def lesson_doc_path(country, curriculum, grade, level, subject, lesson_ref):
+    """Full Firestore path of a lesson document in the lessonRef subcollection."""
+    return f"countries/{country}/curriculums/{curriculum}/grades/{grade}/levels/{level}/subjects/{subject}/lessonRef/{lesson_ref}"
+
+def lesson_parent_paths(country, curriculum, grade, level, subject):
+    """
+    Paths and types of the documents above a lesson, outermost first,
+    e.g. ("countries/NG", "country").
+    """
+    segments = [
+        ("countries", country),
+        ("curriculums", curriculum),
+        ("grades", grade),
+        ("levels", level),
+        ("subjects", subject)
+    ]
+    paths = []
+    current_path = []
+    for collection, document in segments:
+        current_path.append(f"{collection}/{document}")
+        paths.append(("/".join(current_path), collection[:-1]))  # e.g., "country" instead of "countries"
+    return paths
+
+# A class starting together asks for the same lesson at once; one read serves them all.
+# lesson_cache already hands out a private copy, so only callers that joined are copied again
+@single_flight(name='find_lesson_by_ref', copy_result=copy.deepcopy)
 def find_lesson_by_ref(lesson_ref, country, curriculum, grade, level, subject):
     """
     Find a lesson document in Firestore based on provided parameters.
+    Reads go through lesson_cache, keyed by the full document path.
     Returns: (lesson_path, lesson_data)
     """
     try:
         # Construct the document path with the lessonRef subcollection
-        doc_path = f"countries/{country}/curriculums/{curriculum}/grades/{grade}/levels/{level}/subjects/{subject}/lessonRef/{lesson_ref}"
-        doc_ref = db.document(doc_path)
-
-        logger.info(f"Attempting to fetch lesson at path: {doc_path}")
-
-        # Get the document
-        doc = doc_ref.get()
-
-        if not doc.exists:
+        doc_path = lesson_doc_path(country, curriculum, grade, level, subject, lesson_ref)
+
+        def load_lesson():
+            logger.info(f"Attempting to fetch lesson at path: {doc_path}")
+            with span('firestore.read'):
+                doc = db.document(doc_path).get()
+            if not doc.exists:
+                return None
+            logger.info(f"Found lesson: {doc.id}")
+            # Ensure we always cache a dict
+            data = doc.to_dict() or {}
+            compiled_lessons.note_loaded(doc_path, data)
+            return data
+
+        lesson_data = lesson_cache.get_or_load(doc_path, load_lesson)
+
+        if lesson_data is None:
             logger.error(f"Document not found at path: {doc_path}")
             raise ValueError(f'No lesson found for ref: {lesson_ref}')
 
-        # Get document data
-        lesson_data = doc.to_dict()
-        if not lesson_data:
-            lesson_data = {}  # Ensure we always return a dict
-
         # Add missing fields if they don't exist
         lesson_data.setdefault('lessonRef', lesson_ref)
         lesson_data.setdefault('subject', subject)
         lesson_data.setdefault('gradeLevel', grade)
 
-        logger.info(f"Found lesson: {doc.id}")
-        logger.debug(f"Lesson data: {lesson_data}")
+        logger.debug("Lesson data: %s", truncated(lesson_data))
 
         return doc_path, lesson_data
 
@@ -1455,6 +2435,180 @@ def find_lesson_by_ref(lesson_ref, country, curriculum, grade, level, subject):
         logger.error(f"Error finding lesson: {str(e)}")
         raise ValueError(f'Error retrieving lesson: {str(e)}')
 
+# ===== BACKGROUND BLOOM CLASSIFICATION =====
+def record_bloom_result(analysis_id, interaction_id, bloom_result):
+    """
+    Store a classified Bloom level on its logged interaction and bump the
+    bloom_analysis counter. Jobs can run more than once (a redelivered lease,
+    a retry after a lost ack), so the counter only moves in the transaction
+    that takes the interaction out of 'pending'.
+    """
+    analysis_ref = db.collection('lesson_analysis').document(analysis_id)
+    interaction_ref = analysis_ref.collection('interactions').document(interaction_id)
+
+    @firestore.transactional
+    def write(transaction):
+        snapshot = interaction_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            logger.warning(f"Interaction {analysis_id}/{interaction_id} not found, dropping its Bloom level")
+            return
+        if (snapshot.to_dict() or {}).get('bloom_level', 'pending') != 'pending':
+            return
+        transaction.update(interaction_ref, {'bloom_level': bloom_result})
+        transaction.update(analysis_ref, {f'bloom_analysis.{bloom_level_key(bloom_result)}': firestore.Increment(1)})
+
+    write(db.transaction())
+
+BLOOM_BATCH_MAX_ITEMS = int(os.getenv('BLOOM_BATCH_MAX_ITEMS', '25'))
+BLOOM_BATCH_TOKEN_BUDGET = int(os.getenv('BLOOM_BATCH_TOKEN_BUDGET', '6000'))
+BLOOM_CLASSIFY_MAX_TEXTS = 200
+
+def chunk_bloom_texts(texts, max_items=BLOOM_BATCH_MAX_ITEMS, token_budget=BLOOM_BATCH_TOKEN_BUDGET):
+    """Split texts into batches of indices bounded by item count and estimated tokens."""
+    batches, current, current_tokens = [], [], 0
+    for index, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= max_items or current_tokens + tokens > token_budget):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def build_bloom_batch_prompt(texts):
+    items = json.dumps([{'index': index, 'text': text} for index, text in enumerate(texts)], ensure_ascii=False)
+    return (
+        "Classify each student interaction below into the Bloom's taxonomy level that best applies "
+        "(remembering, understanding, applying, analyzing, evaluating, creating).\n\n"
+        f"Interactions:\n{items}\n\n"
+        "Respond ONLY with a JSON array holding one object per interaction, in this format:\n"
+        '[{"index": 0, "level": "applying", "reason": "short rationale"}, ...]\n'
+    )
+
+def parse_bloom_level(reply):
+    """First Bloom level named in a free-text reply, or None."""
+    match = re.search(r'\b(' + '|'.join(BLOOM_LEVELS) + r')\b', reply.lower())
+    return match.group(1) if match else None
+
+def parse_bloom_batch_response(reply, count):
+    """Per-item Bloom levels from a batch reply; None where an item is missing or malformed."""
+    levels = [None] * count
+    cleaned = re.sub(r'^```(?:json)?\s*|\s*```$', '', reply.strip())
+    try:
+        items = json.loads(cleaned)
+    except ValueError:
+        # Salvage the array if the model wrapped it in prose
+        start, end = cleaned.find('['), cleaned.rfind(']')
+        try:
+            items = json.loads(cleaned[start:end + 1]) if start != -1 and end > start else []
+        except ValueError:
+            items = []
+    if not isinstance(items, list):
+        return levels
+
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        index = item.get('index')
+        level = str(item.get('level', '')).strip().lower()
+        if isinstance(index, int) and 0 <= index < count and level in BLOOM_LEVELS:
+            levels[index] = level
+    return levels
+
+def classify_bloom_batch(texts):
+    """
+    Classify interaction texts into Bloom levels, packing them into as few
+    Gemini calls as BLOOM_BATCH_MAX_ITEMS and BLOOM_BATCH_TOKEN_BUDGET allow.
+    Items the batch reply leaves out or garbles are classified one at a time.
+    """
+    levels = [None] * len(texts)
+    for indices in chunk_bloom_texts(texts):
+        gemini_response = model.generate_content(
+            build_bloom_batch_prompt([texts[index] for index in indices]),
+            request_options={'timeout': GEMINI_TIMEOUT}
+        )
+        batch_levels = parse_bloom_batch_response(gemini_response.text if gemini_response else '', len(indices))
+        for index, level in zip(indices, batch_levels):
+            levels[index] = level
+
+    for index, level in enumerate(levels):
+        if level is None:
+            logger.warning(f"Batch reply had no valid level for item {index}, classifying it alone")
+            gemini_response = model.generate_content(
+                build_bloom_prompt(texts[index]),
+                request_options={'timeout': GEMINI_TIMEOUT}
+            )
+            levels[index] = parse_bloom_level(gemini_response.text if gemini_response else '') or "unknown"
+    return levels
+
+def classify_bloom_jobs(jobs):
+    """Worker handler: classify a batch of queued interactions. Returns the jobs that failed."""
+    levels = classify_bloom_batch([job['text'] for job in jobs])
+    failed = []
+    for job, level in zip(jobs, levels):
+        try:
+            record_bloom_result(job['analysis_id'], job['interaction_id'], level)
+        except Exception as e:
+            logger.error(f"Recording Bloom level failed for {job['analysis_id']}: {str(e)}")
+            failed.append(job)
+    return failed
+
+bloom_queue_backend = os.getenv('BLOOM_QUEUE_BACKEND', 'memory')
+bloom_queue_options = {}
+if bloom_queue_backend == 'sqlite':
+    bloom_queue_options['path'] = os.getenv('BLOOM_QUEUE_SQLITE_PATH', '/tmp/bloom_queue.sqlite3')
+bloom_workers = WorkerPool(
+    create_work_queue(bloom_queue_backend, **bloom_queue_options),
+    classify_bloom_jobs,
+    workers=int(os.getenv('BLOOM_WORKERS', '2')),
+    batch_size=BLOOM_BATCH_MAX_ITEMS,
+    max_attempts=int(os.getenv('BLOOM_MAX_ATTEMPTS', '5')),
+    name='bloom-classifier'
+)
+if bloom_workers.queue.durable:
+    # Jobs persisted before a restart are drained now rather than on the next submit
+    bloom_workers.start()
+atexit.register(bloom_workers.stop)
+
+@app.route('/classify-interactions', methods=['POST'])
+def classify_interactions():
+    """Classify a list of interaction texts into Bloom levels in as few Gemini calls as possible."""
+    try:
+        data = request.get_json()
+        texts = data.get('texts')
+
+        if not isinstance(texts, list) or not texts or not all(isinstance(text, str) for text in texts):
+            return create_response(False, 'texts must be a non-empty list of strings', status_code=400)
+        if len(texts) > BLOOM_CLASSIFY_MAX_TEXTS:
+            return create_response(False, f'At most {BLOOM_CLASSIFY_MAX_TEXTS} texts per request', status_code=400)
+
+        try:
+            levels = classify_bloom_batch(texts)
+        except LLMUnavailableError as e:
+            return llm_unavailable_response(e)
+        except Exception as e:
+            logger.error(f"Gemini API Error: {str(e)}")
+            return create_response(False, f"Gemini API Error: {str(e)}", status_code=500)
+
+        return create_response(True, 'Interactions classified successfully', {
+            'levels': [{'index': index, 'level': level} for index, level in enumerate(levels)]
+        })
+    except Exception as e:
+        logger.error(f"Full error details: {traceback.format_exc()}")
+        return create_response(False, str(e), status_code=500)
+
+@app.route('/bloom-queue-stats', methods=['GET'])
+def bloom_queue_stats():
+    """Report queue depth, retries and dead letters for Bloom classification."""
+    return create_response(True, 'Bloom queue statistics retrieved', {
+        **bloom_workers.stats(),
+        'dead_letters': bloom_workers.queue.dead_letters()[-20:]
+    })
+
+record_timing('import:main', _module_import_started)
+
 # ===== MAIN EXECUTION =====
 if __name__ == "__main__":
     print("Starting server...")
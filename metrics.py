@@ -0,0 +1,203 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds; covers sub-millisecond cache hits up to slow Gemini calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram. observe() is a bisect and a few adds, so
+    it is cheap enough for every request; quantiles are estimated from the
+    buckets by linear interpolation.
+    """
+
+    __slots__ = ('buckets', 'counts', 'count', 'total', '_lock')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.count, self.total
+
+    def quantile(self, q, snapshot=None):
+        counts, count, _ = snapshot or self.snapshot()
+        if not count:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    return lower  # +Inf bucket: report its lower bound
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+
+class RequestTrace:
+    """Spans recorded while serving one request, in the order they finished."""
+
+    __slots__ = ('endpoint', 'started', 'spans')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.spans = []  # (name, seconds)
+
+
+class MetricsRegistry:
+    """Per-endpoint request and span histograms, rendered in Prometheus text format."""
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, prefix='lesson_api'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._requests = {}  # (endpoint, status) -> Histogram
+        self._spans = {}     # (endpoint, span) -> Histogram
+        self._current = contextvars.ContextVar('request_trace', default=None)
+
+    def _histogram(self, table, key):
+        histogram = table.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = table.setdefault(key, Histogram())
+        return histogram
+
+    # ===== TRACING =====
+    def start_trace(self, endpoint):
+        """Begin timing a request; returns a token for finish_trace()."""
+        trace = RequestTrace(endpoint)
+        return trace, self._current.set(trace)
+
+    def finish_trace(self, token, status):
+        trace, context_token = token
+        self._current.reset(context_token)
+        elapsed = time.perf_counter() - trace.started
+        self._histogram(self._requests, (trace.endpoint, str(status))).observe(elapsed)
+        return trace, elapsed
+
+    def current_trace(self):
+        return self._current.get()
+
+    @contextmanager
+    def span(self, name):
+        """Time a phase of the current request; a no-op outside a traced request."""
+        trace = self._current.get()
+        if trace is None:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            trace.spans.append((name, elapsed))
+            self._histogram(self._spans, (trace.endpoint, name)).observe(elapsed)
+
+    # ===== EXPORT =====
+    def summary(self):
+        """p50/p95/p99 in milliseconds per endpoint, merged across status codes."""
+        with self._lock:
+            requests = list(self._requests.items())
+        merged = {}
+        for (endpoint, _), histogram in requests:
+            target = merged.setdefault(endpoint, Histogram())
+            counts, count, total = histogram.snapshot()
+            target.counts = [a + b for a, b in zip(target.counts, counts)]
+            target.count += count
+            target.total += total
+        return {
+            endpoint: {
+                'count': histogram.count,
+                **{f"p{int(q * 100)}_ms": round(histogram.quantile(q) * 1000, 2) for q in self.QUANTILES}
+            }
+            for endpoint, histogram in sorted(merged.items())
+        }
+
+    def render_prometheus(self, gauges=None):
+        """
+        Prometheus text exposition: request and span duration histograms plus
+        a quantile gauge per endpoint. gauges maps a metric name to
+        {label tuple: value} for extra values such as startup timings.
+        """
+        lines = []
+        with self._lock:
+            requests = sorted(self._requests.items())
+            spans = sorted(self._spans.items())
+
+        request_metric = f"{self.prefix}_request_duration_seconds"
+        lines.append(f"# HELP {request_metric} Request latency by endpoint and status.")
+        lines.append(f"# TYPE {request_metric} histogram")
+        for (endpoint, status), histogram in requests:
+            self._render_histogram(lines, request_metric, {'endpoint': endpoint, 'status': status}, histogram)
+
+        span_metric = f"{self.prefix}_span_duration_seconds"
+        lines.append(f"# HELP {span_metric} Time spent in each phase of a request.")
+        lines.append(f"# TYPE {span_metric} histogram")
+        for (endpoint, name), histogram in spans:
+            self._render_histogram(lines, span_metric, {'endpoint': endpoint, 'span': name}, histogram)
+
+        quantile_metric = f"{self.prefix}_request_duration_quantile_seconds"
+        lines.append(f"# HELP {quantile_metric} Estimated request latency quantiles by endpoint.")
+        lines.append(f"# TYPE {quantile_metric} gauge")
+        for endpoint, values in self.summary().items():
+            for q in self.QUANTILES:
+                labels = _format_labels({'endpoint': endpoint, 'quantile': str(q)})
+                lines.append(f"{quantile_metric}{labels} {values[f'p{int(q * 100)}_ms'] / 1000:.6f}")
+
+        for name, samples in (gauges or {}).items():
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            for labels, value in samples.items():
+                lines.append(f"{metric}{_format_labels(dict(labels))} {value}")
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_histogram(lines, metric, labels, histogram):
+        counts, count, total = histogram.snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f"{metric}_bucket{_format_labels({**labels, 'le': le})} {cumulative}")
+        lines.append(f"{metric}_sum{_format_labels(labels)} {total:.6f}")
+        lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + '}'
+
+
+def server_timing_header(trace, total_seconds):
+    """Server-Timing value, e.g. 'firestore;dur=12.1, gemini;dur=840.2, total;dur=861.0'."""
+    parts = [f"{name.replace(' ', '_')};dur={seconds * 1000:.1f}" for name, seconds in trace.spans]
+    parts.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ', '.join(parts)
+
+
+# Process-wide registry shared by the Flask and ASGI entry points
+registry = MetricsRegistry()
+span = registry.span
@@ -0,0 +1,283 @@
+"""
+Prompt templates compiled once, with per-endpoint token budgets.
+
+A PromptTemplate is parsed from str.format syntax when it is created, so
+rendering is a join of precomputed literal text and field values. Fields
+are plain names; callers compute values (joined lists, lookups with
+defaults) before rendering. bind() substitutes some fields up front and
+returns a smaller template, and bind_cached() keeps those per key, which is
+how the lesson-dependent part of a prompt is rendered once per lesson
+version instead of once per request.
+
+Every template may carry a budget in estimated input tokens. A prompt over
+budget has its elastic fields (analytics payloads, lesson text, student
+questions) shrunk to fit: the largest fields give up room first, dicts and
+lists are condensed to compact JSON that keeps every key and the leading
+items, and long text is truncated with a note saying how much was left out.
+Prompts within budget render exactly as their source reads.
+"""
+import json
+import logging
+import string
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+# Elastic fields are never cut below this, even if the prompt stays over budget
+MIN_FIELD_CHARS = 200
+TRUNCATION_MARKER = ' [... {omitted} characters omitted]'
+
+_templates = []
+_templates_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token) used for prompt budgeting."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def budgets_from_env(value):
+    """Parse 'generate-summary=2000,ai-tutor=1000' into {endpoint: tokens}."""
+    budgets = {}
+    for item in (value or '').split(','):
+        endpoint, sep, tokens = item.strip().rpartition('=')
+        if sep and endpoint:
+            budgets[endpoint] = int(tokens)
+    return budgets
+
+
+def allocate(sizes, available):
+    """
+    Split available characters between fields of the given sizes: fields
+    smaller than an even share keep their size, and what they leave over is
+    shared by the larger ones. Returns a cap per field, in order.
+    """
+    caps = [0] * len(sizes)
+    remaining = max(available, 0)
+    order = sorted(range(len(sizes)), key=sizes.__getitem__)
+    for position, index in enumerate(order):
+        caps[index] = min(sizes[index], remaining // (len(order) - position))
+        remaining -= caps[index]
+    return caps
+
+
+def truncate(text, max_chars):
+    if len(text) <= max_chars:
+        return text
+    keep = max(max_chars - len(TRUNCATION_MARKER) - 6, 0)
+    return text[:keep] + TRUNCATION_MARKER.format(omitted=len(text) - keep)
+
+
+def _dumps(value):
+    return json.dumps(value, default=str, ensure_ascii=False, separators=(',', ':'))
+
+
+def summarize(value, max_chars):
+    """
+    Compact JSON for value in about max_chars. Dicts keep every key and share
+    the room between their values, lists keep their leading items and count
+    the rest, and long strings are truncated.
+    """
+    text = _dumps(value)
+    if len(text) <= max_chars:
+        return text
+    if isinstance(value, dict):
+        keys = [_dumps(str(key)) for key in value]
+        items = list(value.values())
+        pieces = [_dumps(item) for item in items]
+        caps = allocate([len(piece) for piece in pieces], max_chars - sum(len(key) + 2 for key in keys))
+        return '{' + ','.join(
+            f"{key}:{piece if len(piece) <= cap else summarize(item, cap)}"
+            for key, item, piece, cap in zip(keys, items, pieces, caps)
+        ) + '}'
+    if isinstance(value, (list, tuple)):
+        room = max_chars - len('"... 000000 more items"') - 2
+        kept, used = [], 0
+        for item in value:
+            piece = _dumps(item)
+            if used + len(piece) + 1 > room:
+                break
+            kept.append(piece)
+            used += len(piece) + 1
+        if not kept:
+            kept.append(summarize(value[0], room))
+        if len(value) > len(kept):
+            kept.append(_dumps(f"... {len(value) - len(kept)} more items"))
+        return '[' + ','.join(kept) + ']'
+    if isinstance(value, str):
+        return _dumps(truncate(value, max_chars - 2))
+    return text
+
+
+def shrink(value, max_chars):
+    """value as prompt text of at most max_chars characters."""
+    text = summarize(value, max_chars) if isinstance(value, (dict, list, tuple)) else str(value)
+    return truncate(text, max_chars)
+
+
+class _TemplateStats:
+    __slots__ = ('renders', 'tokens', 'max_tokens', 'shrunk', 'over_budget', 'render_seconds',
+                 'fragment_hits', 'fragment_misses')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+class PromptTemplate:
+    """
+    A prompt in str.format syntax, parsed once. elastic names the fields
+    that may be shrunk to keep the prompt within budget estimated tokens
+    (no limit when budget is falsy). Templates made by bind() share the
+    name, budget and stats of the template they came from; elastic fields
+    given to bind() stay open, holding the value as a default, so they can
+    still be shrunk when the prompt is rendered.
+    """
+
+    def __init__(self, name, source, elastic=(), budget=None, max_fragments=1024):
+        parts = []
+        for literal, field, format_spec, conversion in string.Formatter().parse(source):
+            if field is not None and (not field.isidentifier() or format_spec or conversion):
+                raise ValueError(f"Prompt template {name}: fields must be plain names, got {{{field}}}")
+            parts.append((literal, field))
+        self._init(name, parts, tuple(elastic), budget, max_fragments, _TemplateStats(), threading.Lock(), {})
+        with _templates_lock:
+            _templates.append(self)
+
+    def _init(self, name, parts, elastic, budget, max_fragments, stats, lock, defaults):
+        self.name = name
+        self.elastic = elastic
+        self.budget = budget
+        self.max_fragments = max_fragments
+        self._parts = parts
+        self._defaults = defaults
+        self._stats = stats
+        self._fragments = OrderedDict()
+        self._lock = lock
+        # Literal text with a slot after each literal for its field; rendering fills the slots and joins
+        self._pieces = []
+        self._slots = []  # (index in _pieces, field)
+        for literal, field in parts:
+            self._pieces.append(literal)
+            if field is not None:
+                self._slots.append((len(self._pieces), field))
+                self._pieces.append('')
+        self._counts = {}  # field -> occurrences
+        for _, field in parts:
+            if field is not None:
+                self._counts[field] = self._counts.get(field, 0) + 1
+        self.fields = frozenset(self._counts)
+
+    def bind(self, **values):
+        """A template with the given fields filled in and the rest left open."""
+        parts, pending = [], ''
+        for literal, field in self._parts:
+            pending += literal
+            if field in values and field not in self.elastic:
+                pending += str(values[field])
+            else:
+                parts.append((pending, field))
+                pending = ''
+        if pending:
+            parts.append((pending, None))
+        bound = object.__new__(PromptTemplate)
+        defaults = {**self._defaults, **{field: value for field, value in values.items() if field in self.elastic}}
+        bound._init(self.name, parts, self.elastic, self.budget, self.max_fragments, self._stats, self._lock, defaults)
+        return bound
+
+    def bind_cached(self, key, make_values):
+        """
+        bind(**make_values()), remembered under key, which must identify
+        everything the values depend on (e.g. lesson path and version).
+        """
+        with self._lock:
+            bound = self._fragments.get(key)
+            if bound is not None:
+                self._fragments.move_to_end(key)
+                self._stats.fragment_hits += 1
+                return bound
+            self._stats.fragment_misses += 1
+        bound = self.bind(**make_values())
+        with self._lock:
+            self._fragments[key] = bound
+            while len(self._fragments) > self.max_fragments:
+                self._fragments.popitem(last=False)
+        return bound
+
+    def render(self, **values):
+        started = time.perf_counter()
+        if self._defaults:
+            values = {**self._defaults, **values}
+        try:
+            texts = {field: str(values[field]) for field in self.fields}
+        except KeyError:
+            missing = ', '.join(sorted(self.fields - values.keys()))
+            raise ValueError(f"Prompt template {self.name} is missing fields: {missing}") from None
+        prompt = self._join(texts)
+        shrunk = False
+        if self.budget and len(prompt) > self.budget * CHARS_PER_TOKEN:
+            shrunk = self._fit(values, texts, len(prompt), self.budget * CHARS_PER_TOKEN)
+            if shrunk:
+                prompt = self._join(texts)
+
+        tokens = estimate_tokens(prompt)
+        over_budget = bool(self.budget) and tokens > self.budget
+        if over_budget:
+            logger.warning(f"Prompt {self.name} is over its budget after shrinking: {tokens} > {self.budget} tokens")
+        with self._lock:
+            stats = self._stats
+            stats.renders += 1
+            stats.tokens += tokens
+            stats.max_tokens = max(stats.max_tokens, tokens)
+            stats.shrunk += shrunk
+            stats.over_budget += over_budget
+            stats.render_seconds += time.perf_counter() - started
+        return prompt
+
+    def _join(self, texts):
+        pieces = self._pieces.copy()
+        for index, field in self._slots:
+            pieces[index] = texts[field]
+        return ''.join(pieces)
+
+    def _fit(self, values, texts, total, budget_chars):
+        """Shrink elastic fields in texts so the prompt fits; returns whether any was shrunk."""
+        elastic = [field for field in self.elastic if field in texts]
+        if not elastic:
+            return False
+        sizes = [self._counts[field] * len(texts[field]) for field in elastic]
+        caps = allocate(sizes, budget_chars - (total - sum(sizes)))
+        shrunk = False
+        for field, cap in zip(elastic, caps):
+            limit = max(cap // self._counts[field], MIN_FIELD_CHARS)
+            if len(texts[field]) > limit:
+                texts[field] = shrink(values[field], limit)
+                shrunk = True
+        if shrunk:
+            logger.info(f"Shrank prompt {self.name} from about {total // CHARS_PER_TOKEN} tokens to fit {self.budget}")
+        return shrunk
+
+    def stats(self):
+        with self._lock:
+            stats = self._stats
+            return {
+                'budget': self.budget,
+                'renders': stats.renders,
+                'avg_estimated_tokens': (stats.tokens / stats.renders) if stats.renders else 0.0,
+                'max_estimated_tokens': stats.max_tokens,
+                'shrunk': stats.shrunk,
+                'over_budget': stats.over_budget,
+                'avg_render_ms': (stats.render_seconds * 1000 / stats.renders) if stats.renders else 0.0,
+                'fragment_hits': stats.fragment_hits,
+                'fragment_misses': stats.fragment_misses,
+                'cached_fragments': len(self._fragments)
+            }
+
+
+def prompt_template_stats():
+    """Stats for every PromptTemplate in the process, by name."""
+    with _templates_lock:
+        return {template.name: template.stats() for template in _templates}
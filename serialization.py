@@ -0,0 +1,136 @@
+import gzip
+import json
+import logging
+from datetime import date, datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Bodies smaller than this are sent as-is; compressing them costs more than it saves
+MIN_COMPRESS_BYTES = 1024
+
+
+def _is_firestore_sentinel(obj):
+    # Checked by name so Firestore never has to be imported just to serialize
+    cls = type(obj)
+    return cls.__name__ == 'Sentinel' and 'firestore' in cls.__module__
+
+
+def encode_default(obj):
+    """
+    Fallback for values JSON has no type for. SERVER_TIMESTAMP sentinels
+    become the current UTC time, as FirestoreJSONEncoder does, and
+    datetimes (including Firestore's DatetimeWithNanoseconds) become
+    ISO 8601 strings.
+    """
+    if _is_firestore_sentinel(obj):
+        return datetime.now(timezone.utc).isoformat()
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class StdlibSerializer:
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj, default=encode_default).encode('utf-8')
+
+
+class OrjsonSerializer:
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+
+        self._dumps = orjson.dumps
+        self._options = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj):
+        return self._dumps(obj, default=encode_default, option=self._options)
+
+
+class MsgspecSerializer:
+    name = 'msgspec'
+
+    def __init__(self):
+        import msgspec
+
+        self._encode = msgspec.json.Encoder(enc_hook=encode_default).encode
+
+    def dumps(self, obj):
+        return self._encode(obj)
+
+
+SERIALIZERS = {
+    'orjson': OrjsonSerializer,
+    'msgspec': MsgspecSerializer,
+    'json': StdlibSerializer
+}
+
+
+def create_serializer(kind='auto'):
+    """
+    Build a serializer by name: 'orjson', 'msgspec', 'json', or 'auto' for
+    the fastest one installed. A named backend that is not installed falls
+    back to the stdlib.
+    """
+    kind = (kind or 'auto').lower()
+    candidates = ['orjson', 'msgspec', 'json'] if kind == 'auto' else [kind, 'json']
+    for candidate in candidates:
+        if candidate not in SERIALIZERS:
+            raise ValueError(f"Unknown serializer: {candidate}")
+        try:
+            serializer = SERIALIZERS[candidate]()
+        except ImportError:
+            continue
+        logger.info(f"Using {serializer.name} response serializer")
+        return serializer
+    return StdlibSerializer()
+
+
+# ===== COMPRESSION =====
+def _brotli_compress():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    # Quality 4 is close to gzip's ratio at a fraction of brotli's default CPU cost
+    return lambda body: brotli.compress(body, quality=4)
+
+
+COMPRESSORS = {'gzip': lambda body: gzip.compress(body, compresslevel=5)}
+_brotli = _brotli_compress()
+if _brotli is not None:
+    COMPRESSORS['br'] = _brotli
+
+
+def negotiate_encoding(accept_encoding, enabled=('br', 'gzip')):
+    """Best available encoding the client accepts (br over gzip), or None."""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in enabled:
+        if encoding in COMPRESSORS and accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress_body(body, accept_encoding, enabled=('br', 'gzip'), min_bytes=MIN_COMPRESS_BYTES):
+    """Return (body, encoding); encoding is None when the body is left uncompressed."""
+    if len(body) < min_bytes:
+        return body, None
+    encoding = negotiate_encoding(accept_encoding, enabled)
+    if encoding is None:
+        return body, None
+    return COMPRESSORS[encoding](body), encoding
@@ -0,0 +1,315 @@
+"""
+Lesson session lifecycle.
+
+A session is in one of four states:
+
+    active --pause--> paused --resume--> active
+    active|paused --complete--> completed
+    active|paused --expire--> expired --resume--> active
+
+Every transition reads the lesson_sessions document and writes it, its
+lesson_states mirror and (for progress) lesson_progress in one transaction,
+so the three documents cannot disagree. Time spent active is accumulated
+on the server in elapsed_seconds: each stretch runs from active_since to
+the pause, completion or, for expiry, the last interaction.
+
+The idle sweeper queries lesson_sessions on (status, last_interaction),
+which needs a composite index on those two fields.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from firestore_limits import MAX_BATCH_WRITES
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = 'active'
+PAUSED = 'paused'
+COMPLETED = 'completed'
+EXPIRED = 'expired'
+OPEN_STATES = (ACTIVE, PAUSED)
+
+# action -> (states it may start from, state it leads to)
+TRANSITIONS = {
+    'pause': ({ACTIVE}, PAUSED),
+    'resume': ({PAUSED, EXPIRED}, ACTIVE),
+    'complete': ({ACTIVE, PAUSED}, COMPLETED),
+    'expire': ({ACTIVE, PAUSED}, EXPIRED)
+}
+
+
+class SessionNotFound(LookupError):
+    pass
+
+
+class InvalidTransition(ValueError):
+    def __init__(self, action, status):
+        super().__init__(f"Cannot {action} a session that is {status}")
+        self.action = action
+        self.status = status
+
+
+def _as_utc(value):
+    return value if isinstance(value, datetime) and value.tzinfo else None
+
+
+def active_seconds(session, until):
+    """Seconds of the current active stretch, up to until; 0 when the start is unknown."""
+    started = _as_utc(session.get('active_since')) or _as_utc(session.get('created_at'))
+    if started is None or until is None:
+        return 0.0
+    return max((until - started).total_seconds(), 0.0)
+
+
+def plan_transition(action, session, now):
+    """
+    Field updates for applying action to a session document, or None when
+    the session is already in the target state (repeating an action is a
+    no-op). Raises InvalidTransition when the action is not allowed.
+    """
+    sources, target = TRANSITIONS[action]
+    status = session.get('status', ACTIVE)
+    if status == target:
+        return None
+    if status not in sources:
+        raise InvalidTransition(action, status)
+
+    updates = {'status': target, 'previous_status': status}
+    elapsed = session.get('elapsed_seconds', 0)
+    if status == ACTIVE:
+        until = now
+        if target == EXPIRED:
+            # An expired session stopped being active at its last interaction, not now
+            until = _as_utc(session.get('last_interaction')) or now
+        updates['elapsed_seconds'] = elapsed + active_seconds(session, until)
+    if target == ACTIVE:
+        updates['active_since'] = now
+    if target == COMPLETED:
+        updates['completion_status'] = 'completed'
+        updates['completed_at'] = now
+    elif target == EXPIRED:
+        updates['expired_at'] = now
+    return updates
+
+
+class SessionEngine:
+    """
+    Applies lifecycle transitions to lesson sessions. session_states, when
+    given, is the SessionStateStore buffering time_spent; a session's
+    buffered updates are flushed before it changes state.
+    """
+
+    def __init__(self, db, session_states=None, sessions_collection='lesson_sessions',
+                 states_collection='lesson_states', progress_collection='lesson_progress'):
+        self.db = db
+        self.session_states = session_states
+        self.sessions_collection = sessions_collection
+        self.states_collection = states_collection
+        self.progress_collection = progress_collection
+        self._sweeper = None
+        self._stopping = threading.Event()
+
+    def _refs(self, session_id):
+        return (
+            self.db.collection(self.sessions_collection).document(session_id),
+            self.db.collection(self.states_collection).document(session_id)
+        )
+
+    def _summary(self, session_id, session, now):
+        status = session.get('status', ACTIVE)
+        elapsed = session.get('elapsed_seconds', 0)
+        if status == ACTIVE:
+            elapsed += active_seconds(session, now)
+        return {
+            'session_id': session_id,
+            'status': status,
+            'previous_status': session.get('previous_status'),
+            'elapsed_seconds': round(elapsed, 3),
+            'progress': session.get('progress', 0)
+        }
+
+    def _run_transaction(self, session_id, apply):
+        """Run apply(transaction, session_ref, state_ref, session, now) in a transaction; returns its result."""
+        from firebase_admin import firestore
+
+        if self.session_states is not None:
+            self.session_states.flush_session(session_id)
+        session_ref, state_ref = self._refs(session_id)
+
+        @firestore.transactional
+        def run(transaction):
+            snapshot = session_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                raise SessionNotFound(f"No session found: {session_id}")
+            now = datetime.now(timezone.utc)
+            return apply(transaction, session_ref, state_ref, snapshot.to_dict() or {}, now)
+
+        return run(self.db.transaction())
+
+    def transition(self, session_id, action, fields=None):
+        """Apply action ('pause', 'resume', 'complete', 'expire') and return the session summary."""
+        from firebase_admin import firestore
+
+        def apply(transaction, session_ref, state_ref, session, now):
+            updates = plan_transition(action, session, now)
+            if updates is None:
+                return self._summary(session_id, session, now)
+            updates.update({name: value for name, value in (fields or {}).items() if value is not None})
+            updates['last_modified'] = firestore.SERVER_TIMESTAMP
+            transaction.update(session_ref, updates)
+            transaction.set(state_ref, {'status': updates['status'], 'last_activity': firestore.SERVER_TIMESTAMP},
+                            merge=True)
+            return self._summary(session_id, {**session, **updates}, now)
+
+        return self._run_transaction(session_id, apply)
+
+    def pause(self, session_id, client_timestamp=None, reason=None):
+        return self.transition(session_id, 'pause', {
+            'last_active': client_timestamp,
+            'pause_reason': reason or 'No reason provided'
+        })
+
+    def resume(self, session_id, client_timestamp=None):
+        return self.transition(session_id, 'resume', {'last_resumed': client_timestamp})
+
+    def complete(self, session_id):
+        return self.transition(session_id, 'complete')
+
+    def save_progress(self, session_id, lesson_ref, progress):
+        """
+        Record progress (0-100) on the session and in lesson_progress; reaching
+        100 completes the session. Closed sessions reject new progress.
+        """
+        from firebase_admin import firestore
+
+        if isinstance(progress, bool) or not isinstance(progress, (int, float)) or not 0 <= progress <= 100:
+            raise ValueError('progress must be a number from 0 to 100')
+
+        def apply(transaction, session_ref, state_ref, session, now):
+            status = session.get('status', ACTIVE)
+            if status not in OPEN_STATES:
+                raise InvalidTransition('save progress on', status)
+            updates = {
+                'progress': progress,
+                'last_interaction': firestore.SERVER_TIMESTAMP,
+                'last_modified': firestore.SERVER_TIMESTAMP
+            }
+            if progress >= 100:
+                updates.update(plan_transition('complete', session, now))
+            transaction.set(self.db.collection(self.progress_collection).document(session_id), {
+                'session_id': session_id,
+                'lesson_ref': lesson_ref,
+                'progress': progress,
+                'updated_at': firestore.SERVER_TIMESTAMP
+            })
+            transaction.update(session_ref, updates)
+            transaction.set(state_ref, {
+                'status': updates.get('status', status),
+                'last_activity': firestore.SERVER_TIMESTAMP
+            }, merge=True)
+            # last_interaction is a sentinel until committed; the summary reports the old value
+            return self._summary(session_id, {**session, **updates, 'last_interaction': now}, now)
+
+        return self._run_transaction(session_id, apply)
+
+    # ===== IDLE SWEEPER =====
+    def expire_idle(self, idle_seconds, page_size=250, max_sessions=None):
+        """
+        Expire open sessions whose last interaction is older than idle_seconds.
+        Pages through the (status, last_interaction) index oldest first and
+        writes each page as one batch; expired sessions drop out of the query,
+        so every page is the same query again. Each update only applies if
+        the session is unchanged since the query read it. A batch is all or
+        nothing, so when one of them was touched in between, that page is
+        re-checked and expired one session per transaction. Returns counts.
+        """
+        from firebase_admin import firestore
+        from google.api_core.exceptions import FailedPrecondition
+
+        now = datetime.now(timezone.utc)
+        cutoff = now - timedelta(seconds=idle_seconds)
+        # Expiring a session writes two documents
+        page_size = min(page_size, MAX_BATCH_WRITES // 2)
+        report = {'expired': 0, 'batches': 0, 'conflicts': 0, 'cutoff': cutoff.isoformat()}
+
+        while max_sessions is None or report['expired'] < max_sessions:
+            limit = page_size if max_sessions is None else min(page_size, max_sessions - report['expired'])
+            query = (
+                self.db.collection(self.sessions_collection)
+                .where('status', 'in', list(OPEN_STATES))
+                .where('last_interaction', '<', cutoff)
+                .order_by('last_interaction')
+                .limit(limit)
+                .select(['status', 'active_since', 'created_at', 'elapsed_seconds', 'last_interaction'])
+            )
+            snapshots = list(query.stream())
+            if not snapshots:
+                break
+
+            batch = self.db.batch()
+            for snapshot in snapshots:
+                updates = plan_transition('expire', snapshot.to_dict() or {}, now)
+                updates['last_modified'] = firestore.SERVER_TIMESTAMP
+                batch.update(snapshot.reference, updates,
+                             option=self.db.write_option(last_update_time=snapshot.update_time))
+                batch.set(self.db.collection(self.states_collection).document(snapshot.id),
+                          {'status': EXPIRED, 'last_activity': firestore.SERVER_TIMESTAMP}, merge=True)
+            try:
+                batch.commit()
+                expired = [snapshot.id for snapshot in snapshots]
+            except FailedPrecondition:
+                # A session was paused, resumed or interacted with after the query read it
+                report['conflicts'] += 1
+                expired = [snapshot.id for snapshot in snapshots if self._expire_if_idle(snapshot.id, cutoff)]
+            if self.session_states is not None:
+                for session_id in expired:
+                    self.session_states.forget(session_id)
+
+            report['expired'] += len(expired)
+            report['batches'] += 1
+            if len(snapshots) < limit:
+                break
+
+        if report['expired']:
+            logger.info(f"Expired {report['expired']} sessions idle since before {report['cutoff']}")
+        return report
+
+    def _expire_if_idle(self, session_id, cutoff):
+        """Expire one session in a transaction if it is still open and idle since before cutoff."""
+        from firebase_admin import firestore
+
+        def apply(transaction, session_ref, state_ref, session, now):
+            last_interaction = _as_utc(session.get('last_interaction'))
+            if session.get('status', ACTIVE) not in OPEN_STATES or last_interaction is None or last_interaction >= cutoff:
+                return False
+            updates = plan_transition('expire', session, now)
+            updates['last_modified'] = firestore.SERVER_TIMESTAMP
+            transaction.update(session_ref, updates)
+            transaction.set(state_ref, {'status': EXPIRED, 'last_activity': firestore.SERVER_TIMESTAMP}, merge=True)
+            return True
+
+        try:
+            return self._run_transaction(session_id, apply)
+        except SessionNotFound:
+            return False
+
+    def start_sweeper(self, interval_seconds, idle_seconds):
+        """Run expire_idle every interval_seconds on a background thread."""
+        if self._sweeper is not None:
+            return
+
+        def run():
+            while not self._stopping.wait(interval_seconds):
+                try:
+                    self.expire_idle(idle_seconds)
+                except Exception as e:
+                    logger.error(f"Idle session sweep failed: {e}", exc_info=True)
+
+        self._stopping.clear()
+        self._sweeper = threading.Thread(target=run, name='session-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stopping.set()
+        self._sweeper = None
@@ -0,0 +1,294 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from firestore_limits import MAX_BATCH_WRITES
+
+logger = logging.getLogger(__name__)
+
+
+class _SessionState:
+    __slots__ = ('time_spent', 'total_duration', 'pending_time', 'pending_updates', 'dirty_since',
+                 'flushing', 'last_access')
+
+    def __init__(self, time_spent, total_duration):
+        self.time_spent = time_spent
+        self.total_duration = total_duration
+        self.pending_time = 0
+        self.pending_updates = 0
+        self.dirty_since = None
+        self.flushing = False
+        self.last_access = time.monotonic()
+
+    @property
+    def evictable(self):
+        return not self.pending_updates and not self.flushing
+
+
+class SessionStateStore:
+    """
+    Write-behind buffer for the hot fields of lesson_states documents.
+
+    Each session's state is read from Firestore once (or primed when the
+    session is created) and then kept in memory. add_time_spent() only
+    updates memory; the accumulated minutes are written later as a single
+    Increment per session. That happens every flush_interval seconds, as soon
+    as a session collects max_dirty updates, or when flush_session() is
+    called, e.g. on pause and resume. Increment keeps the stored total right
+    even when several instances buffer updates for the same session.
+
+    An unflushed update is never older than max_unflushed_seconds: if the
+    background flusher falls behind or keeps failing, the next update to that
+    session flushes it on the caller's thread. That bounds what a crash can
+    lose. Clean sessions idle for idle_seconds are dropped from memory.
+
+    With touch_collection set, each flush also stamps last_interaction on the
+    session's document there, so idle-session queries see recent activity
+    without a write per interaction.
+    """
+
+    def __init__(self, db, collection='lesson_states', flush_interval=5.0, max_dirty=20,
+                 max_unflushed_seconds=30.0, idle_seconds=1800.0, max_sessions=10000, touch_collection=None):
+        self.db = db
+        self.collection = collection
+        self.touch_collection = touch_collection
+        self.flush_interval = flush_interval
+        self.max_dirty = max(1, max_dirty)
+        self.max_unflushed_seconds = max_unflushed_seconds
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session_id -> _SessionState, least recently used first
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.loads = 0
+        self.updates = 0
+        self.writes = 0
+        self.batches = 0
+        self.failures = 0
+        self.forced_flushes = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='session-state-flusher', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the flusher and write everything still buffered."""
+        self._stopping.set()
+        self._wake.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+
+    # ===== READS AND UPDATES =====
+    def prime(self, session_id, lesson_state):
+        """Seed a session that was just written, so its first update skips the read."""
+        state = _SessionState(lesson_state.get('time_spent', 0), lesson_state.get('total_duration', 30))
+        with self._lock:
+            self._sessions[session_id] = state
+            self._evict_over_capacity()
+
+    def _load(self, session_id):
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is not None:
+                self._sessions.move_to_end(session_id)
+                return state
+
+        snapshot = self.db.collection(self.collection).document(session_id).get()
+        if not snapshot.exists:
+            raise ValueError(f"No lesson state for session: {session_id}")
+        data = snapshot.to_dict() or {}
+        with self._lock:
+            self.loads += 1
+            # Another thread may have loaded it meanwhile; keep the one holding updates
+            state = self._sessions.setdefault(
+                session_id, _SessionState(data.get('time_spent', 0), data.get('total_duration', 30))
+            )
+            self._sessions.move_to_end(session_id)
+            self._evict_over_capacity()
+        return state
+
+    def add_time_spent(self, session_id, minutes):
+        """Add minutes to the session and return (time_spent, total_duration) after the update."""
+        self.start()
+        state = self._load(session_id)
+        now = time.monotonic()
+        with self._lock:
+            state.time_spent += minutes
+            state.pending_time += minutes
+            state.pending_updates += 1
+            state.last_access = now
+            if state.dirty_since is None:
+                state.dirty_since = now
+            self.updates += 1
+            result = state.time_spent, state.total_duration
+            overdue = now - state.dirty_since > self.max_unflushed_seconds
+            if state.pending_updates >= self.max_dirty:
+                self._wake.set()
+
+        if overdue:
+            with self._lock:
+                self.forced_flushes += 1
+            self.flush_session(session_id)
+        return result
+
+    # ===== FLUSHING =====
+    def _take_pending(self, session_ids=None):
+        """Detach and return {session_id: (minutes, updates, dirty_since)} for dirty sessions."""
+        taken = {}
+        with self._lock:
+            for session_id in (session_ids if session_ids is not None else list(self._sessions)):
+                state = self._sessions.get(session_id)
+                if state is None or not state.pending_updates:
+                    continue
+                taken[session_id] = (state.pending_time, state.pending_updates, state.dirty_since)
+                state.pending_time = 0
+                state.pending_updates = 0
+                state.dirty_since = None
+                state.flushing = True
+        return taken
+
+    def _finish_flush(self, session_ids):
+        with self._lock:
+            for session_id in session_ids:
+                state = self._sessions.get(session_id)
+                if state is not None:
+                    state.flushing = False
+
+    def _restore_pending(self, pending):
+        """Put back updates whose write failed, so the next flush retries them."""
+        with self._lock:
+            for session_id, (minutes, updates, dirty_since) in pending.items():
+                state = self._sessions.get(session_id)
+                if state is None:
+                    continue  # forgotten while its write was in flight
+                state.pending_time += minutes
+                state.pending_updates += updates
+                state.dirty_since = min(dirty_since, state.dirty_since or dirty_since)
+
+    def flush(self, session_ids=None):
+        """Write buffered updates (for the given sessions, or all); returns the number of sessions written."""
+        with self._flush_lock:
+            pending = self._take_pending(session_ids)
+            if not pending:
+                return 0
+            from firebase_admin import firestore
+
+            items = list(pending.items())
+            written = 0
+            sessions_per_batch = MAX_BATCH_WRITES // (2 if self.touch_collection else 1)
+            for offset in range(0, len(items), sessions_per_batch):
+                chunk = dict(items[offset:offset + sessions_per_batch])
+                batch = self.db.batch()
+                for session_id, (minutes, _, _) in chunk.items():
+                    for reference, update in self._updates(session_id, minutes, firestore):
+                        batch.update(reference, update)
+                try:
+                    batch.commit()
+                except Exception as e:
+                    # A session deleted since it was loaded fails the whole batch; retry one by one
+                    logger.warning(f"Session state batch of {len(chunk)} failed, writing individually: {e}")
+                    written += self._write_individually(chunk, firestore)
+                    continue
+                finally:
+                    self._finish_flush(chunk)
+                written += len(chunk)
+                with self._lock:
+                    self.batches += 1
+            with self._lock:
+                self.writes += written
+            return written
+
+    def _updates(self, session_id, minutes, firestore):
+        updates = [(self.db.collection(self.collection).document(session_id), {
+            'time_spent': firestore.Increment(minutes),
+            'last_activity': firestore.SERVER_TIMESTAMP
+        })]
+        if self.touch_collection:
+            updates.append((self.db.collection(self.touch_collection).document(session_id), {
+                'last_interaction': firestore.SERVER_TIMESTAMP
+            }))
+        return updates
+
+    def _write_individually(self, pending, firestore):
+        written = 0
+        failed = {}
+        for session_id, (minutes, updates, dirty_since) in pending.items():
+            try:
+                batch = self.db.batch()
+                for reference, update in self._updates(session_id, minutes, firestore):
+                    batch.update(reference, update)
+                batch.commit()
+                written += 1
+            except Exception as e:
+                if type(e).__name__ == 'NotFound':
+                    logger.warning(f"Dropping buffered time for deleted session {session_id}")
+                    self.forget(session_id)
+                    continue
+                failed[session_id] = (minutes, updates, dirty_since)
+        if failed:
+            with self._lock:
+                self.failures += len(failed)
+            self._restore_pending(failed)
+        return written
+
+    def flush_session(self, session_id):
+        return self.flush([session_id])
+
+    def forget(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Session state flush failed: {e}", exc_info=True)
+            self._evict_idle()
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [session_id for session_id, state in self._sessions.items()
+                    if state.evictable and state.last_access < cutoff]
+            for session_id in idle:
+                del self._sessions[session_id]
+
+    def _evict_over_capacity(self):
+        # Caller holds self._lock; sessions with unflushed updates are never evicted
+        excess = len(self._sessions) - self.max_sessions
+        if excess <= 0:
+            return
+        for session_id in [session_id for session_id, state in self._sessions.items() if state.evictable][:excess]:
+            del self._sessions[session_id]
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            dirty = [state for state in self._sessions.values() if state.pending_updates]
+            return {
+                'sessions': len(self._sessions),
+                'dirty_sessions': len(dirty),
+                'pending_updates': sum(state.pending_updates for state in dirty),
+                'oldest_unflushed_seconds': round(max((now - state.dirty_since for state in dirty), default=0.0), 3),
+                'loads': self.loads,
+                'updates': self.updates,
+                'writes': self.writes,
+                'batches': self.batches,
+                'failures': self.failures,
+                'forced_flushes': self.forced_flushes,
+                'updates_per_write': (self.updates / self.writes) if self.writes else 0.0
+            }
@@ -0,0 +1,159 @@
+import asyncio
+import functools
+import threading
+
+_groups = []
+_groups_lock = threading.Lock()
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiting')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiting = 1  # callers yet to collect the result, the leader included
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one execution.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is in flight wait and share its result or exception.
+    Nothing is cached: once the call finishes, the next caller runs it again.
+    When copy_result is given, the function must return an object its
+    caller may own (a fresh copy, say). Callers that shared a call receive
+    copy_result(result), except the last to collect it, which gets result
+    itself once the other copies are taken, so callers that mutate what they
+    get back do not see each other's changes. A call nobody joined is never
+    copied.
+    """
+
+    def __init__(self, name, copy_result=None):
+        self.name = name
+        self.copy_result = copy_result
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self.executions = 0
+        self.coalesced = 0
+        with _groups_lock:
+            _groups.append(self)
+
+    def _share(self, call, result):
+        if not self.copy_result:
+            return result
+        with self._lock:
+            last = call.waiting == 1
+        if not last:
+            result = self.copy_result(result)
+        with self._lock:
+            call.waiting -= 1
+        return result
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                call.waiting += 1
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return self._share(call, call.result)
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return self._share(call, call.result)
+
+    async def do_async(self, key, coroutine_func):
+        """
+        Async counterpart of do(); callers must share one event loop. The call
+        runs as its own task, so a caller that is cancelled (the leader
+        included) stops waiting without cancelling it for the others.
+        """
+        entry = self._async_calls.get(key)
+        if entry is None or entry[0].done():
+            task, call = asyncio.ensure_future(coroutine_func()), _Call()
+            self._async_calls[key] = task, call
+            task.add_done_callback(functools.partial(self._async_call_done, key))
+            with self._lock:
+                self.executions += 1
+        else:
+            task, call = entry
+            with self._lock:
+                call.waiting += 1
+                self.coalesced += 1
+        try:
+            result = await asyncio.shield(task)
+        except BaseException:
+            with self._lock:
+                call.waiting -= 1
+            raise
+        return self._share(call, result)
+
+    def _async_call_done(self, key, task):
+        entry = self._async_calls.get(key)
+        if entry is not None and entry[0] is task:
+            del self._async_calls[key]
+        if not task.cancelled():
+            task.exception()  # retrieved, so a failure nobody waited for is not logged as unhandled
+
+    def stats(self):
+        with self._lock:
+            calls = self.executions + self.coalesced
+            return {
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls) + len(self._async_calls),
+                'coalesced_rate': (self.coalesced / calls) if calls else 0.0
+            }
+
+
+def _default_key(*args, **kwargs):
+    return args, tuple(sorted(kwargs.items()))
+
+
+def single_flight(name=None, key=None, copy_result=None):
+    """
+    Decorator form of SingleFlight for sync and async functions. key(*args,
+    **kwargs) builds the coalescing key (all arguments by default, which
+    must be hashable). The group is exposed as wrapper.single_flight.
+    """
+    def decorate(func):
+        flight = SingleFlight(name or func.__qualname__, copy_result)
+        make_key = key or _default_key
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                return await flight.do_async(make_key(*args, **kwargs), lambda: func(*args, **kwargs))
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return flight.do(make_key(*args, **kwargs), lambda: func(*args, **kwargs))
+
+        wrapper.single_flight = flight
+        return wrapper
+    return decorate
+
+
+def single_flight_stats():
+    """Stats for every SingleFlight group in the process, by name."""
+    with _groups_lock:
+        return {group.name: group.stats() for group in _groups}
@@ -0,0 +1,116 @@
+import importlib
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_timings_lock = threading.Lock()
+_timings = {}  # component -> milliseconds spent importing or initializing it
+
+
+def record_timing(component, started):
+    """Record the time since started (a time.perf_counter() value) under component."""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    with _timings_lock:
+        _timings[component] = round(elapsed_ms, 2)
+    logger.info(f"Startup: {component} took {elapsed_ms:.1f}ms")
+
+
+@contextmanager
+def timed(component):
+    """Record how long the block takes under component in startup_timings()."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(component, started)
+
+
+def startup_timings():
+    with _timings_lock:
+        return dict(_timings)
+
+
+class LazyResource:
+    """
+    A process-wide singleton built by factory() on first use.
+
+    get() is thread-safe: concurrent first callers wait for a single
+    initialization instead of each building their own client. A failed
+    factory is retried on the next get().
+    """
+
+    def __init__(self, name, factory, kind='init'):
+        self.name = name
+        self._factory = factory
+        self._kind = kind
+        self._lock = threading.Lock()
+        self._value = None
+        self._initialized = False
+
+    @property
+    def initialized(self):
+        return self._initialized
+
+    def get(self):
+        if self._initialized:
+            return self._value
+        with self._lock:
+            if not self._initialized:
+                with timed(f"{self._kind}:{self.name}"):
+                    self._value = self._factory()
+                self._initialized = True
+        return self._value
+
+
+class LazyProxy:
+    """
+    Stands in for the object a LazyResource builds, so module-level names
+    such as db and model keep working without initializing anything at
+    import time.
+    """
+
+    __slots__ = ('_resource',)
+
+    def __init__(self, resource):
+        object.__setattr__(self, '_resource', resource)
+
+    def __getattr__(self, name):
+        return getattr(self._resource.get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._resource.get(), name, value)
+
+    def __repr__(self):
+        state = 'initialized' if self._resource.initialized else 'not initialized'
+        return f"<lazy {self._resource.name} ({state})>"
+
+
+class LazyModule:
+    """A module imported on first attribute access, with its import time recorded."""
+
+    __slots__ = ('_resource',)
+
+    def __init__(self, module_name):
+        resource = LazyResource(module_name, lambda: importlib.import_module(module_name), kind='import')
+        object.__setattr__(self, '_resource', resource)
+
+    def __getattr__(self, name):
+        return getattr(self._resource.get(), name)
+
+    def __repr__(self):
+        return f"<lazy module {self._resource.name}>"
+
+
+def prewarm(*resources):
+    """Initialize resources now, e.g. from a health check before traffic arrives; returns failures."""
+    failures = {}
+    for resource in resources:
+        try:
+            resource.get()
+        except Exception as e:
+            logger.error(f"Prewarm of {resource.name} failed: {e}")
+            failures[resource.name] = str(e)
+    return failures
@@ -0,0 +1,120 @@
+import json
+import re
+import threading
+
+SSE_MIMETYPE = 'text/event-stream'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+STREAM_HEADERS = {
+    'Cache-Control': 'no-cache',
+    # Stop Cloud Run / nginx front ends from buffering the stream
+    'X-Accel-Buffering': 'no'
+}
+
+
+def sse_event(event, data):
+    """One Server-Sent Events frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def ndjson_event(event, data):
+    """One JSON-lines frame, for clients that can't consume SSE."""
+    return json.dumps({'event': event, **data}, default=str) + "\n"
+
+
+class StreamStats:
+    """Outcome, time-to-first-byte and token counters for one streaming endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.cancelled = 0
+        self.errors = 0
+        self.ttfb_count = 0
+        self.ttfb_total_ms = 0.0
+        self.ttfb_max_ms = 0.0
+        self.output_tokens = 0
+
+    def record(self, status, ttfb_ms, output_tokens):
+        with self._lock:
+            if status == 'completed':
+                self.completed += 1
+            elif status == 'cancelled':
+                self.cancelled += 1
+            else:
+                self.errors += 1
+            if ttfb_ms is not None:
+                self.ttfb_count += 1
+                self.ttfb_total_ms += ttfb_ms
+                self.ttfb_max_ms = max(self.ttfb_max_ms, ttfb_ms)
+            self.output_tokens += output_tokens
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'completed': self.completed,
+                'cancelled': self.cancelled,
+                'errors': self.errors,
+                'avg_ttfb_ms': (self.ttfb_total_ms / self.ttfb_count) if self.ttfb_count else 0.0,
+                'max_ttfb_ms': self.ttfb_max_ms,
+                'output_tokens': self.output_tokens
+            }
+
+
+def negotiate_stream_format(accept_header):
+    """Pick (formatter, mimetype) from the Accept header; SSE unless NDJSON is asked for."""
+    if accept_header and NDJSON_MIMETYPE in accept_header:
+        return ndjson_event, NDJSON_MIMETYPE
+    return sse_event, SSE_MIMETYPE
+
+
+LESSON_PLAN_SECTIONS = [
+    ('introduction', 'introduction'),
+    ('key_concepts', 'key concepts?'),
+    ('guided_practice', 'guided practice'),
+    ('assessment', 'assessment|quiz'),
+    ('conclusion', 'conclusion')
+]
+
+_SECTION_HEADING_RE = re.compile(
+    r'^[\s#*>\-]*(?:\d+[.)]\s*)?[*_]*(' +
+    '|'.join(f'(?P<{name}>{pattern})' for name, pattern in LESSON_PLAN_SECTIONS) +
+    r')\b',
+    re.IGNORECASE
+)
+
+
+class SectionTracker:
+    """
+    Spots lesson-plan section headings in streamed text. Chunks split lines
+    arbitrarily, so text is buffered up to the last newline before matching.
+    Each section is reported once, with the character offset in the full
+    text where its heading line starts.
+    """
+
+    def __init__(self):
+        self._partial_line = ''
+        self._line_start = 0
+        self._seen = set()
+
+    def feed(self, text):
+        """Return (section, offset) pairs for headings completed by this chunk."""
+        lines = (self._partial_line + text).split('\n')
+        self._partial_line = lines.pop()
+        return self._match(lines)
+
+    def flush(self):
+        line, self._partial_line = self._partial_line, ''
+        return self._match([line]) if line else []
+
+    def _match(self, lines):
+        found = []
+        for line in lines:
+            match = _SECTION_HEADING_RE.match(line)
+            if match:
+                name = next(key for key, value in match.groupdict().items() if value)
+                if name not in self._seen:
+                    self._seen.add(name)
+                    found.append((name, self._line_start))
+            self._line_start += len(line) + 1
+        return found
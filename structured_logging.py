@@ -0,0 +1,154 @@
+import copy
+import json
+import logging
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from metrics import registry as metrics_registry
+
+DEFAULT_MAX_CHARS = 2000
+
+
+class truncated:
+    """
+    Defers str() of a payload until a log record is actually formatted, and
+    cuts the result to max_chars. Use with %-style arguments:
+
+        logger.debug("Lesson data: %s", truncated(lesson_data))
+    """
+
+    __slots__ = ('value', 'max_chars')
+
+    def __init__(self, value, max_chars=DEFAULT_MAX_CHARS):
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self):
+        return truncate_text(str(self.value), self.max_chars)
+
+    __repr__ = __str__
+
+
+def truncate_text(text, max_chars=DEFAULT_MAX_CHARS):
+    if max_chars and len(text) > max_chars:
+        return f"{text[:max_chars]}... [{len(text) - max_chars} more chars]"
+    return text
+
+
+def sample_rates_from_env(value):
+    """Parse '/ai-tutor=0.1,/health=0,default=1' into {route: rate}."""
+    rates = {}
+    for item in (value or '').split(','):
+        route, sep, rate = item.strip().rpartition('=')
+        if sep and route:
+            rates[route] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class RouteSampler(logging.Filter):
+    """
+    Keeps only a fraction of records below WARNING per route, so chatty
+    endpoints can stay at INFO without flooding the log. Warnings and
+    errors always pass. The route comes from the current request trace.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+        self.default_rate = self.rates.pop('default', 1.0)
+
+    def filter(self, record):
+        trace = metrics_registry.current_trace()
+        route = trace.endpoint if trace is not None else None
+        record.route = route
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(route, self.default_rate)
+        return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, using the field names Cloud Logging recognizes."""
+
+    def __init__(self, max_chars=DEFAULT_MAX_CHARS):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'severity': record.levelname,
+            'logger': record.name,
+            'message': truncate_text(record.getMessage(), self.max_chars)
+        }
+        route = getattr(record, 'route', None)
+        if route:
+            entry['route'] = route
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update({key: truncate_text(value, self.max_chars) if isinstance(value, str) else value
+                          for key, value in fields.items()})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The original human-readable format, with long messages truncated."""
+
+    def __init__(self, max_chars=DEFAULT_MAX_CHARS):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        self.max_chars = max_chars
+
+    def formatMessage(self, record):
+        record.message = truncate_text(record.message, self.max_chars)
+        return super().formatMessage(record)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Merges the message and renders any traceback on the calling thread,
+    while args and exc_info still refer to live objects, and leaves all
+    other formatting to the listener.
+    """
+
+    _traceback_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = self._traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(level='INFO', json_output=True, sample_rates=None, max_chars=DEFAULT_MAX_CHARS,
+                      stream=None):
+    """
+    Route all logging through a queue: the request thread only filters the
+    record and merges its message, while a listener thread formats it and
+    writes it out. Returns the QueueListener; call stop() at exit to flush.
+    """
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter(max_chars) if json_output else TextFormatter(max_chars))
+
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    # Also tags records with their route, which the listener thread cannot see
+    handler.addFilter(RouteSampler(sample_rates or {}))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+    listener = QueueListener(records, output, respect_handler_level=True)
+    listener.start()
+    return listener
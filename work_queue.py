@@ -0,0 +1,286 @@
+import heapq
+import itertools
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class InProcessQueue:
+    """
+    Thread-safe job queue held in memory. Jobs are plain dicts; delayed jobs
+    (retries) become visible once their ready time has passed. Anything still
+    queued is lost when the process exits, so this is meant for development.
+    """
+
+    durable = False
+
+    def __init__(self, max_dead_letters=1000):
+        self._heap = []  # (ready_at, seq, job)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._dead_letters = deque(maxlen=max_dead_letters)
+
+    def put(self, job, delay=0):
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), job))
+            self._cond.notify()
+
+    def get_batch(self, max_items, timeout=None):
+        """Wait up to timeout seconds for ready jobs and return at most max_items of them."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    batch = []
+                    while self._heap and self._heap[0][0] <= now and len(batch) < max_items:
+                        batch.append(heapq.heappop(self._heap)[2])
+                    return batch
+                wait = None if deadline is None else deadline - now
+                if self._heap:
+                    next_ready = self._heap[0][0] - now
+                    wait = next_ready if wait is None else min(wait, next_ready)
+                if wait is not None and wait <= 0:
+                    return []
+                self._cond.wait(wait)
+
+    def ack(self, job):
+        pass
+
+    def dead_letter(self, job, error):
+        with self._cond:
+            self._dead_letters.append({'job': job, 'error': error, 'failed_at': time.time()})
+
+    def dead_letters(self):
+        with self._cond:
+            return list(self._dead_letters)
+
+    def size(self):
+        with self._cond:
+            return len(self._heap)
+
+
+class SQLiteQueue:
+    """
+    Durable job queue on a local SQLite file. Handed-out jobs are leased
+    rather than deleted, so a job whose worker dies before ack() is delivered
+    again once lease_seconds has passed.
+    """
+
+    durable = True
+
+    def __init__(self, path, lease_seconds=300, poll_interval=0.2):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, '
+            'ready_at REAL NOT NULL, leased_until REAL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (ready_at)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS dead_letters ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, '
+            'error TEXT, failed_at REAL NOT NULL)'
+        )
+
+    def put(self, job, delay=0):
+        job = dict(job)
+        job_id = job.pop('_id', None)
+        payload = json.dumps(job)
+        ready_at = time.time() + delay
+        with self._lock:
+            if job_id is None:
+                self._conn.execute(
+                    'INSERT INTO jobs (payload, ready_at) VALUES (?, ?)', (payload, ready_at)
+                )
+            else:
+                self._conn.execute(
+                    'UPDATE jobs SET payload = ?, ready_at = ?, leased_until = NULL WHERE id = ?',
+                    (payload, ready_at, job_id)
+                )
+
+    def _lease(self, max_items):
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._conn.execute(
+                    'SELECT id, payload FROM jobs WHERE ready_at <= ? '
+                    'AND (leased_until IS NULL OR leased_until <= ?) ORDER BY ready_at LIMIT ?',
+                    (now, now, max_items)
+                ).fetchall()
+                self._conn.executemany(
+                    'UPDATE jobs SET leased_until = ? WHERE id = ?',
+                    [(now + self.lease_seconds, row[0]) for row in rows]
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        batch = []
+        for job_id, payload in rows:
+            job = json.loads(payload)
+            job['_id'] = job_id
+            batch.append(job)
+        return batch
+
+    def get_batch(self, max_items, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            batch = self._lease(max_items)
+            if batch or (deadline is not None and time.monotonic() >= deadline):
+                return batch
+            time.sleep(self.poll_interval)
+
+    def ack(self, job):
+        with self._lock:
+            self._conn.execute('DELETE FROM jobs WHERE id = ?', (job['_id'],))
+
+    def dead_letter(self, job, error):
+        job = dict(job)
+        job_id = job.pop('_id', None)
+        with self._lock:
+            if job_id is not None:
+                self._conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+            self._conn.execute(
+                'INSERT INTO dead_letters (payload, error, failed_at) VALUES (?, ?, ?)',
+                (json.dumps(job), error, time.time())
+            )
+
+    def dead_letters(self):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT payload, error, failed_at FROM dead_letters ORDER BY id'
+            ).fetchall()
+        return [{'job': json.loads(payload), 'error': error, 'failed_at': failed_at}
+                for payload, error, failed_at in rows]
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+
+
+def create_work_queue(kind, **options):
+    """Build a queue from its name: 'memory' or 'sqlite'."""
+    kind = (kind or 'memory').lower()
+    if kind == 'memory':
+        return InProcessQueue(**options)
+    if kind == 'sqlite':
+        return SQLiteQueue(**options)
+    raise ValueError(f"Unknown work queue backend: {kind}")
+
+
+class WorkerPool:
+    """
+    Background threads that drain a queue in batches.
+
+    handler(jobs) processes a batch and returns the jobs that failed (or None
+    when all succeeded); raising fails the whole batch. Failed jobs are
+    retried with jittered exponential backoff and dead-lettered after
+    max_attempts.
+    """
+
+    def __init__(self, queue, handler, workers=2, batch_size=10, max_attempts=5,
+                 base_delay=1.0, max_delay=60.0, name='worker'):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.name = name
+        self._threads = []
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"{self.name}-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Started {self.workers} {self.name} workers")
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+    def submit(self, job):
+        """Enqueue a job, starting the workers on first use."""
+        job.setdefault('attempts', 0)
+        self.queue.put(job)
+        if not self._threads:
+            self.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                jobs = self.queue.get_batch(self.batch_size, timeout=0.5)
+            except Exception as e:
+                logger.error(f"{self.name}: failed to read from queue: {e}")
+                time.sleep(1)
+                continue
+            if jobs:
+                self._process(jobs)
+
+    def _process(self, jobs):
+        try:
+            failed = self.handler(jobs) or []
+            error = 'handler reported failure'
+        except Exception as e:
+            logger.error(f"{self.name}: batch of {len(jobs)} failed: {e}", exc_info=True)
+            failed = jobs
+            error = str(e)
+
+        failed_ids = {id(job) for job in failed}
+        succeeded = [job for job in jobs if id(job) not in failed_ids]
+        for job in succeeded:
+            self.queue.ack(job)
+        for job in failed:
+            self._retry(job, error)
+        with self._lock:
+            self.processed += len(succeeded)
+
+    def _retry(self, job, error):
+        job['attempts'] = job.get('attempts', 0) + 1
+        if job['attempts'] >= self.max_attempts:
+            logger.error(f"{self.name}: dead-lettering job after {job['attempts']} attempts: {error}")
+            self.queue.dead_letter(job, error)
+            with self._lock:
+                self.dead_lettered += 1
+            return
+        delay = min(self.max_delay, self.base_delay * 2 ** (job['attempts'] - 1))
+        self.queue.put(job, delay=random.uniform(delay / 2, delay))
+        with self._lock:
+            self.retried += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': len(self._threads),
+                'queued': self.queue.size(),
+                'processed': self.processed,
+                'retried': self.retried,
+                'dead_lettered': self.dead_lettered
+            }